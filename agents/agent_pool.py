@@ -0,0 +1,107 @@
+"""
+Agent Pool
+Builds every pipeline agent once per process and shares them across requests
+"""
+
+import threading
+import time
+
+from agents.detection import ImageDetectionAgent
+from agents.diagnostic_router import DiagnosticRouter
+from agents.reasoning import ReasoningAgent
+from agents.treatment import TreatmentAgent
+from agents.followup import FollowUpAgent
+
+
+class AgentPool:
+    """
+    Warm, thread-safe set of pipeline agents
+
+    Agents hold no per-request state, so one instance of each can serve every
+    request thread. The pool is built once (at server startup via warm_up(),
+    or lazily on first use) under a lock so concurrent requests never build
+    a second copy.
+    """
+
+    def __init__(self):
+        self.detection_agent = None
+        self.diagnostic_router = None
+        self.reasoning_agent = None
+        self.treatment_agent = None
+        self.followup_agent = None
+        self.warmup_report = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_warm(self) -> bool:
+        """Whether the agents have been built"""
+        return self.warmup_report is not None
+
+    def warm_up(self) -> dict:
+        """
+        Build all agents, timing each one
+
+        Returns:
+            dict with keys:
+                - agents: Seconds spent building each agent
+                - total_seconds: Total warm-up time
+        """
+        if self.is_warm:
+            return self.warmup_report
+
+        with self._lock:
+            if self.is_warm:
+                return self.warmup_report
+
+            timings = {}
+            start = time.perf_counter()
+
+            for attr, factory in [
+                ('detection_agent', ImageDetectionAgent),
+                ('diagnostic_router', DiagnosticRouter),
+                ('reasoning_agent', ReasoningAgent),
+                ('treatment_agent', TreatmentAgent),
+                ('followup_agent', FollowUpAgent),
+            ]:
+                agent_start = time.perf_counter()
+                setattr(self, attr, factory())
+                timings[attr] = round(time.perf_counter() - agent_start, 4)
+
+            self.warmup_report = {
+                'agents': timings,
+                'total_seconds': round(time.perf_counter() - start, 4)
+            }
+
+        return self.warmup_report
+
+    def get(self) -> 'AgentPool':
+        """Return the warmed-up pool, building it on first use"""
+        if not self.is_warm:
+            self.warm_up()
+        return self
+
+    def print_report(self):
+        """Print the warm-up timing report"""
+        if not self.is_warm:
+            print("[Agent Pool] Not warmed up yet")
+            return
+
+        print(f"[Agent Pool] Warm-up completed in {self.warmup_report['total_seconds'] * 1000:.1f} ms")
+        for name, seconds in self.warmup_report['agents'].items():
+            print(f"[Agent Pool]   {name:<20} {seconds * 1000:8.1f} ms")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_agent_pool() -> AgentPool:
+    """Get the process-wide agent pool"""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = AgentPool()
+
+    return _pool
@@ -0,0 +1,240 @@
+"""
+LLM Call Policies
+Per-agent timeouts, retries with jittered exponential backoff, and hedged
+requests for latency-critical agents
+"""
+
+import asyncio
+import os
+import random
+import threading
+from collections import deque
+
+from openai import APIConnectionError, InternalServerError
+
+# Errors worth another attempt; rate limiting (429) is handled by the
+# rate limiter underneath the policy
+TRANSIENT_ERRORS = (asyncio.TimeoutError, APIConnectionError, InternalServerError)
+
+
+class CallPolicy:
+    """
+    Timeout, retry and hedging settings for one agent's LLM calls
+
+    Hedging: when an attempt has not finished after the policy's recent
+    p95 latency, a duplicate request is sent and whichever finishes first
+    wins; the other is cancelled. Hedges go through the rate limiter like
+    any other call, so they never push an agent past the provider quota.
+    """
+
+    # Latency samples kept for the p95 estimate
+    WINDOW = 200
+    # Samples required before hedging kicks in
+    MIN_SAMPLES = 20
+
+    def __init__(self, name: str, timeout: float = 30.0, retries: int = 2,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 hedge: bool = False, hedge_percentile: float = 0.95,
+                 hedge_min_delay: float = 0.5):
+        """
+        Args:
+            name: Agent/policy name used in logs and counters
+            timeout: Seconds allowed per attempt
+            retries: Extra attempts after a transient failure
+            backoff_base: First retry delay in seconds (doubled per retry)
+            backoff_cap: Upper bound on a single retry delay
+            hedge: Send a duplicate request when an attempt runs long
+            hedge_percentile: Latency percentile that triggers the hedge
+            hedge_min_delay: Never hedge earlier than this many seconds
+        """
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+
+        self._latencies = deque(maxlen=self.WINDOW)
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def observe(self, seconds: float):
+        """Record the latency of a successful request"""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Seconds to wait before hedging, or None when hedging is off or
+        there are not enough samples yet
+        """
+        if not self.hedge:
+            return None
+
+        with self._lock:
+            if len(self._latencies) < self.MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+        return max(self.hedge_min_delay, ordered[index])
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for a zero-based retry attempt"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    async def run(self, attempt_factory):
+        """
+        Run a call under this policy
+
+        Args:
+            attempt_factory: Zero-argument coroutine function performing one
+                request (bounded by self.timeout); called again for every
+                retry and hedge
+
+        Returns:
+            The first successful attempt's result
+
+        Raises:
+            The last error once retries are exhausted, or immediately for
+            non-transient errors
+        """
+        with self._lock:
+            self.calls += 1
+
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(attempt_factory)
+            except TRANSIENT_ERRORS as e:
+                with self._lock:
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.timeouts += 1
+                    if attempt >= self.retries:
+                        self.failures += 1
+                        raise
+                    self.retried += 1
+                delay = self.backoff(attempt)
+                print(f"[Call Policy] {self.name}: {type(e).__name__}, retry {attempt + 1}/{self.retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                raise
+
+    async def _hedged(self, attempt_factory):
+        """One attempt, plus a hedge if it outlives the hedge delay"""
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(attempt_factory())
+
+        if delay is None:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                with self._lock:
+                    self.hedges_sent += 1
+                hedge = asyncio.ensure_future(attempt_factory())
+                tasks.add(hedge)
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            with self._lock:
+                                self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """Counters and the current hedge delay"""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retried,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "hedges_sent": self.hedges_sent,
+                "hedges_won": self.hedges_won,
+                "hedge_delay": round(delay, 3) if delay is not None else None
+            }
+
+
+# Detection gates the whole pipeline, so it gets a tight timeout and
+# hedging; follow-up planning is off the critical path and can wait
+DEFAULT_POLICIES = {
+    "default": {"timeout": 30.0, "retries": 2, "hedge": False},
+    "detection": {"timeout": 15.0, "retries": 2, "hedge": True},
+    "diagnostic": {"timeout": 30.0, "retries": 2, "hedge": False},
+    "reasoning": {"timeout": 30.0, "retries": 2, "hedge": False},
+    "treatment": {"timeout": 30.0, "retries": 2, "hedge": False},
+    "followup": {"timeout": 60.0, "retries": 3, "hedge": False}
+}
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def _policy_settings(name: str) -> dict:
+    """Defaults for a policy, overridden by LLM_POLICY_<NAME>_* variables"""
+    settings = dict(DEFAULT_POLICIES.get(name, DEFAULT_POLICIES["default"]))
+    prefix = f"LLM_POLICY_{name.upper()}_"
+
+    for key, cast in (("timeout", float), ("retries", int)):
+        value = os.getenv(prefix + key.upper())
+        if value:
+            try:
+                settings[key] = cast(value)
+            except ValueError:
+                pass
+
+    hedge = os.getenv(prefix + "HEDGE")
+    if hedge:
+        settings["hedge"] = hedge.lower() == "true"
+
+    return settings
+
+
+def get_call_policy(name: str = "default") -> CallPolicy:
+    """
+    Get the process-wide call policy for an agent
+
+    Each setting can be overridden through the environment, e.g.:
+        LLM_POLICY_DETECTION_TIMEOUT   - Seconds per attempt
+        LLM_POLICY_DETECTION_RETRIES   - Retries after a transient error
+        LLM_POLICY_DETECTION_HEDGE     - 'true'/'false' to toggle hedging
+    """
+    policy = _policies.get(name)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(name)
+            if policy is None:
+                policy = CallPolicy(name, **_policy_settings(name))
+                _policies[name] = policy
+
+    return policy
+
+
+def policy_stats() -> dict:
+    """Counters for every policy used so far"""
+    with _policies_lock:
+        policies = dict(_policies)
+    return {name: policy.stats() for name, policy in policies.items()}
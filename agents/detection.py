@@ -5,10 +5,13 @@ This agent routes images to specialized diagnostic agents.
 """
 
 import os
-import json
-from openai import AzureOpenAI, OpenAI
 from dotenv import load_dotenv
 
+from agents.event_loop import run_sync
+from agents.keyword_rules import get_keyword_rules
+from agents.llm_client import acomplete_json, get_client, get_model_name, note_mock_response
+from agents.metrics import metrics
+
 load_dotenv()
 
 
@@ -17,57 +20,9 @@ class ImageDetectionAgent:
     
     def __init__(self):
         """Initialize the Image Detection Agent"""
-        self.client = self._initialize_client()
-        self.model = self._get_model_name()
-    
-    def _initialize_client(self):
-        """Initialize OpenAI client with GitHub Models, Azure, or OpenAI fallback"""
-        
-        # Try GitHub Models first (FREE for hackathons!)
-        github_token = os.getenv('GITHUB_TOKEN')
-        if github_token:
-            print(f"[Detection Agent] Using GitHub Models (token: {github_token[:10]}...)")
-            return OpenAI(
-                base_url="https://models.inference.ai.azure.com",
-                api_key=github_token
-            )
-        
-        # Try Azure OpenAI
-        azure_key = os.getenv('AZURE_OPENAI_KEY')
-        if azure_key:
-            print("[Detection Agent] Using Azure OpenAI")
-            return AzureOpenAI(
-                api_key=azure_key,
-                api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),
-                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT')
-            )
-        
-        # Try OpenAI
-        openai_key = os.getenv('OPENAI_API_KEY')
-        if openai_key:
-            print("[Detection Agent] Using OpenAI")
-            return OpenAI(api_key=openai_key)
-        
-        # No API keys - will use mock mode
-        print("[Detection Agent] No API keys found - using mock mode")
-        return None
-    
-    def _get_model_name(self):
-        """Get the appropriate model name based on the client"""
-        if self.client is None:
-            return None
-        
-        # GitHub Models uses gpt-4o-mini
-        if "github" in os.getenv('GITHUB_TOKEN', '').lower() or \
-           os.getenv('USE_GITHUB_MODELS', '').lower() == 'true':
-            return "gpt-4o-mini"
-        
-        # Azure uses deployment name
-        if os.getenv('AZURE_OPENAI_DEPLOYMENT'):
-            return os.getenv('AZURE_OPENAI_DEPLOYMENT')
-        
-        # OpenAI
-        return os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        self.client = get_client()
+        self.model = get_model_name()
+        self.rules = get_keyword_rules()
     
     def detect_image_type(self, image_path: str, condition: str = "") -> dict:
         """
@@ -85,6 +40,10 @@ class ImageDetectionAgent:
                 - imaging_modality: X-ray, CT, MRI, photograph, etc.
                 - reasoning: Why this classification was made
         """
+        return run_sync(self.adetect_image_type(image_path, condition))
+    
+    async def adetect_image_type(self, image_path: str, condition: str = "") -> dict:
+        """Async version of detect_image_type()"""
         print(f"[Detection Agent] Analyzing image: {image_path}")
         if condition:
             print(f"[Detection Agent] Patient condition: {condition}")
@@ -100,14 +59,15 @@ class ImageDetectionAgent:
         
         # Use AI to detect image type
         try:
-            result = self._ai_detection(image_path, condition)
+            result = await self._ai_detection(image_path, condition)
             print(f"[Detection Agent] Detected: {result['image_type']} (Confidence: {result['confidence']})")
             return result
         except Exception as e:
             print(f"[Detection Agent] AI detection failed: {e}, using mock detection")
+            metrics.inc("agent_fallbacks_total", agent="detection")
             return self._mock_detection(image_path, condition)
     
-    def _ai_detection(self, image_path: str, condition: str) -> dict:
+    async def _ai_detection(self, image_path: str, condition: str) -> dict:
         """Use AI to detect image type"""
         
         # For now, we'll use text-based detection based on filename and condition
@@ -137,86 +97,24 @@ Respond ONLY with valid JSON in this exact format:
     "reasoning": "brief explanation of classification"
 }}"""
         
-        response = self.client.chat.completions.create(
+        return await acomplete_json(
             model=self.model,
             messages=[
                 {"role": "system", "content": "You are a medical imaging classification expert. Always respond with valid JSON only."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
-            max_tokens=300
+            max_tokens=300,
+            policy="detection",
+            required=("image_type", "confidence")
         )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON response
-        # Remove markdown code blocks if present
-        if result_text.startswith('```'):
-            result_text = result_text.split('```')[1]
-            if result_text.startswith('json'):
-                result_text = result_text[4:]
-        
-        result = json.loads(result_text)
-        return result
     
     def _mock_detection(self, image_path: str, condition: str) -> dict:
         """Mock detection based on filename and condition keywords"""
-        
-        filename = os.path.basename(image_path).lower()
-        condition_lower = condition.lower() if condition else ""
-        
-        # Dental detection
-        if any(word in filename for word in ['tooth', 'teeth', 'dental', 'molar', 'cavity']) or \
-           any(word in condition_lower for word in ['tooth', 'teeth', 'dental', 'cavity', 'gum', 'molar']):
-            return {
-                "image_type": "dental",
-                "confidence": "high",
-                "body_part": "teeth/oral cavity",
-                "imaging_modality": "X-ray or photograph",
-                "reasoning": "Filename or condition indicates dental imaging"
-            }
-        
-        # Chest X-ray detection
-        if any(word in filename for word in ['chest', 'lung', 'thorax', 'respiratory']) or \
-           any(word in condition_lower for word in ['chest', 'lung', 'breathing', 'cough', 'respiratory', 'pneumonia']):
-            return {
-                "image_type": "chest_xray",
-                "confidence": "high",
-                "body_part": "chest/lungs",
-                "imaging_modality": "X-ray",
-                "reasoning": "Filename or condition indicates chest/lung imaging"
-            }
-        
-        # Brain scan detection
-        if any(word in filename for word in ['brain', 'head', 'skull', 'cranial', 'mri', 'ct']) or \
-           any(word in condition_lower for word in ['brain', 'head', 'headache', 'concussion', 'stroke', 'seizure']):
-            return {
-                "image_type": "brain_scan",
-                "confidence": "high",
-                "body_part": "brain/head",
-                "imaging_modality": "CT or MRI",
-                "reasoning": "Filename or condition indicates brain imaging"
-            }
-        
-        # Skin detection
-        if any(word in filename for word in ['skin', 'lesion', 'mole', 'rash', 'derma']) or \
-           any(word in condition_lower for word in ['skin', 'rash', 'lesion', 'mole', 'itch']):
-            return {
-                "image_type": "skin",
-                "confidence": "high",
-                "body_part": "skin",
-                "imaging_modality": "photograph",
-                "reasoning": "Filename or condition indicates dermatology imaging"
-            }
-        
-        # Default to other
-        return {
-            "image_type": "other",
-            "confidence": "low",
-            "body_part": "unspecified",
-            "imaging_modality": "unknown",
-            "reasoning": "Could not determine specific image type from available information"
-        }
+        note_mock_response("detection")
+        return self.rules.match(
+            'detection', filename=os.path.basename(image_path), condition=condition
+        )
 
 
 def main():
@@ -0,0 +1,223 @@
+"""
+Diagnosis Events
+Runs the diagnostic pipeline for an uploaded image and turns its progress
+into the event payloads the API streams to clients (both /api/diagnose and
+/api/jobs run it as a background job)
+"""
+
+import os
+import time
+
+from agents.agent_pool import get_agent_pool
+from agents.pipeline import build_diagnostic_pipeline
+from agents.upload_store import get_upload_store
+
+# Plan follow-up care concurrently with the Treatment Agent
+EARLY_FOLLOWUP = os.getenv('PIPELINE_EARLY_FOLLOWUP', 'false').lower() == 'true'
+
+# Start treatment from the diagnosis while the Reasoning Agent is still explaining it
+SPECULATIVE_TREATMENT = os.getenv('PIPELINE_SPECULATIVE_TREATMENT', 'false').lower() == 'true'
+
+# Streamed agent text is batched into one step_delta per step per interval
+DELTA_INTERVAL = float(os.getenv('STREAM_DELTA_INTERVAL', '0.25'))
+
+STEP_START_MESSAGES = {
+    1: 'Detecting image type and body part...',
+    2: 'Routing to specialized diagnostic agent...',
+    3: 'Analyzing findings to generate diagnosis...',
+    4: 'Creating treatment plan...',
+    5: 'Generating follow-up care plan...'
+}
+
+
+def truncate(text, limit):
+    """Shorten long agent output for progress events"""
+    return text[:limit] + '...' if len(text) > limit else text
+
+
+def step_complete_event(stage, step, result, seconds=None):
+    """Build the step_complete payload for a finished pipeline stage"""
+    if stage == 'detection':
+        message = f"Detected: {result['image_type']} ({result['confidence']} confidence)"
+        summary = f"{result['image_type']} - {result['body_part']}"
+    elif stage == 'diagnostic':
+        message = f"Analysis complete using {result['agent_used']}"
+        summary = truncate(result['findings'], 200)
+    elif stage == 'reasoning':
+        message = f"Diagnosis: {result['diagnosis']}"
+        summary = f"{result['diagnosis']} (Confidence: {result['confidence']})"
+    elif stage == 'treatment':
+        message = 'Treatment plan generated'
+        summary = truncate(result['treatment'], 150)
+    else:
+        message = f"Follow-up timeline: {result.get('timeline', 'N/A')}"
+        summary = truncate(result['follow_up'], 150)
+
+    return {
+        'type': 'step_complete',
+        'step': step,
+        'message': message,
+        'result': summary,
+        'seconds': round(seconds, 3) if seconds is not None else None
+    }
+
+
+class DeltaBuffer:
+    """Batches a step's streamed text so the job event log isn't filled token by token"""
+
+    def __init__(self, interval: float = DELTA_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+
+    def add(self, event):
+        """Buffer a pipeline step_delta event"""
+        pending = self._pending.get(event['step'])
+        if pending is None or event['reset']:
+            self._pending[event['step']] = {
+                'type': 'step_delta',
+                'step': event['step'],
+                'text': event['text'],
+                'reset': event['reset']
+            }
+        else:
+            pending['text'] += event['text']
+
+    def due(self) -> bool:
+        return bool(self._pending) and time.monotonic() - self._flushed_at >= self.interval
+
+    def flush(self):
+        """Return the buffered step_delta events, one per step"""
+        events = list(self._pending.values())
+        self._pending.clear()
+        self._flushed_at = time.monotonic()
+        return events
+
+
+def build_api_report(results: dict, condition: str, filename: str,
+                     image_digest: str = None, image_format: str = None) -> dict:
+    """
+    Aggregate pipeline stage results into the report returned by the API
+
+    Args:
+        results: Stage results from the diagnostic pipeline
+        condition: Patient's condition description
+        filename: Name of the uploaded image
+        image_digest: SHA-256 of the image
+        image_format: Format sniffed from the image's magic bytes
+
+    Returns:
+        dict: Final report
+    """
+    detection_info = results['detection']
+    diagnostic_result = results['diagnostic']
+    reasoning_output = results['reasoning']
+    treatment_output = results['treatment']
+    followup_output = results['followup']
+
+    return {
+        "timestamp": detection_info.get('timestamp', ''),
+        "patient_condition": condition,
+        "image_analyzed": filename,
+        "image_sha256": image_digest,
+        "image_format": image_format,
+        "image_type": detection_info.get("image_type"),
+        "body_part": detection_info.get("body_part"),
+        "imaging_modality": detection_info.get("imaging_modality"),
+        "detection_confidence": detection_info.get("confidence"),
+        "finding": diagnostic_result['findings'],
+        "diagnosis": reasoning_output.get("diagnosis"),
+        "confidence": reasoning_output.get("confidence"),
+        "treatment": treatment_output.get("treatment"),
+        "precautions": treatment_output.get("precautions", []),
+        "follow_up": followup_output.get("follow_up"),
+        "timeline": followup_output.get("timeline"),
+        "patient_instructions": followup_output.get("patient_instructions"),
+        "agent_workflow": {
+            "step_1": "Image Detection Agent",
+            "step_2": diagnostic_result.get('agent_used', 'Diagnostic Agent'),
+            "step_3": "Clinical Reasoning Agent",
+            "step_4": "Treatment Agent",
+            "step_5": "Follow-Up Agent"
+        }
+    }
+
+
+def diagnosis_events(image_path: str, image_digest: str, filename: str, condition: str,
+                     patient_email: str = None, image_format: str = None):
+    """
+    Run the diagnostic pipeline and yield its progress as API events
+
+    Yields:
+        dict events: step_start, step_delta (streamed agent text, batched)
+        and step_complete per stage, then either {'type': 'complete',
+        'report'} or {'type': 'error', 'message'}
+    """
+    try:
+        # Reuse the warm agents built at startup
+        pipeline = build_diagnostic_pipeline(
+            get_agent_pool().get(), early_followup=EARLY_FOLLOWUP,
+            speculative_treatment=SPECULATIVE_TREATMENT
+        )
+        context = {
+            'image_path': image_path,
+            'condition': condition,
+            'patient_email': patient_email,
+            'image_digest': image_digest
+        }
+
+        deltas = DeltaBuffer()
+
+        # Stages run as soon as their inputs are ready
+        for event in pipeline.stream(context, deltas=True):
+            if event['type'] == 'step_delta':
+                deltas.add(event)
+                if deltas.due():
+                    yield from deltas.flush()
+                continue
+
+            # Streamed text always arrives before the step's other events
+            yield from deltas.flush()
+            if event['type'] == 'step_start':
+                yield {
+                    'type': 'step_start',
+                    'step': event['step'],
+                    'message': STEP_START_MESSAGES[event['step']]
+                }
+            elif event['type'] == 'step_complete':
+                yield step_complete_event(event['stage'], event['step'], event['result'], event['seconds'])
+            else:
+                results = event['results']
+
+        yield {
+            'type': 'complete',
+            'report': build_api_report(results, condition, filename, image_digest, image_format)
+        }
+
+    except Exception as e:
+        yield {
+            'type': 'error',
+            'message': str(e)
+        }
+
+
+def run_diagnosis_job(payload: dict, publish):
+    """
+    Job handler for queued diagnoses
+
+    Runs the pipeline for a job enqueued by POST /api/jobs, publishing
+    every event, then frees the upload reference the job owns.
+
+    Args:
+        payload: image_path, image_digest, filename, condition,
+            patient_email and image_format
+        publish: Callable receiving each event dict
+    """
+    try:
+        for event in diagnosis_events(
+            payload['image_path'], payload['image_digest'], payload['filename'],
+            payload['condition'], payload.get('patient_email'), payload.get('image_format')
+        ):
+            publish(event)
+    finally:
+        get_upload_store().release_path(payload['image_path'], payload['image_digest'])
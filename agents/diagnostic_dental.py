@@ -4,9 +4,13 @@ Specialized agent for analyzing dental images and conditions
 """
 
 import os
-from openai import AzureOpenAI, OpenAI
 from dotenv import load_dotenv
 
+from agents.event_loop import run_sync
+from agents.keyword_rules import get_keyword_rules
+from agents.llm_client import acomplete_chat, get_client, get_model_name, note_mock_response
+from agents.metrics import metrics
+
 load_dotenv()
 
 
@@ -15,49 +19,9 @@ class DentalDiagnosticAgent:
     
     def __init__(self):
         """Initialize the Dental Diagnostic Agent"""
-        self.client = self._initialize_client()
-        self.model = self._get_model_name()
-    
-    def _initialize_client(self):
-        """Initialize OpenAI client"""
-        github_token = os.getenv('GITHUB_TOKEN')
-        if github_token:
-            print(f"[Dental Agent] Using GitHub Models (token: {github_token[:10]}...)")
-            return OpenAI(
-                base_url="https://models.inference.ai.azure.com",
-                api_key=github_token
-            )
-        
-        azure_key = os.getenv('AZURE_OPENAI_KEY')
-        if azure_key:
-            print("[Dental Agent] Using Azure OpenAI")
-            return AzureOpenAI(
-                api_key=azure_key,
-                api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),
-                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT')
-            )
-        
-        openai_key = os.getenv('OPENAI_API_KEY')
-        if openai_key:
-            print("[Dental Agent] Using OpenAI")
-            return OpenAI(api_key=openai_key)
-        
-        print("[Dental Agent] No API keys found - using mock mode")
-        return None
-    
-    def _get_model_name(self):
-        """Get the appropriate model name"""
-        if self.client is None:
-            return None
-        
-        if "github" in os.getenv('GITHUB_TOKEN', '').lower() or \
-           os.getenv('USE_GITHUB_MODELS', '').lower() == 'true':
-            return "gpt-4o-mini"
-        
-        if os.getenv('AZURE_OPENAI_DEPLOYMENT'):
-            return os.getenv('AZURE_OPENAI_DEPLOYMENT')
-        
-        return os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        self.client = get_client()
+        self.model = get_model_name()
+        self.rules = get_keyword_rules()
     
     def analyze(self, image_path: str, condition: str, detection_info: dict) -> str:
         """
@@ -71,6 +35,10 @@ class DentalDiagnosticAgent:
         Returns:
             Detailed findings from dental analysis
         """
+        return run_sync(self.aanalyze(image_path, condition, detection_info))
+    
+    async def aanalyze(self, image_path: str, condition: str, detection_info: dict) -> str:
+        """Async version of analyze()"""
         print(f"[Dental Agent] Analyzing dental image: {image_path}")
         print(f"[Dental Agent] Condition: {condition}")
         
@@ -82,12 +50,13 @@ class DentalDiagnosticAgent:
             return self._mock_analysis(condition)
         
         try:
-            return self._ai_analysis(condition, detection_info)
+            return await self._ai_analysis(condition, detection_info)
         except Exception as e:
             print(f"[Dental Agent] AI analysis failed: {e}, using mock analysis")
+            metrics.inc("agent_fallbacks_total", agent="diagnostic_dental")
             return self._mock_analysis(condition)
     
-    def _ai_analysis(self, condition: str, detection_info: dict) -> str:
+    async def _ai_analysis(self, condition: str, detection_info: dict) -> str:
         """Use AI for dental analysis"""
         
         prompt = f"""You are an expert dentist analyzing a dental image.
@@ -104,40 +73,21 @@ Based on the patient's symptoms, provide a detailed dental assessment including:
 
 Provide a concise, professional dental finding (2-3 sentences)."""
 
-        response = self.client.chat.completions.create(
+        return await acomplete_chat(
             model=self.model,
             messages=[
                 {"role": "system", "content": "You are an experienced dentist providing professional dental assessments."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
-            max_tokens=200
+            max_tokens=200,
+            policy="diagnostic"
         )
-        
-        return response.choices[0].message.content.strip()
     
     def _mock_analysis(self, condition: str) -> str:
         """Mock dental analysis based on condition keywords"""
-        condition_lower = condition.lower()
-        
-        # Cavity/decay
-        if any(word in condition_lower for word in ['pain', 'ache', 'hurt', 'sensitive']):
-            return "Possible dental caries (cavity) detected in upper molar region with visible decay. The affected tooth shows signs of enamel erosion and probable pulp involvement. Recommend immediate dental intervention."
-        
-        # Gum disease
-        if any(word in condition_lower for word in ['gum', 'bleed', 'swollen', 'red']):
-            return "Evidence of periodontal disease with gingival inflammation visible in multiple quadrants. Moderate plaque accumulation and possible bone loss detected. Recommend professional cleaning and periodontal evaluation."
-        
-        # Wisdom tooth
-        if any(word in condition_lower for word in ['wisdom', 'molar', 'back']):
-            return "Impacted third molar (wisdom tooth) identified with signs of pericoronitis. The tooth is partially erupted causing tissue inflammation and potential infection risk. Extraction may be necessary."
-        
-        # Abscess
-        if any(word in condition_lower for word in ['abscess', 'infection', 'pus', 'swelling']):
-            return "Periapical abscess detected at the root apex with surrounding bone resorption. Active infection present requiring urgent endodontic treatment or extraction. Antibiotic therapy recommended."
-        
-        # Default
-        return "Possible cavity detected in upper molar region with visible decay and enamel erosion. The affected tooth shows signs of demineralization. Recommend dental filling and fluoride treatment."
+        note_mock_response("diagnostic_dental")
+        return self.rules.match('dental_diagnostic', condition=condition)
 
 
 def main():
@@ -5,9 +5,13 @@ Handles diagnostic analysis for various medical image types
 """
 
 import os
-from openai import AzureOpenAI, OpenAI
 from dotenv import load_dotenv
 
+from agents.event_loop import run_sync
+from agents.keyword_rules import get_keyword_rules
+from agents.llm_client import acomplete_chat, get_client, get_model_name, note_mock_response
+from agents.metrics import metrics
+
 load_dotenv()
 
 
@@ -16,49 +20,9 @@ class GenericDiagnosticAgent:
     
     def __init__(self):
         """Initialize the Generic Diagnostic Agent"""
-        self.client = self._initialize_client()
-        self.model = self._get_model_name()
-    
-    def _initialize_client(self):
-        """Initialize OpenAI client"""
-        github_token = os.getenv('GITHUB_TOKEN')
-        if github_token:
-            print(f"[Generic Diagnostic Agent] Using GitHub Models (token: {github_token[:10]}...)")
-            return OpenAI(
-                base_url="https://models.inference.ai.azure.com",
-                api_key=github_token
-            )
-        
-        azure_key = os.getenv('AZURE_OPENAI_KEY')
-        if azure_key:
-            print("[Generic Diagnostic Agent] Using Azure OpenAI")
-            return AzureOpenAI(
-                api_key=azure_key,
-                api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),
-                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT')
-            )
-        
-        openai_key = os.getenv('OPENAI_API_KEY')
-        if openai_key:
-            print("[Generic Diagnostic Agent] Using OpenAI")
-            return OpenAI(api_key=openai_key)
-        
-        print("[Generic Diagnostic Agent] No API keys found - using mock mode")
-        return None
-    
-    def _get_model_name(self):
-        """Get the appropriate model name"""
-        if self.client is None:
-            return None
-        
-        if "github" in os.getenv('GITHUB_TOKEN', '').lower() or \
-           os.getenv('USE_GITHUB_MODELS', '').lower() == 'true':
-            return "gpt-4o-mini"
-        
-        if os.getenv('AZURE_OPENAI_DEPLOYMENT'):
-            return os.getenv('AZURE_OPENAI_DEPLOYMENT')
-        
-        return os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        self.client = get_client()
+        self.model = get_model_name()
+        self.rules = get_keyword_rules()
     
     def analyze(self, image_path: str, condition: str, detection_info: dict) -> str:
         """
@@ -72,6 +36,10 @@ class GenericDiagnosticAgent:
         Returns:
             Detailed findings from analysis
         """
+        return run_sync(self.aanalyze(image_path, condition, detection_info))
+    
+    async def aanalyze(self, image_path: str, condition: str, detection_info: dict) -> str:
+        """Async version of analyze()"""
         image_type = detection_info.get('image_type', 'unknown')
         body_part = detection_info.get('body_part', 'unspecified')
         
@@ -87,12 +55,13 @@ class GenericDiagnosticAgent:
             return self._mock_analysis(condition, image_type, body_part)
         
         try:
-            return self._ai_analysis(condition, detection_info)
+            return await self._ai_analysis(condition, detection_info)
         except Exception as e:
             print(f"[Generic Diagnostic Agent] AI analysis failed: {e}, using mock analysis")
+            metrics.inc("agent_fallbacks_total", agent="diagnostic_generic")
             return self._mock_analysis(condition, image_type, body_part)
     
-    def _ai_analysis(self, condition: str, detection_info: dict) -> str:
+    async def _ai_analysis(self, condition: str, detection_info: dict) -> str:
         """Use AI for medical image analysis"""
         
         image_type = detection_info.get('image_type', 'medical image')
@@ -113,52 +82,25 @@ Based on the patient's symptoms and image type, provide a detailed medical asses
 
 Provide a concise, professional medical finding (2-3 sentences)."""
 
-        response = self.client.chat.completions.create(
+        return await acomplete_chat(
             model=self.model,
             messages=[
                 {"role": "system", "content": f"You are an experienced medical specialist in {image_type} interpretation."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
-            max_tokens=200
+            max_tokens=200,
+            policy="diagnostic"
         )
-        
-        return response.choices[0].message.content.strip()
     
     def _mock_analysis(self, condition: str, image_type: str, body_part: str) -> str:
         """Mock analysis based on image type and condition"""
-        condition_lower = condition.lower()
-        
-        # Brain scan
-        if image_type == 'brain_scan':
-            if any(word in condition_lower for word in ['headache', 'migraine', 'head pain']):
-                return "Brain CT scan shows no acute intracranial hemorrhage or mass effect. Mild periventricular white matter changes consistent with chronic microvascular ischemia. Ventricles and sulci appear age-appropriate. Consider MRI for further evaluation if symptoms persist."
-            elif any(word in condition_lower for word in ['stroke', 'weakness', 'numbness']):
-                return "MRI demonstrates acute infarction in the left middle cerebral artery territory with restricted diffusion. No hemorrhagic transformation noted. Moderate mass effect with slight midline shift. Urgent neurology consultation recommended for acute stroke management."
-            else:
-                return "Brain imaging reveals normal brain parenchyma without acute abnormality. No evidence of mass, hemorrhage, or infarction. Ventricles and sulci are within normal limits for patient age."
-        
-        # Skin imaging
-        elif image_type == 'skin':
-            if any(word in condition_lower for word in ['mole', 'lesion', 'spot']):
-                return "Dermatoscopic examination reveals asymmetric pigmented lesion with irregular borders and color variation. ABCDE criteria suggest possible melanoma. Lesion measures approximately 8mm in diameter. Urgent dermatology referral and biopsy recommended."
-            elif any(word in condition_lower for word in ['rash', 'itch', 'red']):
-                return "Clinical photograph shows erythematous maculopapular rash with geographic distribution. Appearance consistent with contact dermatitis or allergic reaction. No evidence of vesiculation or ulceration. Recommend topical corticosteroid and identification of allergen."
-            else:
-                return "Skin examination shows benign-appearing lesion without concerning features. Regular borders, uniform pigmentation, and symmetry present. Continue monitoring for any changes in size, shape, or color."
-        
-        # Bone X-ray
-        elif image_type == 'bone_xray':
-            if any(word in condition_lower for word in ['fracture', 'break', 'broken', 'fall']):
-                return "X-ray demonstrates oblique fracture of the distal radius with minimal displacement. No evidence of comminution or intra-articular extension. Adjacent soft tissue swelling noted. Recommend orthopedic evaluation for possible closed reduction and immobilization."
-            elif any(word in condition_lower for word in ['arthritis', 'joint pain', 'stiff']):
-                return "Radiographic findings show moderate degenerative joint disease with joint space narrowing, subchondral sclerosis, and marginal osteophyte formation. No acute fracture or dislocation. Findings consistent with osteoarthritis."
-            else:
-                return "Skeletal radiograph shows intact bony structures without acute fracture or dislocation. Normal bone density and alignment. Soft tissues appear unremarkable."
+        note_mock_response("diagnostic_generic")
+        if image_type in ('brain_scan', 'skin', 'bone_xray'):
+            return self.rules.match(f'{image_type}_diagnostic', condition=condition)
         
         # Default for other types
-        else:
-            return f"Medical imaging of {body_part} reviewed. Based on the patient's presentation with {condition}, findings suggest possible abnormality requiring clinical correlation. Recommend specialist consultation for comprehensive evaluation and management plan."
+        return f"Medical imaging of {body_part} reviewed. Based on the patient's presentation with {condition}, findings suggest possible abnormality requiring clinical correlation. Recommend specialist consultation for comprehensive evaluation and management plan."
 
 
 def main():
@@ -3,6 +3,7 @@ Diagnostic Router
 Routes images to specialized diagnostic agents based on detection results
 """
 
+from agents.event_loop import run_sync
 from agents.diagnostic_dental import DentalDiagnosticAgent
 from agents.diagnostic_chest import ChestXrayDiagnosticAgent
 from agents.diagnostic_generic import GenericDiagnosticAgent
@@ -34,6 +35,10 @@ class DiagnosticRouter:
                 - agent_used: Which agent performed the analysis
                 - detection_info: Original detection information
         """
+        return run_sync(self.aroute_and_analyze(image_path, condition, detection_info))
+    
+    async def aroute_and_analyze(self, image_path: str, condition: str, detection_info: dict) -> dict:
+        """Async version of route_and_analyze()"""
         image_type = detection_info.get('image_type', 'other')
         
         print(f"[Diagnostic Router] Routing {image_type} image to specialized agent")
@@ -53,7 +58,7 @@ class DiagnosticRouter:
         print(f"[Diagnostic Router] Using: {agent_name}")
         
         # Get analysis from specialized agent
-        findings = agent.analyze(image_path, condition, detection_info)
+        findings = await agent.aanalyze(image_path, condition, detection_info)
         
         return {
             'findings': findings,
@@ -0,0 +1,291 @@
+"""
+Email Delivery Engine
+Sends follow-up emails over a pool of persistent SMTP connections with
+bounded parallelism, a send-rate limit and retries for transient failures
+"""
+
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from agents.rate_limiter import TokenBucket
+
+
+class DeliveryResult:
+    """Outcome of one message"""
+
+    def __init__(self, key, sent: bool, code: int = None, detail: str = "", attempts: int = 1):
+        """
+        Args:
+            key: Caller's identifier for the message (e.g. patient ID)
+            sent: True once the server accepted the message
+            code: Last SMTP reply code, if any
+            detail: Server reply or error text
+            attempts: Delivery attempts made
+        """
+        self.key = key
+        self.sent = sent
+        self.code = code
+        self.detail = detail
+        self.attempts = attempts
+
+    def __repr__(self):
+        status = "sent" if self.sent else "failed"
+        return f"DeliveryResult({self.key!r}, {status}, code={self.code}, attempts={self.attempts})"
+
+
+class SMTPConnectionPool:
+    """
+    Pool of logged-in SMTP connections reused across many messages
+
+    Connections are opened lazily, handed out one per sending thread and
+    recycled after max_messages so long runs do not hit server-side
+    per-session limits.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: str = None, password: str = None,
+                 starttls: bool = True, use_ssl: bool = False, timeout: float = 30.0,
+                 size: int = 4, max_messages: int = 100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = size
+        self.max_messages = max_messages
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                conn.starttls()
+        conn.ehlo_or_helo_if_needed()
+        if self.username:
+            conn.login(self.username, self.password or "")
+        conn.sent_count = 0
+        self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection
+
+        A connection that raised is closed instead of being returned, so the
+        next borrower gets a fresh one.
+        """
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+
+            yield conn
+
+            conn.sent_count += 1
+            if conn.sent_count >= self.max_messages:
+                _quit(conn)
+            else:
+                self._idle.put(conn)
+            conn = None
+        finally:
+            if conn is not None:
+                _quit(conn)
+            self._slots.release()
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                _quit(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _quit(conn):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+
+
+class DeliveryEngine:
+    """
+    Parallel, rate-limited sender on top of an SMTPConnectionPool
+
+    4xx replies, dropped connections and socket errors are retried with
+    exponential backoff; 5xx replies fail the message immediately.
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, workers: int = None, rate_per_second: float = 0,
+                 retries: int = 3, backoff_base: float = 1.0):
+        """
+        Args:
+            pool: Connection pool to send through
+            workers: Messages sent in parallel (default: the pool size)
+            rate_per_second: Overall send-rate cap; 0 disables it
+            retries: Extra attempts after a transient failure
+            backoff_base: First retry delay in seconds (doubled per retry)
+        """
+        self.pool = pool
+        self.workers = workers or pool.size
+        self.rate = TokenBucket(rate_per_second * 60, capacity=max(1.0, rate_per_second))
+        self.retries = retries
+        self.backoff_base = backoff_base
+
+    def send_batch(self, messages: list, before_send=None, on_result=None) -> dict:
+        """
+        Send messages in parallel
+
+        Args:
+            messages: List of (key, email.message.EmailMessage) pairs
+            before_send: Optional callable(key) run before a message's first
+                attempt; a falsy return skips the message
+            on_result: Optional callable(DeliveryResult) run as soon as each
+                message is sent or has failed for good
+
+        Returns:
+            dict with results (DeliveryResult per message, in input order),
+            sent, failed, skipped, seconds and per_second
+        """
+        def deliver(item):
+            key, message = item
+            if before_send is not None and not before_send(key):
+                return DeliveryResult(key, False, None, "skipped", attempts=0)
+            result = self._deliver(key, message)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smtp") as executor:
+            results = list(executor.map(deliver, messages))
+
+        seconds = time.perf_counter() - start
+        sent = sum(1 for result in results if result.sent)
+        skipped = sum(1 for result in results if result.attempts == 0)
+        return {
+            'results': results,
+            'sent': sent,
+            'failed': len(results) - sent - skipped,
+            'skipped': skipped,
+            'seconds': round(seconds, 3),
+            'per_second': round(sent / seconds, 1) if seconds > 0 and sent else 0.0
+        }
+
+    def _deliver(self, key, message) -> DeliveryResult:
+        attempt = 0
+        while True:
+            attempt += 1
+            wait = self.rate.reserve(1)
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                with self.pool.connection() as conn:
+                    code, reply = self._send(conn, message)
+            # SMTPException subclasses OSError, so the SMTP cases go first.
+            # Replies (including AUTH and connect rejections) keep their code.
+            except smtplib.SMTPResponseException as e:
+                code, reply = e.smtp_code, e.smtp_error
+            except smtplib.SMTPServerDisconnected as e:
+                code, reply = None, str(e)
+            except smtplib.SMTPException as e:
+                return DeliveryResult(key, False, None, str(e), attempt)
+            except OSError as e:
+                code, reply = None, str(e)
+
+            if code == 250:
+                return DeliveryResult(key, True, code, "OK", attempt)
+            if (code is None or _transient(code)) and attempt <= self.retries:
+                self._backoff(attempt)
+                continue
+            return DeliveryResult(key, False, code, _text(reply), attempt)
+
+    @staticmethod
+    def _send(conn, message):
+        """
+        Send one message on a borrowed connection
+
+        Rejections smtplib recovers from with RSET leave the connection
+        usable, so they are returned as (code, reply) rather than raised.
+        Anything else propagates and the pool discards the connection.
+        """
+        try:
+            refused = conn.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            return next(iter(e.recipients.values()))
+        except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+            return e.smtp_code, e.smtp_error
+
+        if refused:
+            return next(iter(refused.values()))
+        return 250, "OK"
+
+    def _backoff(self, attempt: int):
+        time.sleep(self.backoff_base * (2 ** (attempt - 1)))
+
+    def close(self):
+        self.pool.close()
+
+
+def _transient(code) -> bool:
+    return code is not None and 400 <= code < 500
+
+
+def _text(reply) -> str:
+    return reply.decode('utf-8', errors='replace') if isinstance(reply, bytes) else str(reply)
+
+
+def get_delivery_engine():
+    """
+    Build a delivery engine from the environment, or None when SMTP is not
+    configured (emails are then printed to the console)
+
+    Configured through the environment:
+        SMTP_HOST                - SMTP server; unset keeps the console simulation
+        SMTP_PORT                - Port (default 587)
+        SMTP_USERNAME            - Login user (optional)
+        SMTP_PASSWORD            - Login password (optional)
+        SMTP_STARTTLS            - 'false' to skip STARTTLS (default true)
+        SMTP_SSL                 - 'true' for implicit TLS, e.g. port 465 (default false)
+        SMTP_TIMEOUT             - Socket timeout in seconds (default 30)
+        SMTP_POOL_SIZE           - Persistent connections / parallel sends (default 4)
+        SMTP_MAX_PER_CONNECTION  - Messages before a connection is recycled (default 100)
+        SMTP_RATE_PER_SECOND     - Send-rate cap, 0 = unlimited (default 0)
+        SMTP_RETRIES             - Retries for 4xx and connection errors (default 3)
+    """
+    host = os.getenv("SMTP_HOST")
+    if not host:
+        return None
+
+    pool = SMTPConnectionPool(
+        host,
+        port=int(os.getenv("SMTP_PORT", 587)),
+        username=os.getenv("SMTP_USERNAME") or None,
+        password=os.getenv("SMTP_PASSWORD") or None,
+        starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+        use_ssl=os.getenv("SMTP_SSL", "false").lower() == "true",
+        timeout=float(os.getenv("SMTP_TIMEOUT", 30)),
+        size=int(os.getenv("SMTP_POOL_SIZE", 4)),
+        max_messages=int(os.getenv("SMTP_MAX_PER_CONNECTION", 100))
+    )
+    return DeliveryEngine(
+        pool,
+        rate_per_second=float(os.getenv("SMTP_RATE_PER_SECOND", 0)),
+        retries=int(os.getenv("SMTP_RETRIES", 3))
+    )
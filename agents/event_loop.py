@@ -0,0 +1,54 @@
+"""
+Shared Event Loop
+Runs a single background asyncio loop that the synchronous agent API
+submits its coroutines to
+"""
+
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared background event loop, starting it on first use"""
+    global _loop
+
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="maiopinion-event-loop", daemon=True
+                )
+                thread.start()
+                _loop = loop
+
+    return _loop
+
+
+def run_sync(coro):
+    """
+    Run a coroutine on the shared event loop and block until it finishes
+
+    Lets synchronous callers (CLI, Flask request threads, worker threads)
+    use the async agent API. All of them share one loop, so they also
+    share the loop's async HTTP connection pool.
+
+    Raises:
+        RuntimeError: If called from the shared loop itself, where it would
+            deadlock; await the coroutine directly instead
+    """
+    loop = get_event_loop()
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync() called from the shared event loop; await the coroutine instead")
+
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
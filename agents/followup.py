@@ -4,15 +4,22 @@ Generates follow-up care plans and patient instructions
 Handles email preferences and patient data storage
 """
 
+import asyncio
 import json
 import os
-import csv
-import sys
 from datetime import datetime, timedelta
-from pathlib import Path
-from openai import AzureOpenAI, OpenAI
+from email.message import EmailMessage
 from dotenv import load_dotenv
 
+from agents.email_delivery import get_delivery_engine
+from agents.event_loop import run_sync
+from agents.keyword_rules import get_keyword_rules
+from agents.llm_client import acomplete_json, get_client, get_model_name, note_mock_response
+from agents.followup_scheduler import FollowUpScheduler
+from agents.metrics import metrics
+from agents.patient_ids import new_patient_id
+from agents.patient_store import get_patient_store
+
 # Load environment variables
 load_dotenv()
 
@@ -33,59 +40,17 @@ class FollowUpAgent:
     
     def __init__(self):
         self.name = "Follow-Up Agent"
-        self.client = self._initialize_client()
-        self.db_path = Path("patients_db.csv")
-        self._initialize_database()
-        
-    def _initialize_client(self):
-        """Initialize OpenAI client (GitHub Models, Azure OpenAI, or OpenAI)"""
-        # Try GitHub Models first - check both .env and system environment
-        github_token = os.getenv("GITHUB_TOKEN") or os.environ.get("GITHUB_TOKEN")
-        use_github = os.getenv("USE_GITHUB_MODELS", "false").lower() == "true"
-        
-        if github_token and use_github and github_token != "your_github_token_here":
-            print(f"[{self.name}] Using GitHub Models (token: {github_token[:10]}...)")
-            return OpenAI(
-                api_key=github_token,
-                base_url="https://models.inference.ai.azure.com"
-            )
-        
-        # Try Azure OpenAI
-        azure_key = os.getenv("AZURE_OPENAI_KEY")
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        
-        if azure_key and azure_endpoint:
-            print(f"[{self.name}] Using Azure OpenAI")
-            return AzureOpenAI(
-                api_key=azure_key,
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-                azure_endpoint=azure_endpoint
-            )
-        
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if openai_key:
-            print(f"[{self.name}] Using OpenAI")
-            return OpenAI(api_key=openai_key)
-        
-        print(f"[{self.name}] WARNING: No API keys found, using mock responses")
-        return None
-    
-    def _initialize_database(self):
-        """Initialize CSV database if it doesn't exist"""
-        if not self.db_path.exists():
-            with open(self.db_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'patient_id', 'timestamp', 'email', 'condition', 
-                    'diagnosis', 'treatment', 'follow_up_timeline', 
-                    'follow_up_date', 'email_sent', 'created_at'
-                ])
-            print(f"[{self.name}] Created patient database: {self.db_path}")
+        self.client = get_client()
+        self.model = get_model_name()
+        self.rules = get_keyword_rules()
+        self.store = get_patient_store()
+        self.delivery_engine = get_delivery_engine()
+        self.email_sender = os.getenv("SMTP_FROM", "noreply@maiopinion.com")
     
     def save_patient_data(self, patient_email: str, condition: str, diagnosis: str, 
                          treatment: str, follow_up_timeline: str) -> str:
         """
-        Save patient data to CSV database
+        Save patient data to the patient store
         
         Args:
             patient_email: Patient's email address
@@ -97,29 +62,26 @@ class FollowUpAgent:
         Returns:
             str: Generated patient ID
         """
-        # Generate patient ID
+        # Unique, time-ordered ID (safe under concurrent registrations)
         timestamp = datetime.now()
-        patient_id = f"PT{timestamp.strftime('%Y%m%d%H%M%S')}"
+        patient_id = new_patient_id()
         
         # Calculate follow-up date
         days = self._parse_timeline_days(follow_up_timeline)
         follow_up_date = (timestamp + timedelta(days=days)).strftime('%Y-%m-%d')
         
-        # Save to CSV
-        with open(self.db_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                patient_id,
-                timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                patient_email,
-                condition,
-                diagnosis,
-                treatment,
-                follow_up_timeline,
-                follow_up_date,
-                'No',  # email_sent
-                timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            ])
+        self.store.add({
+            'patient_id': patient_id,
+            'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'email': patient_email,
+            'condition': condition,
+            'diagnosis': diagnosis,
+            'treatment': treatment,
+            'follow_up_timeline': follow_up_timeline,
+            'follow_up_date': follow_up_date,
+            'email_sent': 'No',
+            'created_at': timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        })
         
         print(f"[{self.name}] Saved patient data: {patient_id} ({patient_email})")
         return patient_id
@@ -147,15 +109,60 @@ class FollowUpAgent:
         Returns:
             dict: JSON with follow-up schedule and patient notes
         """
+        return run_sync(self.aprocess(treatment_data, diagnosis_data, patient_email, condition))
+    
+    async def aprocess(self, treatment_data: dict, diagnosis_data: dict = None, 
+                       patient_email: str = None, condition: str = None) -> dict:
+        """Async version of process()"""
+        followup_plan = await self.aplan(diagnosis_data, treatment_data)
+        return await asyncio.to_thread(
+            self.register, followup_plan, treatment_data, diagnosis_data,
+            patient_email=patient_email, condition=condition
+        )
+    
+    def plan(self, diagnosis_data: dict = None, treatment_data: dict = None) -> dict:
+        """
+        Generate the follow-up care plan (the LLM part of process())
+        
+        Args:
+            diagnosis_data: Output from Clinical Reasoning Agent
+            treatment_data: Optional output from Treatment Agent. When omitted the
+                plan is drafted from the diagnosis alone, so it can run
+                concurrently with the Treatment Agent.
+            
+        Returns:
+            dict with keys follow_up, timeline, patient_instructions
+        """
+        return run_sync(self.aplan(diagnosis_data, treatment_data))
+    
+    async def aplan(self, diagnosis_data: dict = None, treatment_data: dict = None) -> dict:
+        """Async version of plan()"""
         print(f"[{self.name}] Creating follow-up care plan...")
         
-        treatment = treatment_data.get("treatment", "Standard care")
+        treatment = treatment_data.get("treatment", "Standard care") if treatment_data else None
         diagnosis = diagnosis_data.get("diagnosis", "General condition") if diagnosis_data else "General condition"
         
         if self.client:
-            followup_result = self._llm_followup(diagnosis, treatment)
-        else:
-            followup_result = self._mock_followup(diagnosis, treatment)
+            return await self._llm_followup(diagnosis, treatment)
+        return self._mock_followup(diagnosis, treatment)
+    
+    def register(self, followup_plan: dict, treatment_data: dict, diagnosis_data: dict = None,
+                 patient_email: str = None, condition: str = None) -> dict:
+        """
+        Build the final follow-up output and register the patient for email follow-ups
+        
+        Args:
+            followup_plan: Output from plan()
+            treatment_data: Output from Treatment Agent
+            diagnosis_data: Optional diagnosis context
+            patient_email: Optional patient email for follow-up emails
+            condition: Patient's original condition/symptoms
+            
+        Returns:
+            dict: JSON with follow-up schedule and patient notes
+        """
+        treatment = treatment_data.get("treatment", "Standard care")
+        diagnosis = diagnosis_data.get("diagnosis", "General condition") if diagnosis_data else "General condition"
         
         # Save patient data if email provided
         patient_id = None
@@ -165,13 +172,13 @@ class FollowUpAgent:
                 condition=condition,
                 diagnosis=diagnosis,
                 treatment=treatment,
-                follow_up_timeline=followup_result.get("timeline", "7 days")
+                follow_up_timeline=followup_plan.get("timeline", "7 days")
             )
         
         result = {
-            "follow_up": followup_result["follow_up"],
-            "timeline": followup_result.get("timeline", "7 days"),
-            "patient_instructions": followup_result.get("patient_instructions", "Follow treatment plan as prescribed"),
+            "follow_up": followup_plan["follow_up"],
+            "timeline": followup_plan.get("timeline", "7 days"),
+            "patient_instructions": followup_plan.get("patient_instructions", "Follow treatment plan as prescribed"),
             "patient_id": patient_id,
             "email_registered": patient_email is not None,
             "agent": self.name
@@ -184,12 +191,13 @@ class FollowUpAgent:
         print(f"[{self.name}] Follow-up: {result['follow_up']}")
         return result
     
-    def _llm_followup(self, diagnosis: str, treatment: str) -> dict:
+    async def _llm_followup(self, diagnosis: str, treatment: str = None) -> dict:
         """Use LLM to generate follow-up plan"""
+        treatment_line = f"Treatment Plan: {treatment}" if treatment else "Treatment Plan: Not yet available (plan from the diagnosis)"
         prompt = f"""You are a care coordinator. Create a follow-up plan for the patient.
 
 Diagnosis: {diagnosis}
-Treatment Plan: {treatment}
+{treatment_line}
 
 Provide your response in JSON format with these exact keys:
 - follow_up: Main follow-up recommendation (1-2 sentences about when and why to follow up)
@@ -199,65 +207,28 @@ Provide your response in JSON format with these exact keys:
 Be supportive and clear. Respond ONLY with valid JSON, no other text."""
 
         try:
-            if isinstance(self.client, AzureOpenAI):
-                model = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
-            else:
-                # For GitHub Models and OpenAI
-                model = os.getenv("GITHUB_MODEL") or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-            
-            response = self.client.chat.completions.create(
-                model=model,
+            result = await acomplete_json(
+                model=self.model,
                 messages=[
                     {"role": "system", "content": "You are a care coordinator. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.4,
-                max_tokens=200
+                max_tokens=200,
+                policy="followup",
+                required=("follow_up",)
             )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Clean up markdown if present
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(response_text)
             return result
             
         except Exception as e:
             print(f"[{self.name}] LLM call failed: {e}")
+            metrics.inc("agent_fallbacks_total", agent="followup")
             return self._mock_followup(diagnosis, treatment)
     
-    def _mock_followup(self, diagnosis: str, treatment: str) -> dict:
+    def _mock_followup(self, diagnosis: str, treatment: str = None) -> dict:
         """Fallback mock follow-up recommendations"""
-        diagnosis_lower = diagnosis.lower()
-        
-        if "dental" in diagnosis_lower or "caries" in diagnosis_lower:
-            return {
-                "follow_up": "Schedule dental check-up within 7 days to assess pain reduction and treatment effectiveness.",
-                "timeline": "7 days",
-                "patient_instructions": "Rinse with warm salt water twice daily and monitor pain levels. Contact your dentist immediately if pain worsens or swelling occurs."
-            }
-        elif "fracture" in diagnosis_lower:
-            return {
-                "follow_up": "Follow up with orthopedic specialist in 2 weeks for healing assessment and potential imaging.",
-                "timeline": "2 weeks",
-                "patient_instructions": "Rest and immobilize the affected area. Track healing progress and report any increased pain, numbness, or discoloration."
-            }
-        elif "dermatological" in diagnosis_lower or "skin" in diagnosis_lower:
-            return {
-                "follow_up": "Dermatology appointment recommended within 10-14 days to evaluate treatment response.",
-                "timeline": "10-14 days",
-                "patient_instructions": "Monitor the affected area daily for changes. Take photos to track progression and avoid known irritants."
-            }
-        else:
-            return {
-                "follow_up": "Specialist consultation recommended within 5-7 days for comprehensive evaluation.",
-                "timeline": "5-7 days",
-                "patient_instructions": "Keep a symptom diary and note any changes. Seek immediate medical attention if symptoms worsen significantly."
-            }
+        note_mock_response("followup")
+        return self.rules.match('followup', diagnosis=diagnosis)
     
     def validate_output(self, output: dict) -> bool:
         """Validate output structure"""
@@ -266,86 +237,79 @@ Be supportive and clear. Respond ONLY with valid JSON, no other text."""
 
 
     
-    def send_follow_up_emails(self):
+    def send_follow_up_emails(self) -> dict:
         """
         Send follow-up emails to patients based on their schedule
-        Checks patients_db.csv and sends emails to those due for follow-up
-        """
-        if not self.db_path.exists():
-            print(f"[{self.name}] No patient database found")
-            return
+        Only patients due today or earlier are read from the patient store
         
-        today = datetime.now().date()
-        emails_sent = 0
+        Returns:
+            dict with sent, failed, seconds and per_second
+        """
+        result = self.scheduler().run_due()
+        print(f"[{self.name}] Follow-up emails sent: {result['sent']} "
+              f"({result['per_second']}/s, {result['failed']} failed)")
+        return result
+    
+    def scheduler(self) -> FollowUpScheduler:
+        """
+        Build a scheduler that sends this agent's follow-up emails
         
-        # Read all patients
-        with open(self.db_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            patients = list(reader)
+        Configured through the environment:
+            FOLLOWUP_CLAIM_LEASE   - Seconds a worker's claim on due emails is
+                                     held before others may take over (default 300)
+            FOLLOWUP_RETRY_DELAY   - Seconds before a failed email is retried (default 600)
+        """
+        return FollowUpScheduler(
+            self.store,
+            self._deliver_emails,
+            lease_seconds=float(os.getenv("FOLLOWUP_CLAIM_LEASE", 300)),
+            retry_delay=float(os.getenv("FOLLOWUP_RETRY_DELAY", 600))
+        )
+    
+    def _deliver_emails(self, patients: list, begin, finish):
+        """
+        Send follow-up emails for a batch of claimed patient records
         
-        # Check each patient
-        for patient in patients:
-            if patient['email_sent'] == 'Yes':
-                continue  # Already sent
-            
-            follow_up_date = datetime.strptime(patient['follow_up_date'], '%Y-%m-%d').date()
-            
-            # Send email if follow-up date has arrived
-            if today >= follow_up_date:
-                success = self._send_email(
-                    to_email=patient['email'],
-                    patient_id=patient['patient_id'],
-                    condition=patient['condition'],
-                    diagnosis=patient['diagnosis'],
-                    treatment=patient['treatment'],
-                    follow_up_timeline=patient['follow_up_timeline']
-                )
-                
-                if success:
-                    # Mark as sent
-                    patient['email_sent'] = 'Yes'
-                    emails_sent += 1
+        Uses the pooled SMTP delivery engine when SMTP_HOST is configured,
+        otherwise prints each email to the console.
         
-        # Write back updated data
-        if emails_sent > 0:
-            with open(self.db_path, 'w', newline='', encoding='utf-8') as f:
-                fieldnames = ['patient_id', 'timestamp', 'email', 'condition', 
-                            'diagnosis', 'treatment', 'follow_up_timeline', 
-                            'follow_up_date', 'email_sent', 'created_at']
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(patients)
+        Args:
+            patients: Patient records claimed by the scheduler
+            begin: begin(patient_id) -> bool, journals the send before it
+                happens; False means skip the patient
+            finish: finish(patient_id, sent, detail), journals the outcome
+        """
+        if self.delivery_engine is None:
+            for patient in patients:
+                if begin(patient['patient_id']):
+                    safe_print(self._format_console_email(patient))
+                    finish(patient['patient_id'], True, "simulated")
+            return
         
-        print(f"[{self.name}] Follow-up emails sent: {emails_sent}")
-        return emails_sent
+        messages = [(patient['patient_id'], self._build_message(patient)) for patient in patients]
+        outcome = self.delivery_engine.send_batch(
+            messages,
+            before_send=begin,
+            on_result=lambda result: finish(result.key, result.sent, f"{result.code} {result.detail}".strip())
+        )
+        print(f"[{self.name}] SMTP batch: {outcome['sent']} sent, {outcome['failed']} failed "
+              f"({outcome['per_second']}/s)")
     
-    def _send_email(self, to_email: str, patient_id: str, condition: str, 
-                    diagnosis: str, treatment: str, follow_up_timeline: str) -> bool:
-        """
-        Send follow-up email to patient
-        For now, simulates email sending by printing the content
-        TODO: Integrate with actual email service (SendGrid, AWS SES, etc.)
-        """
-        email_content = f"""
-{'='*80}
-[FOLLOW-UP EMAIL]
-{'='*80}
-
-To: {to_email}
-From: MaiOpinion Healthcare Assistant
-Subject: Your Follow-Up Reminder - Patient ID: {patient_id}
-
-Dear Patient,
+    def _email_subject(self, patient: dict) -> str:
+        return f"Your Follow-Up Reminder - Patient ID: {patient['patient_id']}"
+    
+    def _email_body(self, patient: dict) -> str:
+        return f"""Dear Patient,
 
 This is a friendly reminder about your healthcare follow-up based on your 
 recent consultation with MaiOpinion.
 
-Original Condition: {condition}
-Diagnosis: {diagnosis}
-Recommended Timeline: {follow_up_timeline}
+Original Condition: {patient['condition']}
+Diagnosis: {patient['diagnosis']}
+Recommended Timeline: {patient['follow_up_timeline']}
 
 Treatment Plan:
-{treatment}
+{patient['treatment']}
 
 Next Steps:
 - Please schedule an appointment with your healthcare provider
@@ -357,22 +321,35 @@ medical attention immediately.
 
 Stay healthy!
 MaiOpinion Healthcare Team
+"""
+    
+    def _build_message(self, patient: dict) -> EmailMessage:
+        """Build the SMTP message for one patient"""
+        message = EmailMessage()
+        message['To'] = patient['email']
+        message['From'] = self.email_sender
+        message['Subject'] = self._email_subject(patient)
+        # Stable per follow-up, so a resend after a crash mid-send can be
+        # recognised as a duplicate by the mail server and the recipient
+        domain = self.email_sender.rpartition('@')[2] or "maiopinion.com"
+        message['Message-ID'] = f"<followup-{patient['patient_id']}-{patient['follow_up_date']}@{domain}>"
+        message.set_content(self._email_body(patient))
+        return message
+    
+    def _format_console_email(self, patient: dict) -> str:
+        """Render an email for the console simulation"""
+        return f"""
+{'='*80}
+[FOLLOW-UP EMAIL]
+{'='*80}
 
+To: {patient['email']}
+From: MaiOpinion Healthcare Assistant
+Subject: {self._email_subject(patient)}
+
+{self._email_body(patient)}
 {'='*80}
         """
-        
-        safe_print(email_content)
-        
-        # TODO: Replace with actual email sending
-        # import smtplib
-        # from email.mime.text import MIMEText
-        # msg = MIMEText(email_content)
-        # msg['To'] = to_email
-        # msg['From'] = 'noreply@maiopinion.com'
-        # msg['Subject'] = f'Your Follow-Up Reminder - Patient ID: {patient_id}'
-        # ... send email
-        
-        return True  # Simulate successful send
 
 
 # Test the agent if run directly
@@ -0,0 +1,162 @@
+"""
+Follow-Up Scheduler
+Sends follow-up emails as they come due, reading only due rows from the
+patient store's due-date index and journaling every send in its outbox
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+class FollowUpScheduler:
+    """
+    Claims due follow-ups from the patient store and hands them to a sender
+    in batches
+
+    The store keeps pending follow-ups ordered by follow-up date, so a run
+    reads only rows that are due and the daemon can sleep until the
+    earliest pending date or retry instead of polling the whole table.
+
+    Every send is journaled in the store's outbox: a batch is claimed
+    under a lease, each email is recorded as 'sending' before it goes to
+    the mail server and as sent/failed right after. Several schedulers
+    (threads or processes) can therefore share one database without
+    double-sending, and after a crash only emails that were in flight are
+    sent again, once the dead worker's lease expires.
+    """
+
+    def __init__(self, store, deliver, batch_size: int = 500, worker: str = None,
+                 lease_seconds: float = 300.0, retry_delay: float = 600.0):
+        """
+        Args:
+            store: PatientStore holding the follow-up records
+            deliver: Callable deliver(patients, begin, finish) that sends a
+                batch of patient records. For each patient it must call
+                begin(patient_id) before sending, skip the patient if that
+                returns False, and call finish(patient_id, sent, detail) as
+                soon as the outcome is known
+            batch_size: Due records claimed and delivered together
+            worker: Unique name of this sender (default: host:pid:random)
+            lease_seconds: How long claims are held before another worker may
+                take them over
+            retry_delay: Seconds a failed email waits before it is retried
+        """
+        self.store = store
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.worker = worker or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._failed = 0
+
+    def run_due(self, now: datetime = None) -> dict:
+        """
+        Send every follow-up due on or before today
+
+        Args:
+            now: Current time (default: datetime.now())
+
+        Returns:
+            dict with sent, failed, seconds and per_second
+        """
+        today = (now or datetime.now()).strftime('%Y-%m-%d')
+        start = time.perf_counter()
+        with self._lock:
+            self._sent = self._failed = 0
+
+        try:
+            while True:
+                batch = self.store.claim_due(today, self.worker, self.batch_size, self.lease_seconds)
+                if not batch:
+                    break
+                self.deliver(batch, self._begin, self._finish)
+        finally:
+            self.store.release_claims(self.worker)
+
+        seconds = time.perf_counter() - start
+        sent, failed = self._sent, self._failed
+        return {
+            'sent': sent,
+            'failed': failed,
+            'seconds': round(seconds, 3),
+            'per_second': round(sent / seconds, 1) if seconds > 0 and sent else 0.0
+        }
+
+    def _begin(self, patient_id: str) -> bool:
+        return self.store.begin_send(patient_id, self.worker, self.lease_seconds)
+
+    def _finish(self, patient_id: str, sent: bool, detail: str = ""):
+        self.store.finish_send(patient_id, self.worker, sent, detail, retry_after=self.retry_delay)
+        with self._lock:
+            if sent:
+                self._sent += 1
+            else:
+                self._failed += 1
+
+    def seconds_until_next_due(self, now: datetime = None):
+        """
+        Seconds until the next follow-up can be sent
+
+        That is the earlier of two times: when a due patient's claim or
+        retry delay runs out, and when the next pending follow-up date
+        begins.
+
+        Returns:
+            float (0 if a follow-up can be sent now), or None when nothing is pending
+        """
+        now = now or datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        waits = []
+
+        claim_time = self.store.next_claim_time(today)
+        if claim_time is not None:
+            waits.append(claim_time - now.timestamp())
+
+        next_date = self.store.next_due_date(after=today)
+        if next_date is not None:
+            waits.append((datetime.strptime(next_date, '%Y-%m-%d') - now).total_seconds())
+
+        return max(0.0, min(waits)) if waits else None
+
+    def run_forever(self, poll_interval: float = 3600, on_run=None):
+        """
+        Daemon loop: send due follow-ups, then sleep until the next one
+
+        Sleeps at most poll_interval seconds so patients registered by
+        other processes (e.g. the API server) are picked up.
+
+        Args:
+            poll_interval: Longest sleep between runs, in seconds
+            on_run: Optional callback receiving each run_due() result and
+                the number of seconds the scheduler will sleep
+        """
+        while True:
+            result = self.run_due()
+
+            wait = self.seconds_until_next_due()
+            if wait is None:
+                wait = poll_interval
+            else:
+                # Wake just after the lease expires or the due date begins
+                wait = min(poll_interval, wait + 1)
+
+            if on_run:
+                on_run(result, wait)
+            time.sleep(wait)
+
+
+def next_wakeup(seconds: float) -> str:
+    """Format the time the daemon will wake up"""
+    return (datetime.now() + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def default_worker_id() -> str:
+    """Name identifying this sender in the outbox"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,500 @@
+"""
+Job Queue
+Background execution for the API: a bounded queue of diagnosis jobs, a
+pool of worker threads that runs them, and a bounded per-job event log
+with increasing event IDs, so clients can follow a job while (or after)
+it runs and resume from the last event they saw
+"""
+
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+
+# Event types that end a job
+TERMINAL_EVENTS = ('complete', 'error')
+
+JOB_STATUSES = ('queued', 'running', 'complete', 'error')
+
+
+class JobQueueFull(Exception):
+    """The queue is at its maximum depth; the caller should retry later"""
+
+
+class JobQueue(ABC):
+    """
+    Interface for job queue backends
+
+    A job is a JSON-serialisable payload. Workers take jobs with dequeue()
+    and publish() their progress events. Each event gets the next ID of
+    its job (1, 2, 3, ...); clients read the events after the last ID
+    they saw with read_events(). Only the newest max_events events of a
+    job are kept. A job is finished once a 'complete' or 'error' event
+    has been published.
+    """
+
+    max_depth = None
+    max_events = None
+
+    @abstractmethod
+    def enqueue(self, payload: dict) -> str:
+        """
+        Add a job
+
+        Returns:
+            str: Job ID
+
+        Raises:
+            JobQueueFull: If max_depth jobs are already waiting
+        """
+
+    @abstractmethod
+    def dequeue(self, timeout: float = 1.0):
+        """
+        Take the oldest waiting job and mark it running
+
+        Returns:
+            (job_id, payload), or None if nothing arrived within timeout
+        """
+
+    @abstractmethod
+    def publish(self, job_id: str, event: dict) -> int:
+        """
+        Append an event to a job's log
+
+        Returns:
+            int: The event's ID
+        """
+
+    @abstractmethod
+    def read_events(self, job_id: str, after_id: int = 0, timeout: float = 0.0):
+        """
+        Events with IDs above after_id, waiting up to timeout seconds for
+        new ones if there are none yet and the job is not finished
+
+        If events after after_id have already been trimmed from the log,
+        the oldest retained events are returned.
+
+        Returns:
+            (events, finished): events is a list of (event_id, event)
+            pairs, empty if none arrived within timeout; finished is True
+            once the job has ended, in which case events holds everything
+            left to read. None for an unknown job.
+        """
+
+    @abstractmethod
+    def status(self, job_id: str):
+        """
+        Returns:
+            dict with id, status, created_at, started_at, finished_at and
+            last_event_id, or None for an unknown job
+        """
+
+    @abstractmethod
+    def depth(self) -> int:
+        """Jobs waiting for a worker"""
+
+    def stats(self) -> dict:
+        return {
+            'backend': type(self).__name__,
+            'depth': self.depth(),
+            'max_depth': self.max_depth
+        }
+
+
+class MemoryJobQueue(JobQueue):
+    """
+    In-process backend
+
+    Jobs live in this process only, so they are run by its own worker
+    threads and lost on restart. Finished jobs are kept for retention
+    seconds so clients can still read their events.
+    """
+
+    def __init__(self, max_depth: int = 100, retention: float = 3600, max_events: int = 1024):
+        self.max_depth = max_depth
+        self.retention = retention
+        self.max_events = max_events
+        self._waiting = deque()
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def enqueue(self, payload: dict) -> str:
+        with self._changed:
+            self._prune(time.time())
+            if len(self._waiting) >= self.max_depth:
+                raise JobQueueFull(f"{len(self._waiting)} jobs already waiting")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'payload': payload,
+                'events': deque(maxlen=self.max_events),
+                'last_event_id': 0
+            }
+            self._waiting.append(job_id)
+            self._changed.notify_all()
+            return job_id
+
+    def dequeue(self, timeout: float = 1.0):
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._waiting, timeout):
+                return None
+            job = self._jobs[self._waiting.popleft()]
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            return job['id'], job['payload']
+
+    def publish(self, job_id: str, event: dict) -> int:
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return 0
+            job['last_event_id'] += 1
+            job['events'].append((job['last_event_id'], event))
+            if event.get('type') in TERMINAL_EVENTS:
+                job['status'] = event['type']
+                job['finished_at'] = time.time()
+            self._changed.notify_all()
+            return job['last_event_id']
+
+    def read_events(self, job_id: str, after_id: int = 0, timeout: float = 0.0):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if timeout > 0:
+                self._changed.wait_for(
+                    lambda: job['last_event_id'] > after_id or job['finished_at'] is not None, timeout
+                )
+            # IDs are consecutive, so the first wanted event's index is known
+            events = job['events']
+            oldest_id = job['last_event_id'] - len(events) + 1
+            wanted = list(itertools.islice(events, max(0, after_id - oldest_id + 1), None))
+            return wanted, job['finished_at'] is not None
+
+    def status(self, job_id: str):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return _status(job)
+
+    def depth(self) -> int:
+        with self._changed:
+            return len(self._waiting)
+
+    def _prune(self, now: float):
+        """Forget jobs that finished more than retention seconds ago"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and now - job['finished_at'] > self.retention
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Backend on a Redis-compatible server
+
+    Works with any client exposing the redis-py API (redis.Redis or a
+    local stand-in), so API processes and separate worker processes
+    (job_worker.py) can share one queue. Keys used, under prefix:
+        <prefix>:queue          - list of waiting job IDs
+        <prefix>:job:<id>       - hash with status, payload, timestamps
+                                  and last_event_id
+        <prefix>:events:<id>    - list of [event_id, event] JSON pairs,
+                                  trimmed to max_events
+
+    A job's keys expire retention seconds after it finishes. Until then
+    they expire unfinished_ttl seconds after the job's last update, so a
+    job orphaned by a dead worker does not stay in Redis forever.
+
+    Redis lists cannot be waited on without consuming them, so
+    read_events() polls every poll_interval seconds.
+    """
+
+    def __init__(self, client, prefix: str = "maiopinion:jobs", max_depth: int = 100,
+                 retention: float = 3600, max_events: int = 1024, poll_interval: float = 0.2,
+                 unfinished_ttl: float = 86400):
+        self.client = client
+        self.prefix = prefix
+        self.max_depth = max_depth
+        self.retention = retention
+        self.unfinished_ttl = unfinished_ttl
+        self.max_events = max_events
+        self.poll_interval = poll_interval
+
+    def _queue_key(self) -> str:
+        return f"{self.prefix}:queue"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _events_key(self, job_id: str) -> str:
+        return f"{self.prefix}:events:{job_id}"
+
+    def enqueue(self, payload: dict) -> str:
+        # Check-then-push: concurrent producers may overshoot max_depth slightly
+        waiting = self.client.llen(self._queue_key())
+        if waiting >= self.max_depth:
+            raise JobQueueFull(f"{waiting} jobs already waiting")
+
+        job_id = uuid.uuid4().hex
+        self.client.hset(self._job_key(job_id), mapping={
+            'status': 'queued',
+            'created_at': time.time(),
+            'payload': json.dumps(payload)
+        })
+        self.client.expire(self._job_key(job_id), int(self.unfinished_ttl))
+        self.client.lpush(self._queue_key(), job_id)
+        return job_id
+
+    def dequeue(self, timeout: float = 1.0):
+        item = self.client.brpop(self._queue_key(), timeout=max(1, math.ceil(timeout)))
+        if item is None:
+            return None
+
+        job_id = _text(item[1])
+        key = self._job_key(job_id)
+        self.client.hset(key, mapping={'status': 'running', 'started_at': time.time()})
+        self.client.expire(key, int(self.unfinished_ttl))
+        payload = self.client.hget(key, 'payload')
+        if payload is None:
+            return None
+        return job_id, json.loads(_text(payload))
+
+    def publish(self, job_id: str, event: dict) -> int:
+        job_key, events_key = self._job_key(job_id), self._events_key(job_id)
+        event_id = self.client.hincrby(job_key, 'last_event_id', 1)
+        self.client.rpush(events_key, json.dumps([event_id, event]))
+        self.client.ltrim(events_key, -self.max_events, -1)
+        if event.get('type') in TERMINAL_EVENTS:
+            self.client.hset(job_key, mapping={'status': event['type'], 'finished_at': time.time()})
+            ttl = self.retention
+        else:
+            ttl = self.unfinished_ttl
+        for key in (job_key, events_key):
+            self.client.expire(key, int(ttl))
+        return event_id
+
+    def read_events(self, job_id: str, after_id: int = 0, timeout: float = 0.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            # Status first: once it is terminal the log read below is complete
+            status = self.client.hget(self._job_key(job_id), 'status')
+            if status is None:
+                return None
+            finished = _text(status) in TERMINAL_EVENTS
+
+            # The log is at most max_events long, so read it whole and filter
+            events = [json.loads(_text(item)) for item in self.client.lrange(self._events_key(job_id), 0, -1)]
+            events = [(event_id, event) for event_id, event in events if event_id > after_id]
+            if events or finished or time.monotonic() >= deadline:
+                return events, finished
+            time.sleep(self.poll_interval)
+
+    def status(self, job_id: str):
+        fields = {_text(k): _text(v) for k, v in self.client.hgetall(self._job_key(job_id)).items()}
+        if not fields:
+            return None
+        job = {
+            'id': job_id,
+            'status': fields.get('status'),
+            'created_at': _float(fields.get('created_at')),
+            'started_at': _float(fields.get('started_at')),
+            'finished_at': _float(fields.get('finished_at')),
+            'last_event_id': int(fields.get('last_event_id') or 0)
+        }
+        return _status(job)
+
+    def depth(self) -> int:
+        return self.client.llen(self._queue_key())
+
+
+def _status(job: dict) -> dict:
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'last_event_id': job['last_event_id']
+    }
+
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _float(value):
+    return float(value) if value not in (None, '') else None
+
+
+class JobWorkerPool:
+    """
+    Worker threads that take jobs from a JobQueue and run them
+
+    The handler is called as handler(payload, publish) and reports
+    progress through publish(event). A job whose handler raises, or
+    returns without a 'complete' or 'error' event, is finished with an
+    error event so clients following it never wait forever.
+    """
+
+    def __init__(self, queue: JobQueue, handler, workers: int = 4):
+        """
+        Args:
+            queue: Backend to take jobs from
+            handler: Callable handler(payload, publish)
+            workers: Jobs run in parallel
+        """
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the worker threads (no-op if already running)"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f"job-worker-{i + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """Stop taking jobs and wait for running ones to finish"""
+        self._stopping.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                item = self.queue.dequeue(timeout=1.0)
+            except Exception as e:
+                print(f"[Job Worker] Queue unavailable: {e}")
+                self._stopping.wait(5.0)
+                continue
+            if item is not None:
+                self._run(*item)
+
+    def _run(self, job_id: str, payload: dict):
+        finished = []
+
+        def publish(event):
+            if event.get('type') in TERMINAL_EVENTS:
+                finished.append(event['type'])
+            self.queue.publish(job_id, event)
+
+        with self._lock:
+            self.busy += 1
+        try:
+            self.handler(payload, publish)
+            if not finished:
+                publish({'type': 'error', 'message': 'Job ended without a result'})
+        except Exception as e:
+            print(f"[Job Worker] Job {job_id} failed: {e}")
+            if not finished:
+                publish({'type': 'error', 'message': str(e)})
+        finally:
+            with self._lock:
+                self.busy -= 1
+                if finished and finished[-1] == 'complete':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': bool(self._threads),
+                'busy': self.busy,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Get the process-wide job queue
+
+    Configured through the environment:
+        JOB_QUEUE_BACKEND        - 'memory' (default) or 'redis'
+        JOB_QUEUE_URL            - Server URL for the redis backend
+                                   (default redis://localhost:6379/0)
+        JOB_QUEUE_PREFIX         - Key prefix for the redis backend (default maiopinion:jobs)
+        JOB_QUEUE_MAX_DEPTH      - Waiting jobs before new ones get HTTP 429 (default 100)
+        JOB_RETENTION            - Seconds a finished job's events are kept (default 3600)
+        JOB_UNFINISHED_TTL       - Seconds an unfinished job is kept after its last
+                                   update by the redis backend (default 86400)
+        JOB_EVENT_LOG_SIZE       - Newest events kept per job (default 1024)
+
+    Raises:
+        RuntimeError: If the redis backend is selected but the redis
+            package is not installed
+    """
+    global _queue
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                max_depth = int(os.getenv("JOB_QUEUE_MAX_DEPTH", 100))
+                retention = float(os.getenv("JOB_RETENTION", 3600))
+                max_events = int(os.getenv("JOB_EVENT_LOG_SIZE", 1024))
+                backend = os.getenv("JOB_QUEUE_BACKEND", "memory").lower()
+
+                if backend == "redis":
+                    try:
+                        import redis
+                    except ImportError:
+                        raise RuntimeError(
+                            "JOB_QUEUE_BACKEND=redis requires the redis package (pip install redis)"
+                        )
+                    client = redis.Redis.from_url(os.getenv("JOB_QUEUE_URL", "redis://localhost:6379/0"))
+                    _queue = RedisJobQueue(
+                        client,
+                        prefix=os.getenv("JOB_QUEUE_PREFIX", "maiopinion:jobs"),
+                        max_depth=max_depth,
+                        retention=retention,
+                        max_events=max_events,
+                        unfinished_ttl=float(os.getenv("JOB_UNFINISHED_TTL", 86400))
+                    )
+                else:
+                    _queue = MemoryJobQueue(max_depth=max_depth, retention=retention, max_events=max_events)
+
+    return _queue
+
+
+def job_worker_count() -> int:
+    """Worker threads per process, from JOB_WORKERS (default 4)"""
+    return int(os.getenv("JOB_WORKERS", 4))
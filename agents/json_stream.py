@@ -0,0 +1,189 @@
+"""
+Streaming JSON Extractor
+Pulls the JSON object out of an LLM response as it streams in, tolerating
+code fences and prose around it, and reports each top-level field as soon
+as its value is complete
+"""
+
+import json
+
+from agents.metrics import metrics
+
+
+class JsonStreamParser:
+    """
+    Incremental extractor for the first JSON object in a stream of text
+
+    Text before the first '{' (a ```json fence, "Here is the result:") and
+    after the matching '}' is ignored. feed() returns the top-level fields
+    whose values finished in that chunk, so a caller can act on
+    "diagnosis" before "reasoning" has been generated. result() parses the
+    whole object and is the authoritative value.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start = None
+        self._end = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # What the top level expects next: key, colon, value, scalar, or after
+        self._expect = "key"
+        self._key = None
+        self._token_start = None
+        self.fields = {}
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._text
+
+    @property
+    def complete(self) -> bool:
+        """True once the object's closing brace has been read"""
+        return self._end is not None
+
+    @property
+    def surrounded(self) -> bool:
+        """True if anything but whitespace surrounded the object"""
+        if self._start is None:
+            return bool(self._text.strip())
+        trailing = self._text[self._end:] if self._end is not None else ""
+        return bool(self._text[:self._start].strip() or trailing.strip())
+
+    def feed(self, text: str) -> list:
+        """
+        Consume the next piece of the response
+
+        Args:
+            text: Streamed text, split anywhere
+
+        Returns:
+            list of (key, value) for top-level fields completed by this text
+        """
+        self._text += text
+        if self._end is not None:
+            return []
+
+        completed = []
+        data = self._text
+        i = self._pos
+
+        while i < len(data) and self._end is None:
+            c = data[i]
+
+            if self._start is None:
+                if c == "{":
+                    self._start = i
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = self._decode(data[self._token_start:i + 1])
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._expect == "value":
+                        self._finish(data[self._token_start:i + 1], completed)
+            elif c == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._token_start = i
+            elif c in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._token_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._expect == "scalar":
+                        self._finish(data[self._token_start:i], completed)
+                    self._end = i + 1
+                elif self._depth == 1 and self._expect == "value":
+                    self._finish(data[self._token_start:i + 1], completed)
+            elif self._depth == 1:
+                if c == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif c == ",":
+                    if self._expect == "scalar":
+                        self._finish(data[self._token_start:i], completed)
+                    self._expect = "key"
+                elif self._expect == "value" and not c.isspace():
+                    self._token_start = i
+                    self._expect = "scalar"
+            i += 1
+
+        self._pos = i
+        return completed
+
+    def _finish(self, raw: str, completed: list):
+        """Record a finished top-level value; malformed ones wait for result()"""
+        self._expect = "after"
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        if isinstance(self._key, str):
+            self.fields[self._key] = value
+            completed.append((self._key, value))
+
+    @staticmethod
+    def _decode(raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def result(self) -> dict:
+        """
+        Parse the complete object
+
+        Returns:
+            dict: The JSON object
+
+        Raises:
+            ValueError: If the text holds no complete, valid JSON object
+        """
+        if self._start is None:
+            raise ValueError("no JSON object in response")
+        if self._end is None:
+            raise ValueError("JSON object in response is incomplete")
+        return json.loads(self._text[self._start:self._end])
+
+
+def parse_json_response(text: str, agent: str) -> dict:
+    """
+    Extract the JSON object from a complete LLM response
+
+    Counts every parse in llm_json_parse_total by agent and result: ok,
+    recovered (text around the object was skipped) or failed.
+
+    Args:
+        text: Full response text
+        agent: Agent name for metrics
+
+    Returns:
+        dict: The JSON object
+
+    Raises:
+        ValueError: If the response holds no valid JSON object
+    """
+    parser = JsonStreamParser()
+    parser.feed(text)
+    return finish_json_response(parser, agent)
+
+
+def finish_json_response(parser: JsonStreamParser, agent: str) -> dict:
+    """Parse a fully fed JsonStreamParser, recording the outcome (see parse_json_response())"""
+    try:
+        result = parser.result()
+    except ValueError:
+        metrics.inc("llm_json_parse_total", agent=agent, result="failed")
+        raise
+    metrics.inc("llm_json_parse_total", agent=agent, result="recovered" if parser.surrounded else "ok")
+    return result
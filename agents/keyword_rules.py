@@ -0,0 +1,223 @@
+"""
+Keyword Rule Engine
+Matches the keyword tables behind the agents' offline (mock) responses. All
+tables are compiled once into one regular expression, and each text is
+scanned in a single pass no matter how many tables or rules read it.
+
+Rules live in keyword_rules.json (or KEYWORD_RULES_PATH):
+
+    {
+        "<table>": {
+            "rules": [
+                {"name": "...", "priority": 0,
+                 "match": {"<field>": ["keyword", ...], ...},
+                 "result": <any JSON value>},
+                ...
+            ],
+            "default": <any JSON value>
+        }
+    }
+
+A rule matches when any of its keywords occurs (case-insensitively, as a
+substring) in the text passed for that field. The highest priority
+matching rule wins; rules with equal priority are tried in file order.
+"""
+
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "keyword_rules.json"
+
+# Distinct texts whose scan results are kept (conditions repeat a lot)
+SCAN_CACHE_SIZE = 4096
+
+
+class KeywordRules:
+    """Compiled keyword tables"""
+
+    def __init__(self, tables: dict):
+        """
+        Args:
+            tables: Parsed rules file (see module docstring)
+
+        Raises:
+            ValueError: If a table or rule is malformed
+        """
+        keywords = {}
+        self._tables = {}
+
+        for table_name, table in tables.items():
+            if not isinstance(table, dict) or not isinstance(table.get("rules"), list):
+                raise ValueError(f"Keyword table '{table_name}' needs a 'rules' list")
+
+            rules = []
+            for index, rule in enumerate(table["rules"]):
+                match = rule.get("match") if isinstance(rule, dict) else None
+                if not isinstance(match, dict) or "result" not in rule:
+                    raise ValueError(f"Keyword rule {table_name}[{index}] needs 'match' and 'result'")
+                fields = {}
+                for field, words in match.items():
+                    if isinstance(words, str) or not all(isinstance(w, str) and w for w in words):
+                        raise ValueError(f"Keyword rule {table_name}[{index}] field '{field}' needs a list of keywords")
+                    fields[field] = frozenset(keywords.setdefault(w.lower(), len(keywords)) for w in words)
+                rules.append((-int(rule.get("priority", 0)), index, fields, rule["result"]))
+
+            rules.sort(key=lambda r: (r[0], r[1]))
+
+            # For each field, the best ranked rule each keyword selects, so
+            # a lookup is one pass over the keywords found in the text
+            ranks = {}
+            for rank, (_, _, fields, _) in enumerate(rules):
+                for field, ids in fields.items():
+                    field_ranks = ranks.setdefault(field, {})
+                    for word_id in ids:
+                        field_ranks.setdefault(word_id, rank)
+
+            self._tables[table_name] = (
+                ranks, [_copier(result) for _, _, _, result in rules], _copier(table.get("default"))
+            )
+
+        # Keywords found inside other keywords ("head" in "headache") start
+        # at the same offset and would be shadowed by the longer alternative,
+        # so every keyword also implies the keywords it contains
+        self._implies = {}
+        for word, word_id in keywords.items():
+            self._implies[word] = frozenset(
+                other_id for other, other_id in keywords.items() if other in word
+            )
+
+        # The keywords are factored into a prefix tree, so each offset of the
+        # text costs one walk down it rather than one try per keyword
+        self._pattern = re.compile(_trie_pattern(keywords)) if keywords else None
+        self.scan = lru_cache(maxsize=SCAN_CACHE_SIZE)(self._scan)
+
+    def _scan(self, text: str) -> frozenset:
+        """IDs of every keyword occurring in text"""
+        if self._pattern is None or not text:
+            return frozenset()
+        search = self._pattern.search
+        implies = self._implies
+        text = text.lower()
+        found = set()
+        pos = 0
+        while True:
+            match = search(text, pos)
+            if match is None:
+                return frozenset(found)
+            found.update(implies[match.group()])
+            # Resume inside the match so overlapping keywords are found too
+            pos = match.start() + 1
+
+    def match(self, table: str, **fields):
+        """
+        Result of the highest priority rule in table matching the given texts
+
+        Args:
+            table: Table name
+            **fields: Text for each field the table's rules read (None is
+                treated as empty)
+
+        Returns:
+            A copy of the matching rule's result, or of the table default
+
+        Raises:
+            KeyError: If the table does not exist
+        """
+        ranks, results, default = self._tables[table]
+        best = len(results)
+
+        for field, text in fields.items():
+            field_ranks = ranks.get(field)
+            if not text or field_ranks is None:
+                continue
+            for word_id in self.scan(text):
+                rank = field_ranks.get(word_id, best)
+                if rank < best:
+                    best = rank
+
+        return results[best]() if best < len(results) else default()
+
+
+def _trie_pattern(words) -> str:
+    """Regex matching the longest of words at a position, factored by common prefixes"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A keyword ends here; longer ones are tried first
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+def _copier(value):
+    """Function returning a fresh copy of a JSON value, so callers can't change the rule table"""
+    if isinstance(value, dict):
+        nested = [(key, _copier(item)) for key, item in value.items() if isinstance(item, (dict, list))]
+        if not nested:
+            return value.copy
+
+        def copy_dict():
+            copy = value.copy()
+            for key, copier in nested:
+                copy[key] = copier()
+            return copy
+        return copy_dict
+
+    if isinstance(value, list):
+        if not any(isinstance(item, (dict, list)) for item in value):
+            return value.copy
+        copiers = [_copier(item) for item in value]
+        return lambda: [copier() for copier in copiers]
+
+    return lambda: value
+
+
+def load_keyword_rules(path) -> KeywordRules:
+    """
+    Load and compile a rules file
+
+    Raises:
+        ValueError: If the file is not valid JSON or a rule is malformed
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            tables = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"Invalid keyword rules file {path}: {e}") from e
+    return KeywordRules(tables)
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_keyword_rules() -> KeywordRules:
+    """
+    Get the process-wide compiled keyword rules
+
+    Configured through the environment:
+        KEYWORD_RULES_PATH       - Rules file (default agents/keyword_rules.json)
+    """
+    global _rules
+
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = load_keyword_rules(os.getenv("KEYWORD_RULES_PATH") or DEFAULT_RULES_PATH)
+
+    return _rules
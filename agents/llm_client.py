@@ -0,0 +1,540 @@
+"""
+Shared LLM Client Provider
+Builds a single process-wide OpenAI client (GitHub Models, Azure OpenAI, or OpenAI)
+so every agent reuses the same keep-alive HTTP connection pool. Agent calls go
+through the async client of the event loop they run on (see event_loop.py).
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import httpx
+
+from openai import (
+    APIConnectionError, AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI, RateLimitError
+)
+from dotenv import load_dotenv
+
+from agents.call_policy import get_call_policy
+from agents.event_loop import run_sync
+from agents.json_stream import JsonStreamParser, finish_json_response
+from agents.metrics import metrics
+from agents.rate_limiter import get_rate_limiter, retry_after_seconds
+from agents.response_cache import get_response_cache
+
+# Load environment variables
+load_dotenv()
+
+GITHUB_MODELS_ENDPOINT = "https://models.inference.ai.azure.com"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+_lock = threading.Lock()
+_client = None
+_client_kwargs = None
+_provider = None
+_initialized = False
+
+# Async clients are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+# Receives partial completion text while set (see stream_to())
+_delta_sink = contextvars.ContextVar("llm_delta_sink", default=None)
+
+# Collects agents answering with their mock response (see track_mock_responses())
+_mock_responses = contextvars.ContextVar("llm_mock_responses", default=None)
+
+_UNSET = object()
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _pool_settings():
+    """
+    Connection pool limits and timeouts shared by the sync and async clients
+
+    Pool size and timeouts are tunable through the environment:
+        LLM_MAX_CONNECTIONS      - Total sockets in the pool (default 20)
+        LLM_MAX_KEEPALIVE        - Idle keep-alive sockets kept open (default 10)
+        LLM_KEEPALIVE_EXPIRY     - Seconds an idle socket stays open (default 30)
+        LLM_CONNECT_TIMEOUT      - Seconds to establish a connection (default 5)
+        LLM_TIMEOUT              - Seconds for the whole request (default 60)
+    """
+    limits = httpx.Limits(
+        max_connections=_env_int("LLM_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_env_int("LLM_MAX_KEEPALIVE", 10),
+        keepalive_expiry=_env_float("LLM_KEEPALIVE_EXPIRY", 30.0)
+    )
+    timeout = httpx.Timeout(
+        _env_float("LLM_TIMEOUT", 60.0),
+        connect=_env_float("LLM_CONNECT_TIMEOUT", 5.0)
+    )
+    return {"limits": limits, "timeout": timeout}
+
+
+def _detect_provider():
+    """
+    Pick the first configured provider
+
+    Returns:
+        (provider name, client keyword arguments), or (None, None) when no
+        API keys are configured
+    """
+    # Try GitHub Models first - check both .env and system environment
+    github_token = os.getenv("GITHUB_TOKEN") or os.environ.get("GITHUB_TOKEN")
+    use_github = os.getenv("USE_GITHUB_MODELS", "false").lower() == "true"
+
+    if github_token and use_github and github_token != "your_github_token_here":
+        print(f"[LLM Client] Using GitHub Models (token: {github_token[:10]}...)")
+        return "github", {"api_key": github_token, "base_url": GITHUB_MODELS_ENDPOINT}
+
+    # Try Azure OpenAI
+    azure_key = os.getenv("AZURE_OPENAI_KEY")
+    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+
+    if azure_key and azure_endpoint:
+        print("[LLM Client] Using Azure OpenAI")
+        return "azure", {
+            "api_key": azure_key,
+            "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+            "azure_endpoint": azure_endpoint
+        }
+
+    # Fallback to OpenAI
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if openai_key:
+        print("[LLM Client] Using OpenAI")
+        return "openai", {"api_key": openai_key}
+
+    print("[LLM Client] WARNING: No API keys found, agents will use mock responses")
+    return None, None
+
+
+def _create_client():
+    """Create the blocking OpenAI client for the configured provider"""
+    global _client_kwargs
+
+    provider, _client_kwargs = _detect_provider()
+    if provider is None:
+        return None, None
+
+    client_class = AzureOpenAI if provider == "azure" else OpenAI
+    return provider, client_class(http_client=httpx.Client(**_pool_settings()), **_client_kwargs)
+
+
+def _create_async_client():
+    """Create an AsyncOpenAI client for the configured provider"""
+    client_class = AsyncAzureOpenAI if _provider == "azure" else AsyncOpenAI
+    # Retries happen in acomplete_chat() so throttling reaches the rate limiter
+    return client_class(
+        http_client=httpx.AsyncClient(**_pool_settings()), max_retries=0, **_client_kwargs
+    )
+
+
+def get_client():
+    """
+    Get the shared LLM client, creating it on first use
+
+    Returns:
+        OpenAI/AzureOpenAI client, or None when no API keys are configured
+    """
+    global _client, _provider, _initialized
+
+    if _initialized:
+        return _client
+
+    with _lock:
+        if not _initialized:
+            _provider, _client = _create_client()
+            _initialized = True
+
+    return _client
+
+
+def get_async_client():
+    """
+    Get the async LLM client for the running event loop
+
+    Returns:
+        AsyncOpenAI/AsyncAzureOpenAI client, or None when no API keys are configured
+    """
+    if get_client() is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+
+    if client is None:
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                client = _create_async_client()
+                _async_clients[loop] = client
+
+    return client
+
+
+def get_provider():
+    """Get the active provider name ('github', 'azure', 'openai') or None"""
+    get_client()
+    return _provider
+
+
+def get_model_name():
+    """Get the model (or Azure deployment) name for the active provider"""
+    provider = get_provider()
+
+    if provider is None:
+        return None
+
+    if provider == "azure":
+        return os.getenv("AZURE_OPENAI_DEPLOYMENT", DEFAULT_MODEL)
+
+    if provider == "github":
+        return os.getenv("GITHUB_MODEL") or DEFAULT_MODEL
+
+    return os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+
+
+def close_client():
+    """Close the shared client and its connection pool"""
+    global _client, _provider, _initialized
+
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _async_clients.clear()
+        _client = None
+        _provider = None
+        _initialized = False
+
+
+def _estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Rough prompt + completion token count (~4 characters per token)"""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+@contextmanager
+def stream_to(sink):
+    """
+    Stream completions made inside the with-block (and the tasks it
+    starts) to sink
+
+    acomplete_chat() then requests stream=True and calls sink(text, reset)
+    with each piece of text as it arrives. reset is True when an attempt
+    that had already streamed text failed and another attempt's text
+    starts over. Cached completions are passed on as a single piece.
+
+    Set LLM_STREAMING=false to disable streaming requests.
+    """
+    if os.getenv("LLM_STREAMING", "true").lower() == "false":
+        sink = None
+    token = _delta_sink.set(sink)
+    try:
+        yield
+    finally:
+        _delta_sink.reset(token)
+
+
+def stream_sink():
+    """The sink set by the innermost stream_to() around the caller, or None"""
+    return _delta_sink.get()
+
+
+@contextmanager
+def track_mock_responses():
+    """
+    Record the agents that answer with their offline (mock) response
+    inside the with-block (and the tasks it starts) instead of the model's
+
+    Yields:
+        list: Names passed to note_mock_response(), in order
+    """
+    agents = []
+    token = _mock_responses.set(agents)
+    try:
+        yield agents
+    finally:
+        _mock_responses.reset(token)
+
+
+def note_mock_response(agent: str):
+    """Report that agent answered with its mock response (see track_mock_responses())"""
+    agents = _mock_responses.get()
+    if agents is not None:
+        agents.append(agent)
+
+
+async def acomplete_chat(model: str, messages: list, temperature: float, max_tokens: int,
+                         policy: str = "default", validate=None) -> str:
+    """
+    Run a chat completion through the shared response cache, the agent's
+    call policy and the provider rate limiter
+
+    Throttled calls (HTTP 429) wait out the provider's Retry-After and are
+    retried up to LLM_RATE_LIMIT_RETRIES times (default 5) instead of failing
+    over to the agents' mock responses. Timeouts, connection errors and 5xx
+    responses are retried and hedged according to the call policy.
+
+    Inside stream_to() the completion is streamed and partial text is
+    forwarded as it arrives; the full text is still returned at the end.
+
+    Only replies that pass validate are cached. A cached reply that fails
+    it is dropped and requested again.
+
+    Args:
+        model: Model or Azure deployment name
+        messages: Chat messages
+        temperature: Sampling temperature
+        max_tokens: Completion token limit
+        policy: Call policy name (see call_policy.py), usually the agent's
+        validate: Optional callable(text) raising ValueError for a reply
+            the caller cannot use
+
+    Returns:
+        str: Stripped completion text
+
+    Raises:
+        ValueError: If validate rejects the reply
+    """
+    cache = get_response_cache()
+    key = None
+    sink = _delta_sink.get()
+
+    if cache is not None:
+        key = cache.make_key(model, messages, temperature, max_tokens)
+        cached = cache.get(key)
+        if cached is not None and _valid(cached, validate):
+            if sink is not None:
+                sink(cached, False)
+            return cached
+
+    call_policy = get_call_policy(policy)
+    limiter = get_rate_limiter(get_provider())
+    estimated = _estimate_tokens(messages, max_tokens)
+    # Retries and hedges each stream; only one attempt's text is forwarded
+    streaming = {"owner": None, "failed": set()}
+
+    def forward(attempt_id, text):
+        owner = streaming["owner"]
+        if owner is None or owner in streaming["failed"]:
+            streaming["owner"] = attempt_id
+            sink(text, owner is not None)
+        elif owner == attempt_id:
+            sink(text, False)
+
+    async def request():
+        start = time.monotonic()
+        attempt_id = object()
+        try:
+            if sink is None:
+                completion = _create_completion(model, messages, temperature, max_tokens)
+            else:
+                completion = _stream_completion(
+                    model, messages, temperature, max_tokens,
+                    lambda text: forward(attempt_id, text)
+                )
+            response = await asyncio.wait_for(completion, call_policy.timeout)
+        except BaseException as e:
+            streaming["failed"].add(attempt_id)
+            if isinstance(e, Exception):
+                metrics.inc("llm_errors_total", policy=policy, error=type(e).__name__)
+            raise
+
+        elapsed = time.monotonic() - start
+        call_policy.observe(elapsed)
+        metrics.observe("llm_request_seconds", elapsed, policy=policy)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            metrics.inc("llm_tokens_total", usage.prompt_tokens or 0, policy=policy, kind="prompt")
+            metrics.inc("llm_tokens_total", usage.completion_tokens or 0, policy=policy, kind="completion")
+        return response
+
+    async def attempt():
+        retries = _env_int("LLM_RATE_LIMIT_RETRIES", 5)
+        throttled = 0
+
+        while True:
+            try:
+                if limiter is None:
+                    return await request()
+                async with limiter.slot(estimated):
+                    response = await request()
+                usage = getattr(response, "usage", None)
+                limiter.on_success(estimated, getattr(usage, "total_tokens", None))
+                return response
+            except RateLimitError as e:
+                if throttled >= retries:
+                    raise
+                delay = retry_after_seconds(e, throttled)
+                print(f"[LLM Client] Rate limited by {get_provider()}, retrying in {delay:.1f}s")
+                if limiter is not None:
+                    limiter.on_throttle(delay)
+                else:
+                    await asyncio.sleep(delay)
+                throttled += 1
+
+    response = await call_policy.run(attempt)
+    text = response.choices[0].message.content.strip()
+
+    if validate is not None:
+        validate(text)
+    if cache is not None and text:
+        cache.set(key, text)
+
+    return text
+
+
+def _valid(text: str, validate) -> bool:
+    """True if validate (when given) accepts text"""
+    if validate is None:
+        return True
+    try:
+        validate(text)
+    except ValueError:
+        return False
+    return True
+
+
+async def _create_completion(model: str, messages: list, temperature: float, max_tokens: int):
+    return await get_async_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+
+
+async def _stream_completion(model: str, messages: list, temperature: float, max_tokens: int, on_text):
+    """
+    Request a streamed completion, passing each piece of text to on_text
+
+    Providers only report usage for streams when asked with stream_options,
+    which older Azure API versions reject, so streamed calls record no
+    token counts unless a chunk carries usage anyway.
+    """
+    client = get_async_client()
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+
+    parts = []
+    usage = None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices:
+                text = chunk.choices[0].delta.content
+                if text:
+                    parts.append(text)
+                    on_text(text)
+    except httpx.TransportError as e:
+        # A connection dropped mid-stream isn't wrapped by the SDK; make it
+        # retryable like one dropped before the response
+        raise APIConnectionError(request=httpx.Request("POST", str(client.base_url))) from e
+
+    # Same shape as a non-streamed response
+    message = SimpleNamespace(content="".join(parts))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def complete_chat(model: str, messages: list, temperature: float, max_tokens: int,
+                  policy: str = "default") -> str:
+    """Blocking wrapper around acomplete_chat()"""
+    return run_sync(acomplete_chat(model, messages, temperature, max_tokens, policy))
+
+
+async def acomplete_json(model: str, messages: list, temperature: float, max_tokens: int,
+                         policy: str = "default", agent: str = None, on_field=None,
+                         required: tuple = ()) -> dict:
+    """
+    Run a chat completion that should answer with a JSON object
+
+    The object is extracted with JsonStreamParser, so code fences and prose
+    around it are skipped. With on_field, the completion is streamed and
+    on_field(key, value) is called for each top-level field as soon as its
+    value is complete. When a retried call starts over, on_field(None, None)
+    marks the fields reported so far as void and the new attempt's fields
+    follow; the final response's fields are reported if they differ.
+
+    Responses are only cached once they parse and have every required field.
+
+    Args:
+        model, messages, temperature, max_tokens, policy: As for acomplete_chat()
+        agent: Name recorded in llm_json_parse_total (defaults to policy)
+        on_field: Optional callback for fields completed while streaming
+        required: Fields that must be present and non-empty
+
+    Returns:
+        dict: The parsed object
+
+    Raises:
+        ValueError: If the response holds no valid JSON object or lacks a
+            required field
+    """
+    outer = _delta_sink.get()
+    state = {"parser": JsonStreamParser(), "reported": {}, "result": None}
+
+    def report(fields):
+        for key, value in fields:
+            if on_field is not None and state["reported"].get(key, _UNSET) != value:
+                state["reported"][key] = value
+                on_field(key, value)
+
+    def sink(text, reset):
+        if outer is not None:
+            outer(text, reset)
+        if reset:
+            state["parser"] = JsonStreamParser()
+            if on_field is not None and state["reported"]:
+                state["reported"] = {}
+                on_field(None, None)
+        report(state["parser"].feed(text))
+
+    def parse(text):
+        parser = state["parser"]
+        if parser.text.strip() != text:
+            # Not streamed, a cached reply, or a hedged call other than the
+            # streamed one won
+            parser = JsonStreamParser()
+            parser.feed(text)
+        result = finish_json_response(parser, agent or policy)
+        for field in required:
+            if not result.get(field):
+                raise ValueError(f"response has no '{field}'")
+        state["result"] = result
+
+    if on_field is None and outer is None:
+        await acomplete_chat(model, messages, temperature, max_tokens, policy, validate=parse)
+    else:
+        with stream_to(sink):
+            await acomplete_chat(model, messages, temperature, max_tokens, policy, validate=parse)
+
+    result = state["result"]
+    report(result.items())
+    return result
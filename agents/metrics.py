@@ -0,0 +1,269 @@
+"""
+Metrics Registry
+Process-wide latency histograms and counters for pipeline stages and LLM
+calls, rendered as Prometheus text or as a compact summary
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from agents.call_policy import policy_stats
+from agents.rate_limiter import limiter_stats
+from agents.response_cache import get_analysis_cache, get_response_cache
+
+# Upper bounds (seconds) shared by every latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "pipeline_stage_seconds": ("histogram", "Pipeline stage duration in seconds"),
+    "pipeline_run_seconds": ("histogram", "Full diagnostic pipeline duration in seconds"),
+    "pipeline_stage_errors_total": ("counter", "Pipeline stages that raised"),
+    "speculative_treatment_total": ("counter", "Speculative treatment plans by result (confirmed, wasted)"),
+    "speculative_treatment_lead_seconds": ("histogram", "Seconds a speculative treatment started before reasoning finished"),
+    "llm_request_seconds": ("histogram", "LLM request duration in seconds"),
+    "llm_errors_total": ("counter", "LLM requests that failed"),
+    "llm_tokens_total": ("counter", "Tokens reported in response.usage"),
+    "agent_fallbacks_total": ("counter", "Agent calls that fell back to the mock response"),
+    "llm_json_parse_total": ("counter", "JSON responses parsed by result (ok, recovered, failed)"),
+    "llm_cache_lookups_total": ("counter", "Response cache lookups by result"),
+    "llm_cache_evictions_total": ("counter", "Response cache evictions"),
+    "analysis_cache_lookups_total": ("counter", "Per-image analysis cache lookups by result"),
+    "llm_policy_retries_total": ("counter", "LLM call retries after transient errors"),
+    "llm_policy_timeouts_total": ("counter", "LLM call attempts that timed out"),
+    "llm_policy_failures_total": ("counter", "LLM calls that failed after all retries"),
+    "llm_policy_hedges_sent_total": ("counter", "Hedged duplicate LLM requests sent"),
+    "llm_policy_hedges_won_total": ("counter", "Hedged requests that finished first"),
+    "llm_rate_limit_throttled_total": ("counter", "HTTP 429 responses from the provider"),
+    "llm_rate_limit_concurrency_limit": ("gauge", "Current adaptive concurrency limit"),
+    "llm_rate_limit_in_flight": ("gauge", "LLM calls currently in flight")
+}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket (capped at the max seen)"""
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, self.counts):
+            if cumulative >= rank:
+                in_bucket = cumulative - below
+                fraction = (rank - below) / in_bucket if in_bucket else 1.0
+                return min(self.max, lower + (bound - lower) * fraction)
+            lower, below = bound, cumulative
+        return self.max
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled histograms and counters"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        """Add a sample to a histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Increment a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of the with-block (also inside coroutines)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        """Drop every recorded sample"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.count, h.sum)
+                          for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted({key[0] for key in histograms}):
+            lines.extend(_header(name, "histogram"))
+            for (metric, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, cumulative in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name in sorted({key[0] for key in counters}):
+            lines.extend(_header(name, "counter"))
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        lines.extend(_component_metrics())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """
+        Compact per-label summary for reports
+
+        Returns:
+            dict with stages, llm_calls (count, mean and p95 seconds per
+            label), tokens, errors, fallbacks, JSON parse outcomes and
+            failure rate per agent, speculative treatment outcomes, and response and analysis cache
+            statistics
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            timings = {
+                key: {
+                    "count": h.count,
+                    "mean_seconds": round(h.sum / h.count, 4) if h.count else 0.0,
+                    "p95_seconds": round(h.quantile(0.95), 4)
+                }
+                for key, h in histograms.items()
+            }
+            counters = dict(self._counters)
+
+        def timings_by(name, label):
+            return {
+                dict(labels).get(label, ""): value
+                for (metric, labels), value in sorted(timings.items())
+                if metric == name
+            }
+
+        def totals_by(name, label):
+            totals = {}
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    key = dict(labels).get(label, "")
+                    totals[key] = totals.get(key, 0) + value
+            return totals
+
+        def json_parse_rates():
+            rates = {}
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == "llm_json_parse_total":
+                    labels = dict(labels)
+                    agent = rates.setdefault(labels.get("agent", ""), {"ok": 0, "recovered": 0, "failed": 0})
+                    agent[labels.get("result", "")] = agent.get(labels.get("result", ""), 0) + value
+            for agent in rates.values():
+                total = agent["ok"] + agent["recovered"] + agent["failed"]
+                agent["failure_rate"] = round(agent["failed"] / total, 4) if total else 0.0
+            return rates
+
+        cache = get_response_cache()
+        analysis_cache = get_analysis_cache()
+
+        return {
+            "stages": timings_by("pipeline_stage_seconds", "stage"),
+            "llm_calls": timings_by("llm_request_seconds", "policy"),
+            "tokens": totals_by("llm_tokens_total", "kind"),
+            "errors": totals_by("llm_errors_total", "policy"),
+            "fallbacks": totals_by("agent_fallbacks_total", "agent"),
+            "json_parse": json_parse_rates(),
+            "speculative_treatment": totals_by("speculative_treatment_total", "result"),
+            "cache": cache.stats() if cache is not None else None,
+            "analysis_cache": analysis_cache.stats() if analysis_cache is not None else None
+        }
+
+
+def _header(name: str, kind: str) -> list:
+    help_text = HELP.get(name, (kind, name))[1]
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def _labels(labels: tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _component_metrics() -> list:
+    """Gauges and counters owned by the cache, rate limiters and call policies"""
+    lines = []
+
+    cache = get_response_cache()
+    if cache is not None:
+        stats = cache.stats()
+        lines.extend(_header("llm_cache_lookups_total", "counter"))
+        for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses")):
+            lines.append(f'llm_cache_lookups_total{{result="{result}"}} {stats[key]}')
+        lines.extend(_header("llm_cache_evictions_total", "counter"))
+        lines.append(f"llm_cache_evictions_total {stats['evictions']}")
+
+    analysis_cache = get_analysis_cache()
+    if analysis_cache is not None:
+        stats = analysis_cache.stats()
+        lines.extend(_header("analysis_cache_lookups_total", "counter"))
+        for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses")):
+            lines.append(f'analysis_cache_lookups_total{{result="{result}"}} {stats[key]}')
+
+    policies = policy_stats()
+    for field in ("retries", "timeouts", "failures", "hedges_sent", "hedges_won"):
+        name = f"llm_policy_{field}_total"
+        lines.extend(_header(name, "counter"))
+        for policy, stats in sorted(policies.items()):
+            lines.append(f'{name}{{policy="{policy}"}} {stats[field]}')
+
+    limiters = limiter_stats()
+    for field, kind in (("throttled", "counter"), ("concurrency_limit", "gauge"), ("in_flight", "gauge")):
+        name = f"llm_rate_limit_{field}" + ("_total" if kind == "counter" else "")
+        lines.extend(_header(name, kind))
+        for provider, stats in sorted(limiters.items()):
+            lines.append(f'{name}{{provider="{provider}"}} {stats[field]}')
+
+    return lines
+
+
+metrics = MetricsRegistry()
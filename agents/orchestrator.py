@@ -0,0 +1,177 @@
+"""
+Async Orchestrator
+Runs many diagnostic pipelines concurrently on a single event loop
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+
+from agents.agent_pool import get_agent_pool
+from agents.pipeline import build_diagnostic_pipeline
+from agents.upload_store import file_digest
+
+
+def build_report(results: dict, image_path: str, condition: str) -> dict:
+    """
+    Aggregate pipeline stage results into the final diagnostic report
+
+    Args:
+        results: Stage results from the diagnostic pipeline
+        image_path: Path to the analyzed image
+        condition: Patient's symptoms/condition description
+
+    Returns:
+        dict: Complete diagnostic report
+    """
+    detection_info = results['detection']
+    diagnostic = results['diagnostic']['findings']
+    reasoning = results['reasoning']
+    treatment = results['treatment']
+    followup = results['followup']
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "patient_condition": condition,
+        "image_analyzed": Path(image_path).name,
+        "image_type": detection_info.get("image_type"),
+        "body_part": detection_info.get("body_part"),
+        "imaging_modality": detection_info.get("imaging_modality"),
+        "detection_confidence": detection_info.get("confidence"),
+        "finding": diagnostic.get("finding") if isinstance(diagnostic, dict) else diagnostic,
+        "diagnosis": reasoning.get("diagnosis"),
+        "confidence": reasoning.get("confidence"),
+        "treatment": treatment.get("treatment"),
+        "precautions": treatment.get("precautions", []),
+        "follow_up": followup.get("follow_up"),
+        "timeline": followup.get("timeline"),
+        "patient_instructions": followup.get("patient_instructions"),
+        "agent_workflow": {
+            "step_1": "Image Detection Agent",
+            "step_2": results['diagnostic'].get('agent_used', 'Diagnostic Agent'),
+            "step_3": "Clinical Reasoning Agent",
+            "step_4": "Treatment Agent",
+            "step_5": "Follow-Up Agent"
+        }
+    }
+
+
+class AsyncOrchestrator:
+    """
+    Async orchestrator that shares one set of agents across concurrent diagnoses
+
+    Every pipeline awaits the async LLM client instead of holding a thread,
+    so hundreds of diagnoses can be in flight on a single event loop.
+    """
+
+    def __init__(self, agents=None, early_followup: bool = False, speculative_treatment: bool = False):
+        """
+        Args:
+            agents: Object exposing the pipeline agents (default: the shared AgentPool)
+            early_followup: Plan follow-up care concurrently with the Treatment Agent
+            speculative_treatment: Start treatment from the streamed diagnosis
+        """
+        self.agents = agents or get_agent_pool().get()
+        self.early_followup = early_followup
+        self.speculative_treatment = speculative_treatment
+
+    async def arun_pipeline(self, image_path: str, condition: str, patient_email: str = None,
+                            on_event=None) -> dict:
+        """
+        Run one diagnosis
+
+        Args:
+            image_path: Path to medical image
+            condition: Patient's symptoms/condition description
+            patient_email: Optional email for follow-up reminders
+            on_event: Optional callback receiving pipeline progress events
+
+        Returns:
+            dict: Complete diagnostic report
+        """
+        pipeline = build_diagnostic_pipeline(
+            self.agents, early_followup=self.early_followup,
+            speculative_treatment=self.speculative_treatment
+        )
+        results = await pipeline.arun(
+            {'image_path': image_path, 'condition': condition, 'patient_email': patient_email,
+             'image_digest': await asyncio.to_thread(file_digest, image_path)},
+            on_event=on_event
+        )
+        return build_report(results, image_path, condition)
+
+    async def arun_many(self, cases: list, concurrency: int = 100) -> list:
+        """
+        Run many diagnoses concurrently
+
+        Args:
+            cases: List of dicts with image_path, condition and optional patient_email
+            concurrency: Maximum diagnoses in flight at once
+
+        Returns:
+            list with one report per case, in input order; failed cases hold
+            the exception instead of a report
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_case(case):
+            async with semaphore:
+                return await self.arun_pipeline(
+                    case['image_path'], case['condition'], case.get('patient_email')
+                )
+
+        return await asyncio.gather(*(run_case(case) for case in cases), return_exceptions=True)
+
+    async def arun_batch(self, cases, concurrency: int = 8, on_result=None) -> dict:
+        """
+        Stream cases through a bounded pool of worker tasks
+
+        Cases are pulled from the iterable lazily, so arbitrarily large
+        manifests never sit in memory at once. A failing case is reported
+        through on_result and does not stop the batch.
+
+        Args:
+            cases: Iterable of dicts with image_path, condition and optional patient_email
+            concurrency: Number of diagnoses in flight at once
+            on_result: Optional callback (case, report, error, seconds) invoked
+                as each case finishes; exactly one of report/error is set
+
+        Returns:
+            dict with succeeded and failed counts
+        """
+        pending = asyncio.Queue(maxsize=concurrency * 2)
+        stats = {'succeeded': 0, 'failed': 0}
+
+        async def worker():
+            while True:
+                case = await pending.get()
+                if case is None:
+                    return
+
+                start = time.perf_counter()
+                report, error = None, None
+                try:
+                    report = await self.arun_pipeline(
+                        case['image_path'], case['condition'], case.get('patient_email')
+                    )
+                    stats['succeeded'] += 1
+                except Exception as e:
+                    error = e
+                    stats['failed'] += 1
+
+                if on_result:
+                    on_result(case, report, error, time.perf_counter() - start)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            for case in cases:
+                await pending.put(case)
+            for _ in workers:
+                await pending.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        return stats
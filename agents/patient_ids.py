@@ -0,0 +1,108 @@
+"""
+Patient IDs
+Unique, time-ordered patient IDs in the ULID layout: 'PT' followed by 26
+Crockford base32 characters encoding a 48-bit millisecond timestamp and
+80 random bits
+"""
+
+import os
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+
+PREFIX = "PT"
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_LEGACY_ID = re.compile(r"^PT(\d{14})$")
+
+
+class PatientIdGenerator:
+    """
+    Monotonic ULID generator
+
+    IDs sort by creation time. Within one millisecond (or if the clock
+    steps back) the random part is incremented instead of redrawn, so IDs
+    from one process are strictly increasing. IDs from different processes
+    stay unique because each millisecond starts from 80 fresh random bits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def new(self, timestamp_ms: int = None) -> str:
+        """
+        Generate the next ID
+
+        Args:
+            timestamp_ms: Creation time in Unix milliseconds (default: now)
+
+        Returns:
+            str: ID such as 'PT01JAB3Q8Z5X7M4K9T2W6R1C0VN'
+        """
+        ms = int(time.time() * 1000) if timestamp_ms is None else int(timestamp_ms)
+
+        with self._lock:
+            if ms <= self._last_ms:
+                ms = self._last_ms
+                random_part = self._last_random + 1
+                if random_part >> _RANDOM_BITS:
+                    # 2^80 IDs in one millisecond: move on to the next one
+                    ms += 1
+                    random_part = secrets.randbits(_RANDOM_BITS)
+            else:
+                random_part = secrets.randbits(_RANDOM_BITS)
+            self._last_ms, self._last_random = ms, random_part
+
+        return PREFIX + _encode((ms << _RANDOM_BITS) | random_part)
+
+    def reset(self):
+        """Forget the last ID (a forked child must not continue the parent's sequence)"""
+        with self._lock:
+            self._last_ms = -1
+            self._last_random = 0
+
+
+def _encode(value: int) -> str:
+    chars = []
+    for _ in range(26):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def is_legacy_patient_id(patient_id: str) -> bool:
+    """True for the old second-resolution IDs (PTYYYYMMDDHHMMSS)"""
+    return bool(_LEGACY_ID.match(patient_id or ""))
+
+
+def legacy_timestamp_ms(record: dict) -> int:
+    """
+    Creation time of a legacy record in Unix milliseconds, taken from
+    created_at or, failing that, from the digits of its old ID
+    """
+    candidates = [(record.get('created_at') or '', '%Y-%m-%d %H:%M:%S')]
+    match = _LEGACY_ID.match(record.get('patient_id') or '')
+    if match:
+        candidates.append((match.group(1), '%Y%m%d%H%M%S'))
+
+    for value, fmt in candidates:
+        try:
+            return int(datetime.strptime(value, fmt).timestamp() * 1000)
+        except ValueError:
+            continue
+    return int(time.time() * 1000)
+
+
+_generator = PatientIdGenerator()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_generator.reset)
+
+
+def new_patient_id() -> str:
+    """Generate a new patient ID from the process-wide generator"""
+    return _generator.new()
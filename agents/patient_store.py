@@ -0,0 +1,1186 @@
+"""
+Patient Store
+Storage backends for follow-up patient records: a SQLite database (default)
+and the legacy patients_db.csv file
+"""
+
+import csv
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from agents.patient_ids import PatientIdGenerator, is_legacy_patient_id, legacy_timestamp_ms
+
+PATIENT_FIELDS = [
+    'patient_id', 'timestamp', 'email', 'condition',
+    'diagnosis', 'treatment', 'follow_up_timeline',
+    'follow_up_date', 'email_sent', 'created_at'
+]
+
+LEGACY_CSV_PATH = Path("patients_db.csv")
+DEFAULT_SQLITE_PATH = Path("patients.db")
+
+PATIENT_STATUSES = ('sent', 'pending', 'overdue')
+
+
+class PatientFilter:
+    """Criteria for listing patients; criteria left as None match everything"""
+
+    def __init__(self, date_from: str = None, date_to: str = None, status: str = None,
+                 email: str = None, today: str = None):
+        """
+        Args:
+            date_from: Earliest follow-up date ('YYYY-MM-DD'), inclusive
+            date_to: Latest follow-up date, inclusive
+            status: 'sent', 'pending' or 'overdue' (pending, follow-up before today)
+            email: Case-insensitive substring of the email address
+            today: Reference date for 'overdue' (default: today)
+        """
+        if status is not None and status not in PATIENT_STATUSES:
+            raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(PATIENT_STATUSES)})")
+
+        self.date_from = date_from
+        self.date_to = date_to
+        self.status = status
+        self.email = email.lower() if email else None
+        self.today = today or datetime.now().strftime('%Y-%m-%d')
+
+    def matches(self, record: dict) -> bool:
+        """True if a record meets every criterion"""
+        follow_up_date = record['follow_up_date']
+        if self.date_from and follow_up_date < self.date_from:
+            return False
+        if self.date_to and follow_up_date > self.date_to:
+            return False
+        if self.status == 'sent' and record['email_sent'] != 'Yes':
+            return False
+        if self.status in ('pending', 'overdue') and record['email_sent'] != 'No':
+            return False
+        if self.status == 'overdue' and follow_up_date >= self.today:
+            return False
+        if self.email and self.email not in record['email'].lower():
+            return False
+        return True
+
+    def sql(self):
+        """WHERE clause (possibly empty) and parameters for the patients table"""
+        clauses, params = [], []
+        if self.date_from:
+            clauses.append("follow_up_date >= ?")
+            params.append(self.date_from)
+        if self.date_to:
+            clauses.append("follow_up_date <= ?")
+            params.append(self.date_to)
+        if self.status == 'sent':
+            clauses.append("email_sent = 'Yes'")
+        elif self.status == 'pending':
+            clauses.append("email_sent = 'No'")
+        elif self.status == 'overdue':
+            clauses.append("email_sent = 'No' AND follow_up_date < ?")
+            params.append(self.today)
+        if self.email:
+            escaped = self.email.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("email LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+
+class PatientStore(ABC):
+    """
+    Interface shared by the patient storage backends
+
+    Records are dicts keyed by PATIENT_FIELDS. Dates are ISO strings
+    ('YYYY-MM-DD') and email_sent is 'Yes' or 'No', as in the original CSV.
+    """
+
+    path: Path
+
+    @abstractmethod
+    def add(self, record: dict):
+        """Insert a new patient record"""
+
+    @abstractmethod
+    def get(self, patient_id: str):
+        """Look up one patient, or None if unknown"""
+
+    @abstractmethod
+    def all(self):
+        """Iterate over every patient in registration order"""
+
+    @abstractmethod
+    def find(self, patient_filter: PatientFilter = None, limit: int = 50, offset: int = 0) -> list:
+        """
+        One page of matching patients in registration order
+
+        Only the requested page is held in memory, however large the store.
+
+        Args:
+            patient_filter: Criteria to match (default: every patient)
+            limit: Page size
+            offset: Matching patients to skip
+
+        Returns:
+            list of patient records
+        """
+
+    @abstractmethod
+    def count(self, patient_filter: PatientFilter = None) -> int:
+        """Number of patients matching a filter (default: every patient)"""
+
+    @abstractmethod
+    def due(self, on_date: str, batch_size: int = 500):
+        """
+        Iterate over patients whose follow-up email is due on or before
+        on_date, earliest first
+
+        Records are fetched batch_size at a time, and marking them sent while
+        iterating is safe.
+        """
+
+    @abstractmethod
+    def next_due_date(self, after: str = None):
+        """Earliest follow-up date with an unsent email (later than after, if given), or None"""
+
+    @abstractmethod
+    def next_claim_time(self, on_date: str):
+        """
+        Unix time at which claim_due(on_date) can next claim a patient
+
+        Due patients may be held by another worker's lease or waiting out
+        the retry delay of a failed send. The time is in the past when a
+        patient can be claimed right away.
+
+        Returns:
+            float, or None when no unsent follow-up is due on or before on_date
+        """
+
+    @abstractmethod
+    def mark_sent(self, patient_id: str):
+        """Record that a patient's follow-up email was sent"""
+
+    def record_delivery(self, patient_id: str, sent: bool, detail: str = ""):
+        """
+        Record the outcome of a follow-up email attempt
+
+        Successful deliveries mark the email as sent; failed ones leave the
+        patient due so the next run retries them.
+        """
+        if sent:
+            self.mark_sent(patient_id)
+
+    @abstractmethod
+    def claim_due(self, on_date: str, worker: str, limit: int = 500, lease: float = 300.0) -> list:
+        """
+        Claim up to limit due patients for one sender worker, earliest first
+
+        Claimed patients are held in the outbox for lease seconds, so other
+        workers skip them. Patients whose claim expired (a worker died) or
+        whose failed send has waited out its retry delay can be claimed again.
+
+        Returns:
+            list of patient records
+        """
+
+    @abstractmethod
+    def begin_send(self, patient_id: str, worker: str, lease: float = 300.0) -> bool:
+        """
+        Write-ahead record that worker is about to send a patient's email
+
+        Must be called, and return True, before the email is handed to the
+        mail server. Returns False when the worker no longer holds the claim
+        or the email was already sent; the email must then be skipped.
+        """
+
+    @abstractmethod
+    def finish_send(self, patient_id: str, worker: str, sent: bool, detail: str = "",
+                    retry_after: float = 0.0):
+        """
+        Record the outcome of a send started with begin_send()
+
+        A failed send stays due but is not claimed again for retry_after
+        seconds.
+        """
+
+    @abstractmethod
+    def release_claims(self, worker: str):
+        """Give back a worker's claims that never reached begin_send()"""
+
+    @abstractmethod
+    def counts(self, today: str) -> dict:
+        """
+        Summary counts
+
+        Returns:
+            dict with total, sent, pending, overdue (pending and before today)
+            and upcoming (pending, today or later)
+        """
+
+    def statistics(self, today: str, days: int = 14, top: int = 10) -> dict:
+        """
+        Follow-up statistics with breakdowns for capacity planning
+
+        Args:
+            today: Reference date ('YYYY-MM-DD') for overdue/upcoming
+            days: Length of the per-day window, starting today
+            top: Number of diagnoses to break down (most patients first)
+
+        Returns:
+            dict with the counts() fields, as_of, by_day (follow-ups per
+            date in the window) and by_diagnosis, each entry carrying
+            total, sent and pending
+        """
+        # Backends without a maintained summary compute it in one pass
+        window_end = _add_days(today, days)
+        totals = {'total': 0, 'sent': 0, 'unsent': 0, 'overdue': 0}
+        by_day, by_diagnosis = {}, {}
+        for record in self.all():
+            sent = record['email_sent'] == 'Yes'
+            unsent = record['email_sent'] == 'No'
+            totals['total'] += 1
+            totals['sent'] += sent
+            totals['unsent'] += unsent
+            totals['overdue'] += unsent and record['follow_up_date'] < today
+            if today <= record['follow_up_date'] < window_end:
+                _tally(by_day, record['follow_up_date'], sent)
+            _tally(by_diagnosis, record['diagnosis'], sent)
+
+        return _statistics(
+            totals, today,
+            sorted(by_day.items()),
+            sorted(by_diagnosis.items(), key=lambda item: (-item[1][0], item[0]))[:top]
+        )
+
+    @abstractmethod
+    def clear(self):
+        """Delete every patient record"""
+
+    def export_csv(self, output_path: str) -> int:
+        """
+        Write every record to a CSV file in the legacy column layout
+
+        Returns:
+            int: Number of records written
+        """
+        count = 0
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=PATIENT_FIELDS)
+            writer.writeheader()
+            for record in self.all():
+                writer.writerow(record)
+                count += 1
+        return count
+
+
+class SQLitePatientStore(PatientStore):
+    """
+    SQLite patient store in WAL mode
+
+    Lookups by patient ID and the due-email query use indexes, and marking
+    an email as sent updates a single row instead of rewriting the file.
+
+    Every write is a transaction, so threads (serialized on one connection)
+    and other processes (waiting up to busy_timeout for SQLite's file lock)
+    can write concurrently without losing rows. Registrations arriving
+    together are group-committed by a single writer thread.
+    """
+
+    # Most registrations committed in one transaction by the writer thread
+    MAX_COMMIT_BATCH = 500
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, busy_timeout: float = 30.0):
+        """
+        Args:
+            path: Database file
+            busy_timeout: Seconds to wait for another process's write lock
+        """
+        self.path = Path(path)
+        created = not self.path.exists()
+        if self.path.parent != Path('.'):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self._db = sqlite3.connect(str(self.path), timeout=busy_timeout, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self.migrate_patient_ids()
+        self._ensure_statistics()
+
+        if created:
+            print(f"[Patient Store] Created patient database: {self.path}")
+
+    def _create_schema(self):
+        columns = ", ".join(
+            f"{field} TEXT NOT NULL DEFAULT ''" for field in PATIENT_FIELDS if field != 'patient_id'
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS patients ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                f"patient_id TEXT NOT NULL, {columns})"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_patients_follow_up_date ON patients(follow_up_date)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_patients_email_sent ON patients(email_sent, follow_up_date)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL, "
+                "attempted_at TEXT NOT NULL, status TEXT NOT NULL, detail TEXT NOT NULL DEFAULT '')"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_deliveries_patient_id ON deliveries(patient_id)"
+            )
+            # Send journal: 'claimed' -> 'sending' -> 'sent' | 'failed'. lease_until
+            # (unix time) is when a claim expires or a failed send may be retried
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "patient_id TEXT PRIMARY KEY, status TEXT NOT NULL, worker TEXT NOT NULL, "
+                "lease_until REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, updated_at TEXT NOT NULL)"
+            )
+            # Old IDs replaced by migrate_patient_ids(), still accepted by get()
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS patient_id_aliases ("
+                "legacy_id TEXT NOT NULL, patient_id TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_patient_id_aliases_legacy_id ON patient_id_aliases(legacy_id)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            for statement in _STATISTICS_SCHEMA:
+                self._db.execute(statement)
+
+    @staticmethod
+    def _record(row) -> dict:
+        return {field: row[field] for field in PATIENT_FIELDS}
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction that takes SQLite's write lock up front
+
+        Use for read-then-write work: a deferred transaction would read
+        first and could then fail with 'database is locked' when another
+        process already holds the write lock.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def add(self, record: dict):
+        """
+        Insert a record through the group-commit writer
+
+        Concurrent callers (e.g. API request threads) are queued and the
+        writer thread commits everything waiting in one transaction, so
+        write throughput grows with the request rate instead of paying one
+        commit per registration. Returns once the record is committed.
+        """
+        pending = _PendingInsert(record)
+        self._pending.put(pending)
+        self._start_writer()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="patient-store-writer", daemon=True
+                )
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            if batch[0] is None:
+                return
+            while len(batch) < self.MAX_COMMIT_BATCH:
+                try:
+                    pending = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self._pending.put(None)
+                    break
+                batch.append(pending)
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: list):
+        try:
+            self.add_many([pending.record for pending in batch])
+        except Exception:
+            # Insert one by one so a bad record (e.g. a duplicate ID) fails alone
+            for pending in batch:
+                try:
+                    self.add_many([pending.record])
+                except Exception as e:
+                    pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def add_many(self, records) -> int:
+        """Insert several records in one transaction; returns the number inserted"""
+        with self._transaction():
+            return self._insert(records)
+
+    def _insert(self, records) -> int:
+        # Caller holds the lock and an open transaction
+        placeholders = ", ".join("?" for _ in PATIENT_FIELDS)
+        rows = [tuple(record.get(field) or '' for field in PATIENT_FIELDS) for record in records]
+        self._db.executemany(
+            f"INSERT INTO patients ({', '.join(PATIENT_FIELDS)}) VALUES ({placeholders})", rows
+        )
+        return len(rows)
+
+    def get(self, patient_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+            if row is None:
+                row = self._db.execute(
+                    "SELECT p.* FROM patient_id_aliases a JOIN patients p ON p.patient_id = a.patient_id "
+                    "WHERE a.legacy_id = ? ORDER BY p.id LIMIT 1",
+                    (patient_id,)
+                ).fetchone()
+        return self._record(row) if row else None
+
+    def all(self, batch_size: int = 1000):
+        # Streams in id order, batch_size rows at a time
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT * FROM patients WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._record(row)
+            last_id = rows[-1]['id']
+
+    def find(self, patient_filter: PatientFilter = None, limit: int = 50, offset: int = 0) -> list:
+        where, params = (patient_filter or PatientFilter()).sql()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM patients {where} ORDER BY id LIMIT ? OFFSET ?", (*params, limit, offset)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def count(self, patient_filter: PatientFilter = None) -> int:
+        where, params = (patient_filter or PatientFilter()).sql()
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM patients {where}", params).fetchone()[0]
+
+    def due(self, on_date: str, batch_size: int = 500):
+        # Keyset pagination over the (email_sent, follow_up_date) index only
+        # ever touches due rows, however many patients are registered
+        last_date, last_id = '', 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT * FROM patients WHERE email_sent = 'No' AND follow_up_date <= ? "
+                    "AND (follow_up_date, id) > (?, ?) ORDER BY follow_up_date, id LIMIT ?",
+                    (on_date, last_date, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._record(row)
+            last_date, last_id = rows[-1]['follow_up_date'], rows[-1]['id']
+
+    def next_due_date(self, after: str = None):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(follow_up_date) FROM patients WHERE email_sent = 'No' AND follow_up_date > ?",
+                (after or '',)
+            ).fetchone()
+        return row[0]
+
+    def next_claim_time(self, on_date: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(COALESCE(o.lease_until, 0)) FROM patients p "
+                "LEFT JOIN outbox o ON o.patient_id = p.patient_id "
+                "WHERE p.email_sent = 'No' AND p.follow_up_date <= ?",
+                (on_date,)
+            ).fetchone()
+        return row[0]
+
+    def mark_sent(self, patient_id: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE patients SET email_sent = 'Yes' WHERE patient_id = ? AND email_sent = 'No'",
+                (patient_id,)
+            )
+
+    def record_delivery(self, patient_id: str, sent: bool, detail: str = ""):
+        with self._lock, self._db:
+            if sent:
+                self._db.execute(
+                    "UPDATE patients SET email_sent = 'Yes' WHERE patient_id = ? AND email_sent = 'No'",
+                    (patient_id,)
+                )
+            self._db.execute(
+                "INSERT INTO deliveries (patient_id, attempted_at, status, detail) "
+                "VALUES (?, datetime('now'), ?, ?)",
+                (patient_id, 'sent' if sent else 'failed', detail or '')
+            )
+
+    def claim_due(self, on_date: str, worker: str, limit: int = 500, lease: float = 300.0) -> list:
+        now = time.time()
+        # The write lock is taken before reading, so workers in other
+        # processes cannot claim the same rows in between
+        with self._transaction():
+            rows = self._db.execute(
+                "SELECT p.*, o.status AS outbox_status FROM patients p "
+                "LEFT JOIN outbox o ON o.patient_id = p.patient_id "
+                "WHERE p.email_sent = 'No' AND p.follow_up_date <= ? "
+                "AND (o.patient_id IS NULL OR o.lease_until <= ?) "
+                "ORDER BY p.follow_up_date, p.id LIMIT ?",
+                (on_date, now, limit)
+            ).fetchall()
+            self._db.executemany(
+                "INSERT INTO outbox (patient_id, status, worker, lease_until, updated_at) "
+                "VALUES (?, 'claimed', ?, ?, datetime('now')) "
+                "ON CONFLICT(patient_id) DO UPDATE SET status = 'claimed', worker = excluded.worker, "
+                "lease_until = excluded.lease_until, updated_at = excluded.updated_at",
+                [(row['patient_id'], worker, now + lease) for row in rows]
+            )
+
+        interrupted = sum(1 for row in rows if row['outbox_status'] == 'sending')
+        if interrupted:
+            print(f"[Patient Store] Resending {interrupted} follow-up(s) interrupted mid-send")
+        return [self._record(row) for row in rows]
+
+    def begin_send(self, patient_id: str, worker: str, lease: float = 300.0) -> bool:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, lease_until = ?, "
+                "updated_at = datetime('now') "
+                "WHERE patient_id = ? AND worker = ? AND status = 'claimed' AND EXISTS ("
+                "SELECT 1 FROM patients WHERE patient_id = ? AND email_sent = 'No')",
+                (time.time() + lease, patient_id, worker, patient_id)
+            )
+        return cursor.rowcount == 1
+
+    def finish_send(self, patient_id: str, worker: str, sent: bool, detail: str = "",
+                    retry_after: float = 0.0):
+        # Patient row, delivery log and outbox entry change in one transaction
+        with self._lock, self._db:
+            if sent:
+                self._db.execute(
+                    "UPDATE patients SET email_sent = 'Yes' WHERE patient_id = ? AND email_sent = 'No'",
+                    (patient_id,)
+                )
+            self._db.execute(
+                "INSERT INTO deliveries (patient_id, attempted_at, status, detail) "
+                "VALUES (?, datetime('now'), ?, ?)",
+                (patient_id, 'sent' if sent else 'failed', detail or '')
+            )
+            self._db.execute(
+                "UPDATE outbox SET status = ?, lease_until = ?, updated_at = datetime('now') "
+                "WHERE patient_id = ? AND worker = ?",
+                ('sent' if sent else 'failed', 0 if sent else time.time() + retry_after, patient_id, worker)
+            )
+
+    def release_claims(self, worker: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET lease_until = 0, updated_at = datetime('now') "
+                "WHERE worker = ? AND status = 'claimed'",
+                (worker,)
+            )
+
+    def outbox_counts(self) -> dict:
+        """Number of outbox entries per status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def deliveries(self, patient_id: str) -> list:
+        """Delivery attempts for a patient, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT attempted_at, status, detail FROM deliveries WHERE patient_id = ? ORDER BY id",
+                (patient_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self, today: str) -> dict:
+        totals = self._totals(today)
+        return {
+            'total': totals['total'],
+            'sent': totals['sent'],
+            'pending': totals['total'] - totals['sent'],
+            'overdue': totals['overdue'],
+            'upcoming': totals['unsent'] - totals['overdue']
+        }
+
+    def statistics(self, today: str, days: int = 14, top: int = 10) -> dict:
+        totals = self._totals(today)
+        with self._lock:
+            by_day = self._db.execute(
+                "SELECT follow_up_date, total, sent FROM stats_daily "
+                "WHERE follow_up_date >= ? AND follow_up_date < ? AND total > 0 ORDER BY follow_up_date",
+                (today, _add_days(today, days))
+            ).fetchall()
+            by_diagnosis = self._db.execute(
+                "SELECT diagnosis, total, sent FROM stats_diagnosis WHERE total > 0 "
+                "ORDER BY total DESC, diagnosis LIMIT ?",
+                (top,)
+            ).fetchall()
+
+        return _statistics(
+            totals, today,
+            [(row[0], (row[1], row[2])) for row in by_day],
+            [(row[0], (row[1], row[2])) for row in by_diagnosis]
+        )
+
+    def _totals(self, today: str) -> dict:
+        """The maintained totals, with overdue rolled forward to today"""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM stats_totals WHERE id = 1").fetchone()
+        if row['rolled_through'] == today:
+            return dict(row)
+
+        # Overdue counts unsent follow-ups dated before rolled_through. When
+        # the day changes, move the days in between across in one range
+        # query over the per-day summary (a few rows, not the patient table)
+        with self._transaction():
+            rolled = self._db.execute("SELECT rolled_through FROM stats_totals WHERE id = 1").fetchone()[0]
+            low, high, sign = (rolled, today, 1) if rolled < today else (today, rolled, -1)
+            moved = self._db.execute(
+                "SELECT COALESCE(SUM(unsent), 0) FROM stats_daily WHERE follow_up_date >= ? AND follow_up_date < ?",
+                (low, high)
+            ).fetchone()[0]
+            self._db.execute(
+                "UPDATE stats_totals SET overdue = overdue + ?, rolled_through = ? WHERE id = 1",
+                (sign * moved, today)
+            )
+            row = self._db.execute("SELECT * FROM stats_totals WHERE id = 1").fetchone()
+        return dict(row)
+
+    def _ensure_statistics(self):
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'statistics'").fetchone():
+                return
+        self.rebuild_statistics()
+
+    def rebuild_statistics(self, today: str = None):
+        """
+        Recompute the statistics summary from the patient table
+
+        Runs automatically once for databases created before the summary
+        existed; triggers keep it current from then on.
+        """
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        with self._transaction():
+            for table in ("stats_totals", "stats_daily", "stats_diagnosis"):
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.execute(
+                "INSERT INTO stats_totals (id, total, sent, unsent, overdue, rolled_through) "
+                "SELECT 1, COUNT(*), COALESCE(SUM(email_sent = 'Yes'), 0), COALESCE(SUM(email_sent = 'No'), 0), "
+                "COALESCE(SUM(email_sent = 'No' AND follow_up_date < ?), 0), ? FROM patients",
+                (today, today)
+            )
+            self._db.execute(
+                "INSERT INTO stats_daily (follow_up_date, total, sent, unsent) "
+                "SELECT follow_up_date, COUNT(*), SUM(email_sent = 'Yes'), SUM(email_sent = 'No') "
+                "FROM patients GROUP BY follow_up_date"
+            )
+            self._db.execute(
+                "INSERT INTO stats_diagnosis (diagnosis, total, sent) "
+                "SELECT diagnosis, COUNT(*), SUM(email_sent = 'Yes') FROM patients GROUP BY diagnosis"
+            )
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('statistics', '1')")
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM patients")
+            self._db.execute("DELETE FROM outbox")
+            self._db.execute("DELETE FROM patient_id_aliases")
+
+    def migrated_from(self):
+        """Path of the CSV file this database was migrated from, if any"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone()
+        return row[0] if row else None
+
+    def migrate_csv(self, csv_path=LEGACY_CSV_PATH) -> int:
+        """
+        Import a legacy patients_db.csv file
+
+        Runs once per database: the source path is recorded, and later calls
+        return 0. The records, the aliases of reassigned IDs and that marker
+        are written in one transaction, so an interrupted import leaves
+        nothing behind and is simply run again. The CSV file itself is left
+        untouched.
+
+        Returns:
+            int: Number of records imported
+        """
+        csv_path = Path(csv_path)
+        if self.migrated_from() or not csv_path.exists():
+            return 0
+
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            records = [record for record in csv.DictReader(f) if record.get('patient_id')]
+
+        with self._transaction():
+            # Another process may have migrated while we waited for the lock
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone():
+                return 0
+
+            # Only the CSV's own IDs are looked up, however large the database
+            ids = [record['patient_id'] for record in records]
+            taken = set()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                taken.update(row[0] for row in self._db.execute(
+                    f"SELECT patient_id FROM patients WHERE patient_id IN ({', '.join('?' for _ in chunk)})", chunk
+                ))
+            aliases = []
+            for index, new_id in _reassigned_ids(records, taken):
+                aliases.append((records[index]['patient_id'], new_id))
+                records[index] = dict(records[index], patient_id=new_id)
+
+            imported = self._insert(records)
+            self._db.executemany(
+                "INSERT INTO patient_id_aliases (legacy_id, patient_id) VALUES (?, ?)", aliases
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (str(csv_path),)
+            )
+
+        print(f"[Patient Store] Migrated {imported} patient(s) from {csv_path}")
+        return imported
+
+    def migrate_patient_ids(self) -> int:
+        """
+        Replace legacy second-resolution patient IDs with unique ULIDs
+
+        Runs once per database, then enforces unique patient IDs with an
+        index. Old IDs are kept as aliases, so get() still finds a patient
+        by the ID quoted in an earlier email. When several records shared
+        one legacy ID, the earliest takes over its delivery history.
+
+        Returns:
+            int: Number of records given a new ID
+        """
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'patient_ids'").fetchone():
+                return 0
+
+        with self._transaction():
+            # Another process may have migrated while we waited for the lock
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'patient_ids'").fetchone():
+                return 0
+
+            records = [
+                dict(row) for row in self._db.execute(
+                    "SELECT id, patient_id, created_at FROM patients ORDER BY id"
+                )
+            ]
+            changes = _reassigned_ids(records)
+            changed = {index for index, _ in changes}
+            history_owners = {
+                record['patient_id'] for index, record in enumerate(records) if index not in changed
+            }
+
+            for index, new_id in changes:
+                record = records[index]
+                old_id = record['patient_id']
+                self._db.execute("UPDATE patients SET patient_id = ? WHERE id = ?", (new_id, record['id']))
+                self._db.execute(
+                    "INSERT INTO patient_id_aliases (legacy_id, patient_id) VALUES (?, ?)", (old_id, new_id)
+                )
+                if old_id not in history_owners:
+                    history_owners.add(old_id)
+                    self._db.execute("UPDATE deliveries SET patient_id = ? WHERE patient_id = ?", (new_id, old_id))
+                    self._db.execute("UPDATE outbox SET patient_id = ? WHERE patient_id = ?", (new_id, old_id))
+
+            self._db.execute("DROP INDEX IF EXISTS idx_patients_patient_id")
+            self._db.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_patient_id_unique ON patients(patient_id)"
+            )
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('patient_ids', 'ulid')")
+
+        if changes:
+            print(f"[Patient Store] Assigned new IDs to {len(changes)} patient(s) with legacy or duplicate IDs")
+        return len(changes)
+
+    def close(self):
+        """Stop the writer thread (after it commits queued records) and close the database"""
+        with self._writer_lock:
+            if self._writer is not None and self._writer.is_alive():
+                self._pending.put(None)
+                self._writer.join()
+            self._writer = None
+        with self._lock:
+            self._db.close()
+
+
+class _PendingInsert:
+    """A record waiting for the group-commit writer"""
+
+    __slots__ = ("record", "done", "error")
+
+    def __init__(self, record: dict):
+        self.record = record
+        self.done = threading.Event()
+        self.error = None
+
+
+def _stats_contribution(row: str, sign: str) -> str:
+    """Trigger statements adding (sign '+') or removing ('-') one patient row from the summary"""
+    sent = f"({row}.email_sent = 'Yes')"
+    unsent = f"({row}.email_sent = 'No')"
+    return (
+        f"UPDATE stats_totals SET total = total {sign} 1, sent = sent {sign} {sent}, "
+        f"unsent = unsent {sign} {unsent}, "
+        f"overdue = overdue {sign} ({unsent} AND {row}.follow_up_date < rolled_through) WHERE id = 1; "
+        f"INSERT INTO stats_daily (follow_up_date, total, sent, unsent) "
+        f"VALUES ({row}.follow_up_date, {sign}1, {sign}{sent}, {sign}{unsent}) "
+        f"ON CONFLICT(follow_up_date) DO UPDATE SET total = total + excluded.total, "
+        f"sent = sent + excluded.sent, unsent = unsent + excluded.unsent; "
+        f"INSERT INTO stats_diagnosis (diagnosis, total, sent) VALUES ({row}.diagnosis, {sign}1, {sign}{sent}) "
+        f"ON CONFLICT(diagnosis) DO UPDATE SET total = total + excluded.total, sent = sent + excluded.sent; "
+    )
+
+
+# Statistics summary kept current by triggers, in the same transaction as
+# the patient write, so every process sees consistent counts. Overdue holds
+# unsent follow-ups dated before rolled_through and is rolled forward on read.
+_STATISTICS_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS stats_totals ("
+    "id INTEGER PRIMARY KEY CHECK (id = 1), total INTEGER NOT NULL, sent INTEGER NOT NULL, "
+    "unsent INTEGER NOT NULL, overdue INTEGER NOT NULL, rolled_through TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS stats_daily ("
+    "follow_up_date TEXT PRIMARY KEY, total INTEGER NOT NULL, sent INTEGER NOT NULL, unsent INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS stats_diagnosis ("
+    "diagnosis TEXT PRIMARY KEY, total INTEGER NOT NULL, sent INTEGER NOT NULL)",
+    # Diagnoses are free text, so the table keeps growing: the top-N query
+    # walks this index and stops after N rows instead of sorting the table
+    "CREATE INDEX IF NOT EXISTS idx_stats_diagnosis_total ON stats_diagnosis(total DESC, diagnosis)",
+    "CREATE TRIGGER IF NOT EXISTS stats_patient_insert AFTER INSERT ON patients BEGIN "
+    + _stats_contribution("NEW", "+") + "END",
+    "CREATE TRIGGER IF NOT EXISTS stats_patient_delete AFTER DELETE ON patients BEGIN "
+    + _stats_contribution("OLD", "-") + "END",
+    "CREATE TRIGGER IF NOT EXISTS stats_patient_update "
+    "AFTER UPDATE OF email_sent, follow_up_date, diagnosis ON patients BEGIN "
+    + _stats_contribution("OLD", "-") + _stats_contribution("NEW", "+") + "END"
+]
+
+
+def _add_days(day: str, days: int) -> str:
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _tally(groups: dict, key: str, sent: bool):
+    total, sent_count = groups.get(key, (0, 0))
+    groups[key] = (total + 1, sent_count + sent)
+
+
+def _statistics(totals: dict, today: str, by_day: list, by_diagnosis: list) -> dict:
+    """Shape totals and (key, (total, sent)) breakdowns into a statistics() result"""
+    return {
+        'as_of': today,
+        'total': totals['total'],
+        'sent': totals['sent'],
+        'pending': totals['total'] - totals['sent'],
+        'overdue': totals['overdue'],
+        'upcoming': totals['unsent'] - totals['overdue'],
+        'by_day': [
+            {'date': day, 'total': total, 'sent': sent, 'pending': total - sent}
+            for day, (total, sent) in by_day
+        ],
+        'by_diagnosis': [
+            {'diagnosis': diagnosis, 'total': total, 'sent': sent, 'pending': total - sent}
+            for diagnosis, (total, sent) in by_diagnosis
+        ]
+    }
+
+
+def _reassigned_ids(records: list, taken=()) -> list:
+    """
+    New IDs for records whose ID is a legacy timestamp ID or already in use
+
+    Records are visited oldest first and new IDs keep their creation time,
+    so migrated records sort where they were registered.
+
+    Returns:
+        list of (index into records, new patient ID)
+    """
+    generator = PatientIdGenerator()
+    seen = set(taken)
+    order = sorted(range(len(records)), key=lambda i: (records[i].get('created_at') or '', i))
+
+    changes = []
+    for index in order:
+        patient_id = records[index]['patient_id']
+        if is_legacy_patient_id(patient_id) or patient_id in seen:
+            changes.append((index, generator.new(legacy_timestamp_ms(records[index]))))
+        seen.add(patient_id)
+    return changes
+
+
+class CSVPatientStore(PatientStore):
+    """
+    Legacy CSV patient store
+
+    Every query scans the file and mark_sent() rewrites it; kept for
+    setups that still read patients_db.csv directly. Reads and writes hold
+    an exclusive lock on a sidecar <file>.lock, and rewrites replace the
+    file atomically, so threads and processes never see or produce a
+    half-written file. Outbox claims live in memory only, so this backend
+    supports a single sender process and is not crash-safe.
+    """
+
+    def __init__(self, path=LEGACY_CSV_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._outbox = {}
+        self._outbox_lock = threading.Lock()
+
+        with self._locked():
+            if not self.path.exists():
+                self._write([])
+                print(f"[Patient Store] Created patient database: {self.path}")
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and the inter-process file lock"""
+        with self._lock, _file_lock(self.path.with_name(self.path.name + '.lock')):
+            yield
+
+    def _read(self) -> list:
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            return list(csv.DictReader(f))
+
+    def _write(self, patients: list):
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=PATIENT_FIELDS)
+            writer.writeheader()
+            writer.writerows(patients)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def add(self, record: dict):
+        with self._locked(), open(self.path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow([record.get(field) or '' for field in PATIENT_FIELDS])
+
+    @contextmanager
+    def _rows(self):
+        """Stream the file's records one at a time under the lock"""
+        with self._locked(), open(self.path, 'r', encoding='utf-8', newline='') as f:
+            yield csv.DictReader(f)
+
+    def get(self, patient_id: str):
+        with self._rows() as rows:
+            return next((p for p in rows if p['patient_id'] == patient_id), None)
+
+    def all(self):
+        with self._locked():
+            return self._read()
+
+    def find(self, patient_filter: PatientFilter = None, limit: int = 50, offset: int = 0) -> list:
+        patient_filter = patient_filter or PatientFilter()
+        page = []
+        with self._rows() as rows:
+            for patient in rows:
+                if not patient_filter.matches(patient):
+                    continue
+                if offset:
+                    offset -= 1
+                    continue
+                page.append(patient)
+                if len(page) >= limit:
+                    break
+        return page
+
+    def count(self, patient_filter: PatientFilter = None) -> int:
+        patient_filter = patient_filter or PatientFilter()
+        with self._rows() as rows:
+            return sum(1 for patient in rows if patient_filter.matches(patient))
+
+    def due(self, on_date: str, batch_size: int = 500):
+        with self._locked():
+            patients = [
+                p for p in self._read()
+                if p['email_sent'] == 'No' and p['follow_up_date'] <= on_date
+            ]
+        return iter(sorted(patients, key=lambda p: p['follow_up_date']))
+
+    def next_due_date(self, after: str = None):
+        with self._locked():
+            pending = [
+                p['follow_up_date'] for p in self._read()
+                if p['email_sent'] == 'No' and p['follow_up_date'] > (after or '')
+            ]
+        return min(pending) if pending else None
+
+    def next_claim_time(self, on_date: str):
+        due = [p['patient_id'] for p in self.due(on_date)]
+        with self._outbox_lock:
+            times = [self._outbox[i]['lease_until'] if i in self._outbox else 0 for i in due]
+        return min(times) if times else None
+
+    def mark_sent(self, patient_id: str):
+        with self._locked():
+            patients = self._read()
+            for patient in patients:
+                if patient['patient_id'] == patient_id:
+                    patient['email_sent'] = 'Yes'
+            self._write(patients)
+
+    def claim_due(self, on_date: str, worker: str, limit: int = 500, lease: float = 300.0) -> list:
+        now = time.time()
+        claimed = []
+        with self._outbox_lock:
+            for patient in self.due(on_date):
+                entry = self._outbox.get(patient['patient_id'])
+                if entry is None or entry['lease_until'] <= now:
+                    self._outbox[patient['patient_id']] = {
+                        'status': 'claimed', 'worker': worker, 'lease_until': now + lease
+                    }
+                    claimed.append(patient)
+                    if len(claimed) >= limit:
+                        break
+        return claimed
+
+    def begin_send(self, patient_id: str, worker: str, lease: float = 300.0) -> bool:
+        with self._outbox_lock:
+            entry = self._outbox.get(patient_id)
+            if entry is None or entry['worker'] != worker or entry['status'] != 'claimed':
+                return False
+            entry.update(status='sending', lease_until=time.time() + lease)
+            return True
+
+    def finish_send(self, patient_id: str, worker: str, sent: bool, detail: str = "",
+                    retry_after: float = 0.0):
+        self.record_delivery(patient_id, sent, detail)
+        with self._outbox_lock:
+            entry = self._outbox.get(patient_id)
+            if entry is not None and entry['worker'] == worker:
+                entry.update(status='sent' if sent else 'failed',
+                             lease_until=0 if sent else time.time() + retry_after)
+
+    def release_claims(self, worker: str):
+        with self._outbox_lock:
+            for entry in self._outbox.values():
+                if entry['worker'] == worker and entry['status'] == 'claimed':
+                    entry['lease_until'] = 0
+
+    def counts(self, today: str) -> dict:
+        # One streaming pass over the file
+        total = sent = overdue = 0
+        with self._rows() as rows:
+            for patient in rows:
+                total += 1
+                if patient['email_sent'] == 'Yes':
+                    sent += 1
+                elif patient['email_sent'] == 'No' and patient['follow_up_date'] < today:
+                    overdue += 1
+        return {
+            'total': total,
+            'sent': sent,
+            'pending': total - sent,
+            'overdue': overdue,
+            'upcoming': total - sent - overdue
+        }
+
+    def clear(self):
+        with self._locked():
+            self._write([])
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    """Exclusive lock shared with other processes, held for the with-block"""
+    with open(lock_path, 'a+') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def patient_db_backend() -> str:
+    """Configured backend name: 'sqlite' (default) or 'csv'"""
+    return os.getenv("PATIENT_DB_BACKEND", "sqlite").lower()
+
+
+def patient_db_path() -> Path:
+    """Configured database path, without opening it"""
+    default = LEGACY_CSV_PATH if patient_db_backend() == "csv" else DEFAULT_SQLITE_PATH
+    return Path(os.getenv("PATIENT_DB_PATH") or default)
+
+
+def get_patient_store() -> PatientStore:
+    """
+    Get the process-wide patient store
+
+    Configured through the environment:
+        PATIENT_DB_BACKEND       - 'sqlite' (default) or 'csv'
+        PATIENT_DB_PATH          - Database file (default patients.db, or
+                                   patients_db.csv for the csv backend)
+        PATIENT_DB_BUSY_TIMEOUT  - Seconds a SQLite write waits for another
+                                   process's lock (default 30)
+
+    A new SQLite database imports an existing patients_db.csv once.
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if patient_db_backend() == "csv":
+                    _store = CSVPatientStore(patient_db_path())
+                else:
+                    store = SQLitePatientStore(
+                        patient_db_path(), busy_timeout=float(os.getenv("PATIENT_DB_BUSY_TIMEOUT", 30))
+                    )
+                    store.migrate_csv(LEGACY_CSV_PATH)
+                    _store = store
+
+    return _store
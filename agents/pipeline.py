@@ -0,0 +1,464 @@
+"""
+Diagnostic Pipeline Executor
+Runs pipeline stages as a dependency graph on the event loop, starting every
+stage as soon as the stages it reads from have finished
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import time
+
+from agents.event_loop import get_event_loop
+from agents.llm_client import stream_sink, stream_to, track_mock_responses
+from agents.metrics import metrics
+from agents.response_cache import get_analysis_cache
+
+
+class Stage:
+    """A single pipeline stage and the results it depends on"""
+
+    def __init__(self, name: str, func, inputs: tuple = (), step: int = None):
+        """
+        Args:
+            name: Stage name; its result is stored under this key
+            func: Coroutine function invoked with one keyword argument per input
+            inputs: Names of context values or earlier stage results to pass in
+            step: Display step number (1-5); None for internal stages that
+                should not emit progress events
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.step = step
+
+
+class PipelineExecutor:
+    """Executes stages in dependency order, running independent stages concurrently"""
+
+    def __init__(self, stages: list, cleanup=None):
+        """
+        Args:
+            stages: Stage objects, in any order
+            cleanup: Optional callable run when a run ends, however it ends
+                (e.g. to cancel work stages started ahead of a later stage)
+        """
+        self.stages = list(stages)
+        self.cleanup = cleanup
+        self._validate()
+
+    def _validate(self):
+        """Reject duplicate stage names and dependency cycles"""
+        names = [stage.name for stage in self.stages]
+        if len(names) != len(set(names)):
+            raise ValueError("Pipeline stage names must be unique")
+
+        visiting, done = set(), set()
+        by_name = {stage.name: stage for stage in self.stages}
+
+        def visit(name):
+            if name in done or name not in by_name:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline dependency cycle at stage '{name}'")
+            visiting.add(name)
+            for dep in by_name[name].inputs:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in names:
+            visit(name)
+
+    async def astream(self, context: dict, deltas: bool = False):
+        """
+        Run the pipeline, yielding progress events as stages start and finish
+
+        Args:
+            context: Initial values (e.g. image_path, condition) stages may read
+            deltas: Stream the stages' LLM completions and yield their text
+                as it arrives
+
+        Yields:
+            dict events:
+                - {'type': 'step_start', 'stage', 'step'}
+                - {'type': 'step_delta', 'stage', 'step', 'text', 'reset'}
+                  when deltas is set; reset means the stage's streamed text
+                  so far should be discarded (a retried call started over)
+                - {'type': 'step_complete', 'stage', 'step', 'result', 'seconds'}
+                - {'type': 'complete', 'results'} once every stage has finished
+
+        Raises:
+            The first exception raised by any stage; stages still running
+            are cancelled.
+        """
+        values = dict(context)
+        seconds = {}
+        pending = list(self.stages)
+        running = {}
+        delta_queue = asyncio.Queue() if deltas else None
+        next_delta = None
+        missing = {
+            dep for stage in self.stages for dep in stage.inputs
+            if dep not in values and dep not in {s.name for s in self.stages}
+        }
+        if missing:
+            raise ValueError(f"Pipeline inputs not provided: {', '.join(sorted(missing))}")
+
+        start = time.perf_counter()
+        try:
+            while pending or running:
+                # Start every stage whose inputs are ready
+                for stage in [s for s in pending if all(dep in values for dep in s.inputs)]:
+                    pending.remove(stage)
+                    if stage.step is not None:
+                        yield {'type': 'step_start', 'stage': stage.name, 'step': stage.step}
+                    kwargs = {dep: values[dep] for dep in stage.inputs}
+                    sink = self._delta_sink(stage, delta_queue) if deltas and stage.step is not None else None
+                    running[asyncio.ensure_future(self._timed(stage, kwargs, seconds, sink))] = stage
+
+                waiting = set(running)
+                if delta_queue is not None:
+                    if next_delta is None:
+                        next_delta = asyncio.ensure_future(delta_queue.get())
+                    waiting.add(next_delta)
+
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                done.discard(next_delta)
+                if next_delta is not None and next_delta.done():
+                    yield next_delta.result()
+                    next_delta = None
+                if delta_queue is not None:
+                    # Text a stage streamed always comes before its step_complete
+                    while not delta_queue.empty():
+                        yield delta_queue.get_nowait()
+
+                for task in done:
+                    stage = running.pop(task)
+                    values[stage.name] = task.result()
+                    if stage.step is not None:
+                        yield {
+                            'type': 'step_complete',
+                            'stage': stage.name,
+                            'step': stage.step,
+                            'result': values[stage.name],
+                            'seconds': seconds[stage.name]
+                        }
+
+            metrics.observe("pipeline_run_seconds", time.perf_counter() - start)
+            yield {
+                'type': 'complete',
+                'results': {stage.name: values[stage.name] for stage in self.stages}
+            }
+        finally:
+            for task in running:
+                task.cancel()
+            if next_delta is not None:
+                next_delta.cancel()
+            if self.cleanup is not None:
+                self.cleanup()
+
+    @staticmethod
+    def _delta_sink(stage: Stage, delta_queue: asyncio.Queue):
+        """Callback turning a stage's streamed completion text into step_delta events"""
+        def sink(text, reset):
+            delta_queue.put_nowait({
+                'type': 'step_delta',
+                'stage': stage.name,
+                'step': stage.step,
+                'text': text,
+                'reset': reset
+            })
+        return sink
+
+    @staticmethod
+    async def _timed(stage: Stage, kwargs: dict, seconds: dict, sink=None):
+        """Run one stage, recording its duration and any error"""
+        start = time.perf_counter()
+        try:
+            with stream_to(sink):
+                return await stage.func(**kwargs)
+        except Exception:
+            metrics.inc("pipeline_stage_errors_total", stage=stage.name)
+            raise
+        finally:
+            seconds[stage.name] = time.perf_counter() - start
+            metrics.observe("pipeline_stage_seconds", seconds[stage.name], stage=stage.name)
+
+    async def arun(self, context: dict, on_event=None, deltas: bool = False) -> dict:
+        """
+        Run the pipeline to completion
+
+        Args:
+            context: Initial values stages may read
+            on_event: Optional callback receiving each progress event
+            deltas: Also send step_delta events with streamed LLM text
+
+        Returns:
+            dict of stage name -> stage result
+        """
+        async for event in self.astream(context, deltas):
+            if event['type'] == 'complete':
+                return event['results']
+            if on_event:
+                on_event(event)
+
+    def stream(self, context: dict, deltas: bool = False):
+        """Blocking version of astream() for synchronous callers"""
+        events = queue.Queue()
+
+        async def pump():
+            try:
+                async for event in self.astream(context, deltas):
+                    events.put((event, None))
+            except Exception as e:
+                events.put((None, e))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+        try:
+            while True:
+                event, error = events.get()
+                if error is not None:
+                    raise error
+                yield event
+                if event['type'] == 'complete':
+                    return
+        finally:
+            future.cancel()
+
+    def run(self, context: dict, on_event=None, deltas: bool = False) -> dict:
+        """Blocking version of arun()"""
+        for event in self.stream(context, deltas):
+            if event['type'] == 'complete':
+                return event['results']
+            if on_event:
+                on_event(event)
+
+
+# Analyses currently running, so concurrent requests for the same image share one
+_inflight = {}
+
+
+async def cached_analysis(stage: str, image_digest: str, inputs: dict, compute):
+    """
+    Serve a per-image stage result from the analysis cache, computing it once
+
+    Concurrent calls with the same key wait for the first one instead of
+    repeating the analysis. Results an agent answered with its mock
+    response (see track_mock_responses()) are returned but not cached.
+
+    Args:
+        stage: Stage name, part of the cache key
+        image_digest: SHA-256 of the image; None disables caching
+        inputs: JSON-serialisable stage inputs besides the image bytes
+        compute: Coroutine function producing the result on a miss
+
+    Returns:
+        The stage result
+    """
+    cache = get_analysis_cache()
+    if cache is None or not image_digest:
+        return await compute()
+
+    payload = json.dumps({'stage': stage, 'image': image_digest, 'inputs': inputs},
+                         sort_keys=True, ensure_ascii=False)
+    key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"[Pipeline] {stage}: using cached result for image {image_digest[:12]}")
+        return json.loads(cached)
+
+    flight = (id(asyncio.get_running_loop()), key)
+    running = _inflight.get(flight)
+    if running is not None:
+        print(f"[Pipeline] {stage}: waiting for the running analysis of image {image_digest[:12]}")
+        return await asyncio.shield(running)
+
+    # The task copies the current context, so it reports into mocked
+    with track_mock_responses() as mocked:
+        future = asyncio.ensure_future(compute())
+    _inflight[flight] = future
+    try:
+        result = await asyncio.shield(future)
+    finally:
+        if future.done():
+            _inflight.pop(flight, None)
+        else:
+            # Caller was cancelled; let the analysis finish for the others
+            future.add_done_callback(lambda _: _inflight.pop(flight, None))
+
+    if mocked:
+        print(f"[Pipeline] {stage}: not caching mock result from {', '.join(mocked)}")
+    else:
+        cache.set(key, json.dumps(result))
+    return result
+
+
+class _DeltaRelay:
+    """Holds a speculative call's streamed text until the stage that adopts it is streaming"""
+
+    def __init__(self):
+        self._pending = []
+        self._sink = None
+
+    def __call__(self, text, reset):
+        if self._sink is None:
+            self._pending.append((text, reset))
+        else:
+            self._sink(text, reset)
+
+    def attach(self, sink):
+        """Replay held text to sink and forward everything after it"""
+        if sink is None:
+            return
+        for text, reset in self._pending:
+            sink(text, reset)
+        self._pending.clear()
+        self._sink = sink
+
+
+def build_diagnostic_pipeline(agents, early_followup: bool = False, email_resolver=None,
+                              speculative_treatment: bool = False) -> PipelineExecutor:
+    """
+    Build the five-stage diagnostic pipeline
+
+    Expects context keys image_path, condition, patient_email and
+    image_digest (SHA-256 of the image, or None). With a digest, detection
+    and specialist results are served from the analysis cache.
+
+    Args:
+        agents: Object exposing detection_agent, diagnostic_router,
+            reasoning_agent, treatment_agent and followup_agent (e.g. AgentPool)
+        early_followup: Start follow-up planning as soon as reasoning
+            finishes, concurrently with the Treatment Agent, instead of
+            waiting for the treatment text
+        email_resolver: Optional callable returning an email address when
+            patient_email is not provided (e.g. an interactive prompt)
+        speculative_treatment: Start the Treatment Agent as soon as the
+            diagnosis and confidence have streamed out of the Reasoning
+            Agent, instead of waiting for its explanation; the treatment
+            is redone if the final diagnosis differs
+
+    Returns:
+        PipelineExecutor with stages detection, diagnostic, reasoning,
+        treatment, followup_plan and followup
+    """
+
+    # Agents also read the filename, so it is part of the cache key
+    async def detection(image_path, condition, image_digest):
+        return await cached_analysis(
+            'detection', image_digest,
+            {'filename': os.path.basename(image_path), 'condition': condition},
+            lambda: agents.detection_agent.adetect_image_type(image_path, condition)
+        )
+
+    async def diagnostic(image_path, condition, detection, image_digest):
+        return await cached_analysis(
+            'diagnostic', image_digest,
+            {'filename': os.path.basename(image_path), 'condition': condition, 'detection': detection},
+            lambda: agents.diagnostic_router.aroute_and_analyze(image_path, condition, detection)
+        )
+
+    # Treatment started early from the streamed diagnosis (speculative_treatment)
+    speculation = {'fields': {}, 'inputs': None, 'task': None, 'relay': None, 'started': None}
+
+    def discard_speculation():
+        if speculation['task'] is not None:
+            speculation['task'].cancel()
+            metrics.inc("speculative_treatment_total", result="wasted")
+        speculation.update(inputs=None, task=None, relay=None, started=None)
+
+    def speculate(key, value):
+        fields = speculation['fields']
+        if key is None:
+            # The reasoning call was retried; wait for its new fields
+            fields.clear()
+            return
+        fields[key] = value
+        if key not in ('diagnosis', 'confidence') or not fields.get('diagnosis') or 'confidence' not in fields:
+            return
+        inputs = {'diagnosis': fields['diagnosis'], 'confidence': fields['confidence']}
+        if inputs == speculation['inputs']:
+            return
+
+        # A retried reasoning call changed the diagnosis; start over
+        discard_speculation()
+        relay = _DeltaRelay()
+        with stream_to(relay):
+            task = asyncio.ensure_future(agents.treatment_agent.aprocess(inputs))
+        speculation.update(inputs=inputs, task=task, relay=relay, started=time.perf_counter())
+
+    async def reasoning(diagnostic, condition):
+        on_field = speculate if speculative_treatment else None
+        try:
+            output = await agents.reasoning_agent.aprocess(diagnostic['findings'], condition, on_field=on_field)
+            if not agents.reasoning_agent.validate_output(output):
+                raise ValueError("Reasoning agent output validation failed")
+        except BaseException:
+            # Failed or cancelled; the treatment stage will never adopt it
+            discard_speculation()
+            raise
+        if speculation['task'] is not None:
+            metrics.observe("speculative_treatment_lead_seconds", time.perf_counter() - speculation['started'])
+        return output
+
+    async def treatment(reasoning):
+        final = {'diagnosis': reasoning['diagnosis'], 'confidence': reasoning['confidence']}
+        if speculation['task'] is not None and speculation['inputs'] == final:
+            metrics.inc("speculative_treatment_total", result="confirmed")
+            task = speculation['task']
+            speculation['relay'].attach(stream_sink())
+            speculation.update(task=None, relay=None)
+            print("[Pipeline] treatment: diagnosis confirmed, using speculative plan")
+            try:
+                output = await task
+            finally:
+                # Cancelling this stage must not leave the adopted task running
+                task.cancel()
+        else:
+            discard_speculation()
+            output = await agents.treatment_agent.aprocess(reasoning)
+        if not agents.treatment_agent.validate_output(output):
+            raise ValueError("Treatment agent output validation failed")
+        return output
+
+    # The default graph is a chain: every stage reads the one before it
+    # (the specialist needs the image type, reasoning the findings, and so
+    # on). Only follow-up planning could overlap with another stage, but its
+    # prompt includes the treatment text, so dropping that input to plan
+    # alongside the Treatment Agent is opt-in
+    if early_followup:
+        async def followup_plan(reasoning):
+            return await agents.followup_agent.aplan(reasoning)
+        plan_inputs = ('reasoning',)
+    else:
+        async def followup_plan(reasoning, treatment):
+            return await agents.followup_agent.aplan(reasoning, treatment)
+        plan_inputs = ('reasoning', 'treatment')
+
+    async def followup(followup_plan, treatment, reasoning, patient_email, condition):
+        # Prompting and patient storage block, so keep them off the event loop
+        if not patient_email and email_resolver:
+            patient_email = await asyncio.to_thread(email_resolver)
+        output = await asyncio.to_thread(
+            agents.followup_agent.register,
+            followup_plan, treatment, reasoning,
+            patient_email=patient_email, condition=condition
+        )
+        if not agents.followup_agent.validate_output(output):
+            raise ValueError("Follow-up agent output validation failed")
+        return output
+
+    # A run that ends between the reasoning and treatment stages (cancelled,
+    # or another stage failed) leaves no stage to adopt or cancel the task
+    return PipelineExecutor([
+        Stage('detection', detection, ('image_path', 'condition', 'image_digest'), step=1),
+        Stage('diagnostic', diagnostic, ('image_path', 'condition', 'detection', 'image_digest'), step=2),
+        Stage('reasoning', reasoning, ('diagnostic', 'condition'), step=3),
+        Stage('treatment', treatment, ('reasoning',), step=4),
+        Stage('followup_plan', followup_plan, plan_inputs, step=5),
+        Stage('followup', followup, ('followup_plan', 'treatment', 'reasoning', 'patient_email', 'condition')),
+    ], cleanup=discard_speculation)
@@ -0,0 +1,320 @@
+"""
+LLM Rate Limiter
+Keeps agent LLM calls under each provider's request and token quotas, and
+adapts the number of calls in flight to the throttling the provider reports
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute
+
+    Callers reserve capacity up front and sleep for the returned delay, so a
+    large request can drive the bucket negative and later callers queue
+    behind it instead of all retrying at once.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        """
+        Args:
+            rate_per_minute: Sustained refill rate; 0 or less disables the bucket
+            capacity: Burst size (default: one minute's worth)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.enabled = rate_per_minute > 0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens from the bucket
+
+        Returns:
+            float: Seconds the caller must wait before using the reservation
+        """
+        if not self.enabled:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Never let one oversized request block the bucket forever
+            self._tokens -= min(amount, self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount: float):
+        """Return unused tokens (e.g. when the real usage was below the estimate)"""
+        if not self.enabled or amount <= 0:
+            return
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def drain(self):
+        """Empty the bucket after the provider reported throttling"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease limit on calls in flight
+
+    The limit halves when the provider throttles and grows by one after a
+    full window of successful calls. State is guarded by a thread lock and
+    waiters are woken on their own event loop, so one instance can be shared
+    by every loop in the process.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.in_flight = 0
+
+        self._successes = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        """Wait for a free slot"""
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # The slot was handed over just before cancellation; give it back
+            self.release()
+            raise
+
+    def release(self):
+        """Free a slot, handing it to the next waiter if the limit allows"""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            loop, future = self._waiters.pop(0)
+            self.in_flight += 1
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def on_success(self):
+        """Record a successful call; ramp the limit up after a full window"""
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._wake()
+
+    def on_throttle(self):
+        """Record a throttled call; halve the limit"""
+        with self._lock:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ProviderRateLimiter:
+    """
+    Request and token quotas plus adaptive concurrency for one provider
+
+    Every call reserves one request and its estimated tokens, waits out any
+    Retry-After cooldown, then takes a concurrency slot.
+    """
+
+    def __init__(self, provider: str, rpm: float, tpm: float, max_concurrency: int,
+                 min_concurrency: int = 1):
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency)
+
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """
+        Hold capacity for one LLM call
+
+        Args:
+            estimated_tokens: Prompt plus completion tokens the call may use
+        """
+        delay = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        start = time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        cooldown = self._cooldown_until - time.monotonic()
+        if cooldown > 0:
+            await asyncio.sleep(cooldown)
+
+        await self.concurrency.acquire()
+        with self._lock:
+            self.calls += 1
+            self.wait_seconds += time.monotonic() - start
+
+        try:
+            yield
+        finally:
+            self.concurrency.release()
+
+    def on_success(self, estimated_tokens: int, used_tokens: int = None):
+        """Record a successful call and refund any over-estimated tokens"""
+        self.concurrency.on_success()
+        if used_tokens is not None:
+            self.tokens.refund(estimated_tokens - used_tokens)
+
+    def on_throttle(self, retry_after: float):
+        """
+        Record a 429 from the provider
+
+        Args:
+            retry_after: Seconds the provider asked us to wait
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.throttled += 1
+            # Calls already in flight during one throttling episode all get a
+            # 429; back off once per episode rather than once per call
+            new_episode = now >= self._cooldown_until
+            self._cooldown_until = max(self._cooldown_until, now + retry_after)
+        if new_episode:
+            self.concurrency.on_throttle()
+            self.requests.drain()
+
+    def stats(self) -> dict:
+        """Current limits and counters"""
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "concurrency_limit": self.concurrency.limit,
+                "in_flight": self.concurrency.in_flight,
+                "rpm": self.requests.rate * 60 if self.requests.enabled else None,
+                "tpm": self.tokens.rate * 60 if self.tokens.enabled else None
+            }
+
+
+# Published free-tier quotas for GitHub Models; Azure and OpenAI quotas
+# depend on the deployment/account, so they are only limited when configured
+PROVIDER_DEFAULTS = {
+    "github": {"rpm": 15, "tpm": 150000},
+    "azure": {"rpm": 0, "tpm": 0},
+    "openai": {"rpm": 0, "tpm": 0}
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def get_rate_limiter(provider: str):
+    """
+    Get the process-wide rate limiter for a provider, or None when disabled
+
+    Configured through the environment:
+        LLM_RATE_LIMIT_ENABLED   - 'false' disables rate limiting (default true)
+        LLM_RPM                  - Requests per minute (default: provider quota, 0 = unlimited)
+        LLM_TPM                  - Tokens per minute (default: provider quota, 0 = unlimited)
+        LLM_MAX_CONCURRENCY      - Upper bound on calls in flight (default 16)
+        LLM_MIN_CONCURRENCY      - Floor when backing off (default 1)
+    """
+    if provider is None or os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "false":
+        return None
+
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                defaults = PROVIDER_DEFAULTS.get(provider, {"rpm": 0, "tpm": 0})
+                limiter = ProviderRateLimiter(
+                    provider,
+                    rpm=_env_number("LLM_RPM", defaults["rpm"]),
+                    tpm=_env_number("LLM_TPM", defaults["tpm"]),
+                    max_concurrency=int(_env_number("LLM_MAX_CONCURRENCY", 16)),
+                    min_concurrency=int(_env_number("LLM_MIN_CONCURRENCY", 1))
+                )
+                _limiters[provider] = limiter
+
+    return limiter
+
+
+def retry_after_seconds(error, attempt: int, default_base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Seconds to wait after a throttled call
+
+    Honors the retry-after-ms / retry-after headers when the provider sends
+    them, otherwise backs off exponentially.
+
+    Args:
+        error: Exception raised by the OpenAI client
+        attempt: Zero-based retry attempt
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return min(cap, max(0.0, float(value) * scale))
+        except ValueError:
+            # HTTP-date form; fall back to exponential backoff
+            break
+
+    return min(cap, default_base * (2 ** attempt))
+
+
+def limiter_stats() -> dict:
+    """Stats for every provider limiter created so far"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.stats() for provider, limiter in limiters.items()}
@@ -4,10 +4,13 @@ Infers diagnosis from visual findings and patient symptoms using AI
 """
 
 import json
-import os
-from openai import AzureOpenAI, OpenAI
 from dotenv import load_dotenv
 
+from agents.event_loop import run_sync
+from agents.keyword_rules import get_keyword_rules
+from agents.llm_client import acomplete_json, get_client, get_model_name, note_mock_response
+from agents.metrics import metrics
+
 # Load environment variables
 load_dotenv()
 
@@ -19,43 +22,10 @@ class ReasoningAgent:
     
     def __init__(self):
         self.name = "Clinical Reasoning Agent"
-        self.client = self._initialize_client()
-        
-    def _initialize_client(self):
-        """Initialize OpenAI client (GitHub Models, Azure OpenAI, or OpenAI)"""
-        # Try GitHub Models first (models.inference.ai.azure.com)
-        # Check both .env file and system environment
-        github_token = os.getenv("GITHUB_TOKEN") or os.environ.get("GITHUB_TOKEN")
-        use_github = os.getenv("USE_GITHUB_MODELS", "false").lower() == "true"
-        
-        if github_token and use_github and github_token != "your_github_token_here":
-            print(f"[{self.name}] Using GitHub Models (token: {github_token[:10]}...)")
-            return OpenAI(
-                api_key=github_token,
-                base_url="https://models.inference.ai.azure.com"
-            )
-        
-        # Try Azure OpenAI
-        azure_key = os.getenv("AZURE_OPENAI_KEY")
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        self.client = get_client()
+        self.model = get_model_name()
+        self.rules = get_keyword_rules()
         
-        if azure_key and azure_endpoint:
-            print(f"[{self.name}] Using Azure OpenAI")
-            return AzureOpenAI(
-                api_key=azure_key,
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-                azure_endpoint=azure_endpoint
-            )
-        
-        # Fallback to OpenAI
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if openai_key:
-            print(f"[{self.name}] Using OpenAI")
-            return OpenAI(api_key=openai_key)
-        
-        print(f"[{self.name}] WARNING: No API keys found, using mock responses")
-        return None
-    
     def process(self, finding_data: dict, condition: str) -> dict:
         """
         Analyze findings and symptoms to provide diagnosis
@@ -67,6 +37,16 @@ class ReasoningAgent:
         Returns:
             dict: JSON with diagnosis and confidence
         """
+        return run_sync(self.aprocess(finding_data, condition))
+    
+    async def aprocess(self, finding_data: dict, condition: str, on_field=None) -> dict:
+        """
+        Async version of process()
+
+        Args:
+            on_field: Optional callback receiving (key, value) for each
+                field of the LLM's answer as soon as it has streamed out
+        """
         print(f"[{self.name}] Processing findings and symptoms...")
         
         # Handle both dict and string inputs from diagnostic agents
@@ -76,7 +56,7 @@ class ReasoningAgent:
             finding = finding_data
         
         if self.client:
-            diagnosis_result = self._llm_diagnosis(finding, condition)
+            diagnosis_result = await self._llm_diagnosis(finding, condition, on_field)
         else:
             diagnosis_result = self._mock_diagnosis(finding, condition)
         
@@ -90,7 +70,7 @@ class ReasoningAgent:
         print(f"[{self.name}] Diagnosis: {result['diagnosis']} (Confidence: {result['confidence']})")
         return result
     
-    def _llm_diagnosis(self, finding: str, condition: str) -> dict:
+    async def _llm_diagnosis(self, finding: str, condition: str, on_field=None) -> dict:
         """Use LLM to generate diagnosis"""
         prompt = f"""You are a clinical reasoning assistant. Based on the following information, provide a diagnosis.
 
@@ -105,68 +85,29 @@ Provide your response in JSON format with these exact keys:
 Respond ONLY with valid JSON, no other text."""
 
         try:
-            # Get deployment name for Azure or model for OpenAI/GitHub
-            if isinstance(self.client, AzureOpenAI):
-                model = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
-            else:
-                # For GitHub Models and OpenAI
-                model = os.getenv("GITHUB_MODEL") or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-            
-            response = self.client.chat.completions.create(
-                model=model,
+            result = await acomplete_json(
+                model=self.model,
                 messages=[
                     {"role": "system", "content": "You are a clinical reasoning assistant. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=200
+                max_tokens=200,
+                policy="reasoning",
+                on_field=on_field,
+                required=("diagnosis",)
             )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Try to parse JSON from response
-            # Remove markdown code blocks if present
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(response_text)
             return result
             
         except Exception as e:
             print(f"[{self.name}] LLM call failed: {e}")
+            metrics.inc("agent_fallbacks_total", agent="reasoning")
             return self._mock_diagnosis(finding, condition)
     
     def _mock_diagnosis(self, finding: str, condition: str) -> dict:
         """Fallback mock diagnosis based on keywords"""
-        finding_lower = finding.lower()
-        condition_lower = condition.lower()
-        
-        if "cavity" in finding_lower or "decay" in finding_lower:
-            return {
-                "diagnosis": "Dental caries (early stage)",
-                "confidence": "high",
-                "reasoning": "Visual cavity detection with pain symptoms indicates active caries"
-            }
-        elif "fracture" in finding_lower:
-            return {
-                "diagnosis": "Possible bone fracture",
-                "confidence": "medium",
-                "reasoning": "Visual fracture pattern requires radiological confirmation"
-            }
-        elif "skin" in finding_lower:
-            return {
-                "diagnosis": "Dermatological condition",
-                "confidence": "medium",
-                "reasoning": "Skin irregularity pattern suggests inflammatory response"
-            }
-        else:
-            return {
-                "diagnosis": "Condition requiring specialist evaluation",
-                "confidence": "low",
-                "reasoning": "Visual findings are non-specific, need additional clinical context"
-            }
+        note_mock_response("reasoning")
+        return self.rules.match('reasoning', finding=finding)
     
     def validate_output(self, output: dict) -> bool:
         """Validate output structure"""
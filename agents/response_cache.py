@@ -0,0 +1,247 @@
+"""
+LLM Response Cache
+Content-addressed cache for agent completions, keyed on a hash of
+(model, messages, temperature, max_tokens), and for per-image analysis
+results, keyed on the image's SHA-256
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class ResponseCache:
+    """
+    Two-tier response cache
+
+    Memory tier: LRU dict bounded to max_entries
+    Disk tier:   Optional SQLite file bounded to max_disk_entries, evicting
+                 least recently used rows
+
+    Entries older than ttl seconds are treated as misses on both tiers.
+    """
+
+    # How many disk writes between eviction passes
+    EVICT_EVERY = 100
+
+    def __init__(self, max_entries: int = 512, ttl: float = 86400,
+                 disk_path: str = None, max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.disk_path = Path(disk_path) if disk_path else None
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_writes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_path:
+            self._open_disk()
+
+    @staticmethod
+    def make_key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+        """Build the cache key for a completion request"""
+        payload = json.dumps({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _open_disk(self):
+        """Open (or create) the SQLite disk tier"""
+        self.disk_path.parent.mkdir(parents=True, exist_ok=True)
+        self._disk = sqlite3.connect(str(self.disk_path), check_same_thread=False)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._disk.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)"
+        )
+        self._disk.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str):
+        """
+        Look up a cached response
+
+        Returns:
+            Cached response text, or None on a miss
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._disk.execute(
+                            "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+                        )
+                        self._disk.commit()
+                        self._remember(key, value, created_at)
+                        self.disk_hits += 1
+                        return value
+                    self._disk.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._disk.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """Store a response in every enabled tier"""
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, value, now)
+
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._disk_writes += 1
+                if self._disk_writes % self.EVICT_EVERY == 0:
+                    self._evict_disk()
+                self._disk.commit()
+
+    def _remember(self, key: str, value: str, created_at: float):
+        """Insert into the memory tier, evicting the least recently used entry"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        """Trim the disk tier back to max_disk_entries rows"""
+        count = self._disk.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._disk.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM responses")
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self._disk is not None
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Get the process-wide response cache, or None when caching is disabled
+
+    Configured through the environment:
+        LLM_CACHE_ENABLED        - 'false' disables caching (default true)
+        LLM_CACHE_SIZE           - Memory tier entries (default 512)
+        LLM_CACHE_TTL            - Seconds before an entry expires (default 86400)
+        LLM_CACHE_PATH           - SQLite file for the disk tier (default: memory only)
+        LLM_CACHE_DISK_SIZE      - Disk tier entries (default 10000)
+    """
+    global _cache
+
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() == "false":
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_entries=int(os.getenv("LLM_CACHE_SIZE", 512)),
+                    ttl=float(os.getenv("LLM_CACHE_TTL", 86400)),
+                    disk_path=os.getenv("LLM_CACHE_PATH") or None,
+                    max_disk_entries=int(os.getenv("LLM_CACHE_DISK_SIZE", 10000))
+                )
+
+    return _cache
+
+
+_analysis_cache = None
+
+
+def get_analysis_cache():
+    """
+    Get the process-wide cache of per-image detection and specialist
+    results, or None when it is disabled
+
+    Entries are keyed on the image's SHA-256 and the inputs the stage saw,
+    so a re-uploaded image is not analysed again.
+
+    Configured through the environment:
+        ANALYSIS_CACHE_ENABLED   - 'false' disables caching (default true)
+        ANALYSIS_CACHE_SIZE      - Memory tier entries (default 1024)
+        ANALYSIS_CACHE_TTL       - Seconds before an entry expires (default 86400)
+        ANALYSIS_CACHE_PATH      - SQLite file for the disk tier (default: memory only)
+        ANALYSIS_CACHE_DISK_SIZE - Disk tier entries (default 50000)
+    """
+    global _analysis_cache
+
+    if os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "false":
+        return None
+
+    if _analysis_cache is None:
+        with _cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = ResponseCache(
+                    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", 1024)),
+                    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", 86400)),
+                    disk_path=os.getenv("ANALYSIS_CACHE_PATH") or None,
+                    max_disk_entries=int(os.getenv("ANALYSIS_CACHE_DISK_SIZE", 50000))
+                )
+
+    return _analysis_cache
@@ -0,0 +1,408 @@
+"""
+Upload Store
+Content-addressed storage for uploaded images: each upload is streamed to
+disk while it is hashed and its format is sniffed from the magic bytes,
+identical images share one file keyed by SHA-256, and the file is removed
+once the last request using it has finished
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+# Largest accepted upload unless UPLOAD_MAX_BYTES says otherwise
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# Leading bytes of every accepted image format
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+SNIFF_BYTES = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+
+class UnsupportedImageError(Exception):
+    """Upload is not one of the accepted image formats"""
+
+
+def sniff_image_format(head: bytes):
+    """
+    Identify an image from its first bytes
+
+    Returns:
+        str format name ('png', 'jpeg', 'gif', 'bmp'), or None
+    """
+    for signature, name in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return name
+    return None
+
+
+class UploadWriter:
+    """
+    Temporary file that hashes and sniffs an upload as it is written
+
+    The format is checked as soon as the first bytes arrive, so anything
+    that is not an image is rejected before the rest of it is stored.
+    Only one chunk is held in memory at a time. Behaves as a readable,
+    seekable file otherwise (as werkzeug's multipart parser expects).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None):
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self._hasher = hashlib.sha256()
+        self._head = b""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.format = None
+        self.committed = False
+
+    def write(self, data) -> int:
+        if self.format is None:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_format()
+
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.close()
+            raise ValueError(f"Upload exceeds {self.max_bytes} bytes")
+
+        self._hasher.update(data)
+        return self._file.write(data)
+
+    def _check_format(self):
+        self.format = sniff_image_format(self._head)
+        if self.format is None:
+            self.close()
+            raise UnsupportedImageError(
+                "Unsupported image format (expected PNG, JPEG, GIF or BMP)"
+            )
+
+    def finish(self):
+        """Validate a complete upload and close the file"""
+        if self.format is None:
+            self._check_format()
+        self._file.close()
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+    def close(self):
+        """Close the file, deleting it unless it was committed to the store"""
+        self._file.close()
+        if not self.committed:
+            _remove(self.path)
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline, flush, ... of the underlying file
+        return getattr(self._file, name)
+
+
+class StoredUpload:
+    """One request's reference to a stored image"""
+
+    def __init__(self, store, digest: str, path: str, filename: str, size: int,
+                 deduplicated: bool, format: str = None):
+        """
+        Args:
+            store: UploadStore holding the image
+            digest: SHA-256 of the image bytes (hex)
+            path: Private path of this reference, ending in the upload's filename
+            filename: Sanitised original filename
+            size: Image size in bytes
+            deduplicated: True if the image was already stored
+            format: Image format sniffed from the magic bytes
+        """
+        self.store = store
+        self.digest = digest
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.deduplicated = deduplicated
+        self.format = format
+        self._released = False
+
+    def detach(self) -> tuple:
+        """
+        Hand this reference to another owner, e.g. a queued job that may
+        run in another process
+
+        Returns:
+            (path, digest); the new owner frees them with UploadStore.release_path()
+        """
+        if not self._released:
+            self._released = True
+            self.store.forget(self.digest)
+        return self.path, self.digest
+
+    def release(self):
+        """Drop this reference (safe to call more than once)"""
+        if not self._released:
+            self._released = True
+            self.store.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        return f"StoredUpload({self.filename!r}, {self.digest[:12]}, {self.size} bytes)"
+
+
+class UploadStore:
+    """
+    Reference-counted, content-addressed image store
+
+    Layout under root:
+        blobs/<2 hex>/<sha256>  - one file per distinct image
+        refs/<random>/<name>    - hard link per request, so agents still see
+                                  the original filename and concurrent
+                                  uploads with the same name never collide
+        tmp/                    - uploads being written
+
+    Every reference is a hard link, so the blob's link count is the
+    reference count across all processes sharing the root: a blob is
+    deleted when the last link to it goes, whichever process releases it.
+    Where hard links are unsupported, references are copies and each blob
+    is deleted as soon as it is first released.
+    """
+
+    def __init__(self, root: str, max_bytes: int = None):
+        """
+        Args:
+            root: Directory to keep uploads in (created if missing)
+            max_bytes: Largest accepted upload; None for no limit
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, "blobs")
+        self._refs_dir = os.path.join(root, "refs")
+        self._tmp = os.path.join(root, "tmp")
+        for directory in (self._blobs, self._refs_dir, self._tmp):
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._refs = {}
+
+        self.stored = 0
+        self.deduplicated = 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs, digest[:2], digest)
+
+    def new_writer(self) -> "UploadWriter":
+        """Writable file for an upload arriving in chunks; pass it to commit()"""
+        return UploadWriter(self._tmp, self.max_bytes)
+
+    def commit(self, writer: "UploadWriter", filename: str) -> StoredUpload:
+        """
+        Move a fully written upload into the store
+
+        Raises:
+            UnsupportedImageError: If the data is not a supported image
+        """
+        writer.finish()
+        tmp_path, digest, size = writer.path, writer.hexdigest(), writer.size
+        writer.committed = True
+
+        blob = self._blob_path(digest)
+        ref_dir = os.path.join(self._refs_dir, uuid.uuid4().hex)
+        path = os.path.join(ref_dir, filename)
+
+        with self._lock:
+            try:
+                os.mkdir(ref_dir)
+                try:
+                    # Another process may delete the blob at any moment;
+                    # if linking fails, store this copy instead
+                    _link(blob, path)
+                    deduplicated = True
+                except FileNotFoundError:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.replace(tmp_path, blob)
+                    _link(blob, path)
+                    deduplicated = False
+            except OSError:
+                shutil.rmtree(ref_dir, ignore_errors=True)
+                _remove(tmp_path)
+                raise
+
+            if deduplicated:
+                _remove(tmp_path)
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+
+        return StoredUpload(self, digest, path, filename, size, deduplicated, writer.format)
+
+    def release(self, upload: StoredUpload):
+        """Drop a reference, deleting the image once nothing uses it"""
+        self.release_path(upload.path, upload.digest)
+
+    def release_path(self, path: str, digest: str):
+        """
+        Drop a reference by its path, including one detached in another
+        process, deleting the image once no reference links to it
+        """
+        with self._lock:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            self._forget(digest)
+
+            blob = self._blob_path(digest)
+            try:
+                unused = os.stat(blob).st_nlink <= 1
+            except FileNotFoundError:
+                return
+            if unused:
+                _remove(blob)
+
+    def forget(self, digest: str):
+        """Stop counting a reference this process handed to another owner"""
+        with self._lock:
+            self._forget(digest)
+
+    def _forget(self, digest: str):
+        remaining = self._refs.get(digest, 0) - 1
+        if remaining > 0:
+            self._refs[digest] = remaining
+        else:
+            self._refs.pop(digest, None)
+
+    def sweep(self, max_age: float = 3600) -> int:
+        """
+        Remove files left behind by a process that died mid-request
+
+        Only entries untouched for max_age seconds are considered, so
+        requests still running in other processes are not affected.
+
+        Returns:
+            int: Files and directories removed
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+
+        with self._lock:
+            for name in os.listdir(self._refs_dir):
+                ref_dir = os.path.join(self._refs_dir, name)
+                if _mtime(ref_dir) < cutoff:
+                    shutil.rmtree(ref_dir, ignore_errors=True)
+                    removed += 1
+
+            for name in os.listdir(self._tmp):
+                path = os.path.join(self._tmp, name)
+                if _mtime(path) < cutoff:
+                    removed += _remove(path)
+
+            for prefix in os.listdir(self._blobs):
+                directory = os.path.join(self._blobs, prefix)
+                for digest in os.listdir(directory):
+                    blob = os.path.join(directory, digest)
+                    if digest in self._refs or _mtime(blob) >= cutoff:
+                        continue
+                    try:
+                        linked = os.stat(blob).st_nlink > 1
+                    except OSError:
+                        continue
+                    if not linked:
+                        removed += _remove(blob)
+
+        return removed
+
+    def stats(self) -> dict:
+        """Stored/deduplicated upload counts and images currently referenced"""
+        with self._lock:
+            return {
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "active_images": len(self._refs),
+                "active_references": sum(self._refs.values())
+            }
+
+
+def _link(source: str, target: str):
+    """Hard-link target to source, copying where hard links are unsupported"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _remove(path: str) -> int:
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return time.time()
+
+
+def file_digest(path: str):
+    """
+    SHA-256 of a local file, read in chunks
+
+    Returns:
+        str hex digest, or None if the file cannot be read
+    """
+    hasher = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_upload_store() -> UploadStore:
+    """
+    Get the process-wide upload store
+
+    Configured through the environment:
+        UPLOAD_STORE_PATH        - Directory for uploads (default: <tmp>/maiopinion-uploads)
+        UPLOAD_SWEEP_AGE         - Seconds before leftovers of a crashed
+                                   process are removed at startup (default 3600)
+        UPLOAD_MAX_BYTES         - Largest accepted upload (default 16 MiB)
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                root = os.getenv("UPLOAD_STORE_PATH") or os.path.join(
+                    tempfile.gettempdir(), "maiopinion-uploads"
+                )
+                max_bytes = int(os.getenv("UPLOAD_MAX_BYTES", DEFAULT_MAX_BYTES))
+                store = UploadStore(root, max_bytes=max_bytes)
+                removed = store.sweep(float(os.getenv("UPLOAD_SWEEP_AGE", 3600)))
+                if removed:
+                    print(f"[Upload Store] Removed {removed} stale upload file(s) from {root}")
+                _store = store
+
+    return _store
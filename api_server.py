@@ -3,232 +3,306 @@ Flask API Backend for MaiOpinion
 Handles image upload and diagnostic processing with SSE streaming
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, Request, request, jsonify, Response
 from flask_cors import CORS
+from werkzeug.serving import is_running_from_reloader
 from werkzeug.utils import secure_filename
-import os
 import json
-import tempfile
+from datetime import datetime
 from pathlib import Path
 import sys
 
 # Add parent directory to path to import agents
 sys.path.insert(0, str(Path(__file__).parent))
 
-from agents.detection import ImageDetectionAgent
-from agents.diagnostic_router import DiagnosticRouter
-from agents.reasoning import ReasoningAgent
-from agents.treatment import TreatmentAgent
-from agents.followup import FollowUpAgent
+from agents.agent_pool import get_agent_pool
+from agents.diagnosis_events import run_diagnosis_job
+from agents.job_queue import JobQueueFull, JobWorkerPool, get_job_queue, job_worker_count
+from agents.metrics import metrics
+from agents.patient_store import get_patient_store
+from agents.upload_store import UnsupportedImageError, get_upload_store
+
+# Agents are built once per process and shared by all requests
+agent_pool = get_agent_pool()
+
+# Uploads are stored once per distinct image, keyed by SHA-256
+upload_store = get_upload_store()
+
+# Diagnoses submitted to /api/jobs run on worker threads, off the request
+# threads. Only the process serving requests starts them (see __main__).
+job_queue = get_job_queue()
+job_workers = JobWorkerPool(job_queue, run_diagnosis_job, workers=job_worker_count())
+
+# Seconds a client is asked to wait after HTTP 429
+JOB_RETRY_AFTER = 5
+
+
+class UploadRequest(Request):
+    """
+    Request whose file parts are written straight into the upload store
+
+    Each chunk is hashed and written to disk as the multipart body is
+    parsed, and the format is checked from the first bytes, so uploads are
+    never buffered in memory or copied a second time.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        writer = upload_store.new_writer()
+        self.__dict__.setdefault('upload_writers', []).append(writer)
+        return writer
+
+    def close(self):
+        super().close()
+        # Parts that were rejected, cut off or never committed
+        for writer in self.__dict__.get('upload_writers', ()):
+            writer.close()
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 
 # Configuration
-UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+# Same limit as the upload store (UPLOAD_MAX_BYTES, 16MB by default)
+app.config['MAX_CONTENT_LENGTH'] = upload_store.max_bytes
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+def send_sse(data, event_id=None):
+    """Send Server-Sent Event, with an id line when the event has one"""
+    if event_id is not None:
+        return f"id: {event_id}\ndata: {json.dumps(data)}\n\n"
+    return f"data: {json.dumps(data)}\n\n"
 
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def receive_upload():
+    """
+    Validate a diagnosis form and move its image into the upload store
 
+    Parsing the form streams the image to disk and rejects non-images from
+    their first bytes. Every request gets its own reference in the
+    content-addressed store, so identical filenames never collide.
 
-def send_sse(data):
-    """Send Server-Sent Event"""
-    return f"data: {json.dumps(data)}\n\n"
+    Returns:
+        (upload, condition, email, None), or (None, None, None, error message)
+    """
+    try:
+        files = request.files
+    except UnsupportedImageError as e:
+        return None, None, None, str(e)
+    
+    if 'image' not in files:
+        return None, None, None, 'No image file provided'
+    
+    if 'condition' not in request.form:
+        return None, None, None, 'No condition description provided'
+    
+    file = files['image']
+    if file.filename == '':
+        return None, None, None, 'No file selected'
+    
+    filename = secure_filename(file.filename) or 'upload'
+    try:
+        upload = upload_store.commit(file.stream, filename)
+    except UnsupportedImageError as e:
+        return None, None, None, str(e)
+    
+    return upload, request.form['condition'], request.form.get('email', None), None
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'message': 'MaiOpinion API is running'})
+    return jsonify({
+        'status': 'healthy',
+        'message': 'MaiOpinion API is running',
+        'agents_warm': agent_pool.is_warm,
+        'warmup': agent_pool.warmup_report,
+        'uploads': upload_store.stats(),
+        'jobs': {**job_queue.stats(), **job_workers.stats()}
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: stage and LLM latencies, tokens, cache and error counts"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats_endpoint():
+    """Follow-up statistics: totals plus per-day (?days=14) and per-diagnosis (?top=10) breakdowns"""
+    days = min(max(request.args.get('days', 14, type=int), 1), 365)
+    top = min(max(request.args.get('top', 10, type=int), 1), 100)
+    today = datetime.now().strftime('%Y-%m-%d')
+    return jsonify(get_patient_store().statistics(today, days=days, top=top))
 
 
 @app.route('/api/diagnose', methods=['POST'])
 def diagnose():
-    """Main diagnostic endpoint with SSE streaming"""
+    """
+    Main diagnostic endpoint with SSE streaming
+    
+    The diagnosis runs as a background job, so it keeps going if the
+    connection drops; the client resumes from GET /api/jobs/<id>/events
+    with the last event ID it received.
+    """
     
     # Validate request BEFORE entering generator
-    if 'image' not in request.files:
-        return Response(send_sse({'type': 'error', 'message': 'No image file provided'}), 
+    upload, condition, email, error = receive_upload()
+    if error:
+        return Response(send_sse({'type': 'error', 'message': error}), 
                        mimetype='text/event-stream')
     
-    if 'condition' not in request.form:
-        return Response(send_sse({'type': 'error', 'message': 'No condition description provided'}), 
-                       mimetype='text/event-stream')
+    try:
+        job_id = enqueue_diagnosis(upload, condition, email)
+    except JobQueueFull:
+        response = Response(send_sse({'type': 'error', 'message': 'Too many diagnoses waiting, retry later'}),
+                            status=429, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response
     
-    file = request.files['image']
-    condition = request.form['condition']
-    email = request.form.get('email', None)
+    def generate(job_id):
+        yield send_sse({'type': 'job', 'job_id': job_id, 'events_url': f'/api/jobs/{job_id}/events'})
+        yield from job_event_stream(job_id, 0)
     
-    if file.filename == '':
-        return Response(send_sse({'type': 'error', 'message': 'No file selected'}), 
-                       mimetype='text/event-stream')
+    response = Response(generate(job_id), mimetype='text/event-stream')
+    response.headers['X-Job-ID'] = job_id
+    return response
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a diagnosis for the worker pool; answers 429 while the queue is full"""
+    upload, condition, email, error = receive_upload()
+    if error:
+        return jsonify({'error': error}), 400
     
-    if not allowed_file(file.filename):
-        return Response(send_sse({'type': 'error', 'message': 'Invalid file type'}), 
-                       mimetype='text/event-stream')
+    try:
+        job_id = enqueue_diagnosis(upload, condition, email)
+    except JobQueueFull:
+        response = jsonify({
+            'error': 'Too many diagnoses waiting, retry later',
+            'queue_depth': job_queue.depth()
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'events_url': f'/api/jobs/{job_id}/events'
+    }), 202
+
+
+def enqueue_diagnosis(upload, condition, email):
+    """
+    Queue a diagnosis of a stored upload
+    
+    Returns:
+        str: Job ID
+    
+    Raises:
+        JobQueueFull: If the queue is full (the upload is released)
+    """
+    # The job owns the image reference from here on and frees it when done
+    image_path, image_digest = upload.detach()
+    payload = {
+        'image_path': image_path,
+        'image_digest': image_digest,
+        'image_format': upload.format,
+        'filename': upload.filename,
+        'condition': condition,
+        'patient_email': email
+    }
+    
+    try:
+        job_id = job_queue.enqueue(payload)
+    except JobQueueFull:
+        upload_store.release_path(image_path, image_digest)
+        raise
     
-    # Save uploaded file
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    
-    def generate(filepath, condition, email, filename):
-        try:
-            # Initialize agents
-            detection_agent = ImageDetectionAgent()
-            diagnostic_router = DiagnosticRouter()
-            reasoning_agent = ReasoningAgent()
-            treatment_agent = TreatmentAgent()
-            followup_agent = FollowUpAgent()
-            
-            # Step 1: Image Detection
-            yield send_sse({
-                'type': 'step_start',
-                'step': 1,
-                'message': 'Detecting image type and body part...'
-            })
-            
-            detection_info = detection_agent.detect_image_type(filepath, condition)
-            
-            yield send_sse({
-                'type': 'step_complete',
-                'step': 1,
-                'message': f"Detected: {detection_info['image_type']} ({detection_info['confidence']} confidence)",
-                'result': f"{detection_info['image_type']} - {detection_info['body_part']}"
-            })
-            
-            # Step 2: Specialized Diagnostic
-            yield send_sse({
-                'type': 'step_start',
-                'step': 2,
-                'message': 'Routing to specialized diagnostic agent...'
-            })
-            
-            diagnostic_result = diagnostic_router.route_and_analyze(
-                filepath, condition, detection_info
-            )
-            diagnostic_output = diagnostic_result['findings']
-            
-            yield send_sse({
-                'type': 'step_complete',
-                'step': 2,
-                'message': f"Analysis complete using {diagnostic_result['agent_used']}",
-                'result': diagnostic_output[:200] + '...' if len(diagnostic_output) > 200 else diagnostic_output
-            })
-            
-            # Step 3: Clinical Reasoning
-            yield send_sse({
-                'type': 'step_start',
-                'step': 3,
-                'message': 'Analyzing findings to generate diagnosis...'
-            })
-            
-            reasoning_output = reasoning_agent.process(diagnostic_output, condition)
-            
-            yield send_sse({
-                'type': 'step_complete',
-                'step': 3,
-                'message': f"Diagnosis: {reasoning_output['diagnosis']}",
-                'result': f"{reasoning_output['diagnosis']} (Confidence: {reasoning_output['confidence']})"
-            })
-            
-            # Step 4: Treatment Planning
-            yield send_sse({
-                'type': 'step_start',
-                'step': 4,
-                'message': 'Creating treatment plan...'
-            })
-            
-            treatment_output = treatment_agent.process(reasoning_output)
-            
-            yield send_sse({
-                'type': 'step_complete',
-                'step': 4,
-                'message': 'Treatment plan generated',
-                'result': treatment_output['treatment'][:150] + '...' if len(treatment_output['treatment']) > 150 else treatment_output['treatment']
-            })
-            
-            # Step 5: Follow-Up Care
-            yield send_sse({
-                'type': 'step_start',
-                'step': 5,
-                'message': 'Generating follow-up care plan...'
-            })
-            
-            followup_output = followup_agent.process(
-                treatment_output,
-                reasoning_output,
-                patient_email=email,
-                condition=condition
-            )
-            
-            yield send_sse({
-                'type': 'step_complete',
-                'step': 5,
-                'message': f"Follow-up timeline: {followup_output.get('timeline', 'N/A')}",
-                'result': followup_output['follow_up'][:150] + '...' if len(followup_output['follow_up']) > 150 else followup_output['follow_up']
-            })
-            
-            # Generate final report
-            final_report = {
-                "timestamp": detection_info.get('timestamp', ''),
-                "patient_condition": condition,
-                "image_analyzed": filename,
-                "image_type": detection_info.get("image_type"),
-                "body_part": detection_info.get("body_part"),
-                "imaging_modality": detection_info.get("imaging_modality"),
-                "detection_confidence": detection_info.get("confidence"),
-                "finding": diagnostic_output,
-                "diagnosis": reasoning_output.get("diagnosis"),
-                "confidence": reasoning_output.get("confidence"),
-                "treatment": treatment_output.get("treatment"),
-                "precautions": treatment_output.get("precautions", []),
-                "follow_up": followup_output.get("follow_up"),
-                "timeline": followup_output.get("timeline"),
-                "patient_instructions": followup_output.get("patient_instructions"),
-                "agent_workflow": {
-                    "step_1": "Image Detection Agent",
-                    "step_2": diagnostic_result.get('agent_used', 'Diagnostic Agent'),
-                    "step_3": "Clinical Reasoning Agent",
-                    "step_4": "Treatment Agent",
-                    "step_5": "Follow-Up Agent"
-                }
-            }
-            
-            yield send_sse({
-                'type': 'complete',
-                'report': final_report
-            })
-                
-        except Exception as e:
-            yield send_sse({
-                'type': 'error',
-                'message': str(e)
-            })
-        finally:
-            # Clean up uploaded file
-            if os.path.exists(filepath):
-                os.remove(filepath)
-    
-    return Response(generate(filepath, condition, email, filename), mimetype='text/event-stream')
+    job_workers.start()
+    return job_id
+
+
+def job_event_stream(job_id, after_id):
+    """
+    SSE stream of a job's events after after_id: the missed events from
+    the job's log first, then new ones as they are published, ending with
+    the complete or error event
+    """
+    while True:
+        read = job_queue.read_events(job_id, after_id, timeout=15.0)
+        if read is None:
+            return
+        events, finished = read
+        for event_id, event in events:
+            yield send_sse(event, event_id)
+        if finished:
+            # Also ends streams resumed at or past the job's last event
+            return
+        if not events:
+            # Keep proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+            continue
+        after_id = events[-1][0]
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status and timestamps"""
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(status)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Stream a job's progress as SSE
+    
+    Resumes after the ID in the Last-Event-ID header (sent automatically
+    by reconnecting EventSource clients) or the last_event_id query
+    parameter; without either, streams from the first event.
+    """
+    if job_queue.status(job_id) is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '0'
+    try:
+        after_id = max(0, int(last_id))
+    except ValueError:
+        after_id = 0
+    
+    return Response(job_event_stream(job_id, after_id), mimetype='text/event-stream')
 
 
 if __name__ == '__main__':
     print("=" * 80)
     print("MaiOpinion API Server")
     print("=" * 80)
+    
+    debug = True
+
+    # The debug reloader runs this block in a watcher process first and
+    # serves from a child it restarts on changes; only the child needs
+    # agents and workers (a second pool would take jobs from a shared queue)
+    if is_running_from_reloader() or not debug:
+        # Build all agents before accepting requests
+        agent_pool.warm_up()
+        agent_pool.print_report()
+        job_workers.start()
+    
     print("\nStarting Flask server on http://localhost:5000")
     print("API Endpoints:")
     print("  - GET  /api/health   - Health check")
+    print("  - GET  /api/metrics  - Prometheus metrics")
+    print("  - GET  /api/stats    - Follow-up statistics")
     print("  - POST /api/diagnose - Diagnostic endpoint")
+    print("  - POST /api/jobs     - Queue a diagnosis (GET /api/jobs/<id>/events to follow it)")
     print("\nPress Ctrl+C to stop the server")
     print("=" * 80)
     
-    app.run(debug=True, port=5000, threaded=True)
+    app.run(debug=debug, port=5000, threaded=True)
@@ -7,6 +7,41 @@ import DiagnosticReport from './components/DiagnosticReport'
 import Header from './components/Header'
 import { Activity } from 'lucide-react'
 
+const MAX_RECONNECTS = 5
+
+class DiagnosisError extends Error {}
+
+// Read an SSE response, passing each event to onEvent and remembering its
+// id in cursor.lastEventId; resolves true once the final report arrived
+async function readEvents(response, onEvent, cursor) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) return false
+
+    buffer += decoder.decode(value, { stream: true })
+    const blocks = buffer.split('\n\n')
+    buffer = blocks.pop()
+
+    for (const block of blocks) {
+      let id = null
+      let data = null
+      for (const line of block.split('\n')) {
+        if (line.startsWith('id: ')) id = line.slice(4)
+        else if (line.startsWith('data: ')) data = JSON.parse(line.slice(6))
+      }
+      if (data === null) continue
+
+      onEvent(data)
+      if (id !== null) cursor.lastEventId = id
+      if (data.type === 'complete') return true
+    }
+  }
+}
+
 function App() {
   const [image, setImage] = useState(null)
   const [condition, setCondition] = useState('')
@@ -63,41 +98,72 @@ function App() {
         throw new Error('Failed to process diagnosis')
       }
 
-      const reader = response.body.getReader()
-      const decoder = new TextDecoder()
+      const handleEvent = (data) => {
+        if (data.type === 'step_start') {
+          setCurrentStep(data.step)
+          setAgentSteps(prev => prev.map(s => 
+            s.id === data.step 
+              ? { ...s, status: 'active', message: data.message }
+              : s
+          ))
+        } else if (data.type === 'step_delta') {
+          // Show the agent's output as it is generated until the step completes
+          setAgentSteps(prev => prev.map(s =>
+            s.id === data.step
+              ? { ...s, result: (data.reset ? '' : (s.result || '')) + data.text }
+              : s
+          ))
+        } else if (data.type === 'step_complete') {
+          setAgentSteps(prev => prev.map(s => 
+            s.id === data.step 
+              ? { ...s, status: 'completed', message: data.message, result: data.result }
+              : s
+          ))
+        } else if (data.type === 'complete') {
+          setFinalReport(data.report)
+          setCurrentStep(null)
+        } else if (data.type === 'error') {
+          throw new DiagnosisError(data.message)
+        }
+      }
+
+      // The diagnosis keeps running on the server if the connection drops,
+      // so reconnect and resume after the last event received
+      const jobId = response.headers.get('X-Job-ID')
+      const cursor = { lastEventId: null }
+      let stream = response
+      let reconnects = 0
 
       while (true) {
-        const { done, value } = await reader.read()
-        if (done) break
-
-        const chunk = decoder.decode(value)
-        const lines = chunk.split('\n')
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const data = JSON.parse(line.slice(6))
-            
-            if (data.type === 'step_start') {
-              setCurrentStep(data.step)
-              setAgentSteps(prev => prev.map(s => 
-                s.id === data.step 
-                  ? { ...s, status: 'active', message: data.message }
-                  : s
-              ))
-            } else if (data.type === 'step_complete') {
-              setAgentSteps(prev => prev.map(s => 
-                s.id === data.step 
-                  ? { ...s, status: 'completed', message: data.message, result: data.result }
-                  : s
-              ))
-            } else if (data.type === 'complete') {
-              setFinalReport(data.report)
-              setCurrentStep(null)
-            } else if (data.type === 'error') {
-              throw new Error(data.message)
+        const previous = cursor.lastEventId
+        try {
+          if (!stream) {
+            const headers = cursor.lastEventId ? { 'Last-Event-ID': cursor.lastEventId } : {}
+            stream = await fetch(`/api/jobs/${jobId}/events`, { headers })
+            if (!stream.ok) {
+              throw new DiagnosisError('The diagnosis is no longer available')
             }
           }
+          if (await readEvents(stream, handleEvent, cursor)) {
+            break
+          }
+        } catch (err) {
+          if (err instanceof DiagnosisError) {
+            throw err
+          }
+        }
+
+        // Only count reconnects that made no progress
+        if (cursor.lastEventId !== previous) {
+          reconnects = 0
+        }
+
+        if (!jobId || reconnects >= MAX_RECONNECTS) {
+          throw new Error('Connection to the server was lost')
         }
+        reconnects += 1
+        stream = null
+        await new Promise(resolve => setTimeout(resolve, 1000 * reconnects))
       }
     } catch (err) {
       setError(err.message || 'An error occurred during processing')
@@ -0,0 +1,64 @@
+"""
+Job Worker
+Runs queued diagnoses in a separate process, taking jobs submitted to
+POST /api/jobs from a shared Redis-compatible queue
+
+Usage:
+    JOB_QUEUE_BACKEND=redis python job_worker.py --workers 8
+
+Start as many worker processes as needed; each runs --workers diagnoses
+at a time. They must share UPLOAD_STORE_PATH with the API server.
+"""
+
+import argparse
+import sys
+import time
+
+from agents.agent_pool import get_agent_pool
+from agents.diagnosis_events import run_diagnosis_job
+from agents.job_queue import JobWorkerPool, MemoryJobQueue, get_job_queue, job_worker_count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='MaiOpinion - run queued diagnoses from the shared job queue'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=job_worker_count(),
+        help='Diagnoses run in parallel by this process (default: JOB_WORKERS or 4)'
+    )
+    args = parser.parse_args()
+
+    queue = get_job_queue()
+    if isinstance(queue, MemoryJobQueue):
+        print("❌ The in-process job queue cannot be shared with other processes.")
+        print("   Set JOB_QUEUE_BACKEND=redis (and JOB_QUEUE_URL) for the API server and this worker.")
+        sys.exit(1)
+
+    print("=" * 80)
+    print("MaiOpinion Job Worker")
+    print("=" * 80)
+
+    agent_pool = get_agent_pool()
+    agent_pool.warm_up()
+    agent_pool.print_report()
+
+    pool = JobWorkerPool(queue, run_diagnosis_job, workers=args.workers)
+    pool.start()
+    print(f"\nRunning {args.workers} worker(s); press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(60)
+            stats = pool.stats()
+            print(f"[Job Worker] {stats['completed']} completed, {stats['failed']} failed, "
+                  f"{stats['busy']} running, {queue.depth()} waiting")
+    except KeyboardInterrupt:
+        print("\nStopping after running jobs finish...")
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ Main Orchestrator - Chains all four agents together
 import argparse
 import json
 import sys
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -15,6 +16,20 @@ from agents.diagnostic_router import DiagnosticRouter
 from agents.reasoning import ReasoningAgent
 from agents.treatment import TreatmentAgent
 from agents.followup import FollowUpAgent
+from agents.event_loop import run_sync
+from agents.metrics import metrics
+from agents.orchestrator import AsyncOrchestrator, build_report
+from agents.pipeline import build_diagnostic_pipeline
+from agents.upload_store import file_digest
+
+
+STEP_NAMES = {
+    1: "Image Detection Agent",
+    2: "Specialized Diagnostic Agent",
+    3: "Clinical Reasoning Agent",
+    4: "Treatment Agent",
+    5: "Follow-Up Agent"
+}
 
 
 class MaiOpinionOrchestrator:
@@ -33,8 +48,12 @@ class MaiOpinionOrchestrator:
         self.treatment_agent = TreatmentAgent()
         self.followup_agent = FollowUpAgent()
         
+        # Step whose streamed text is on the current output line
+        self._delta_step = None
+        
     def run_pipeline(self, image_path: str, condition: str, patient_email: str = None, 
-                     no_prompt: bool = False) -> dict:
+                     no_prompt: bool = False, early_followup: bool = False,
+                     stream: bool = True, speculative_treatment: bool = False) -> dict:
         """
         Run the complete diagnostic pipeline through all 4 agents
         
@@ -43,6 +62,9 @@ class MaiOpinionOrchestrator:
             condition: Patient's symptoms/condition description
             patient_email: Optional email for follow-up reminders
             no_prompt: Skip interactive email prompt
+            early_followup: Plan follow-up care concurrently with the Treatment Agent
+            stream: Print the agents' output as it is generated
+            speculative_treatment: Start treatment from the streamed diagnosis
             
         Returns:
             dict: Complete diagnostic report
@@ -52,69 +74,31 @@ class MaiOpinionOrchestrator:
         print("=" * 80 + "\n")
         
         try:
-            # Step 1: Image Detection Agent
-            print("\n[STEP 1/5] Running Image Detection Agent...")
-            print("-" * 80)
-            detection_info = self.detection_agent.detect_image_type(image_path, condition)
-            
-            # Step 2: Specialized Diagnostic Agent (routed based on detection)
-            print("\n[STEP 2/5] Running Specialized Diagnostic Agent...")
-            print("-" * 80)
-            diagnostic_result = self.diagnostic_router.route_and_analyze(
-                image_path, condition, detection_info
-            )
-            diagnostic_output = diagnostic_result['findings']
-            
-            # Step 3: Clinical Reasoning Agent
-            print("\n[STEP 3/5] Running Clinical Reasoning Agent...")
-            print("-" * 80)
-            reasoning_output = self.reasoning_agent.process(diagnostic_output, condition)
-            
-            if not self.reasoning_agent.validate_output(reasoning_output):
-                raise ValueError("Reasoning agent output validation failed")
-            
-            # Step 4: Treatment Agent
-            print("\n[STEP 4/5] Running Treatment Agent...")
-            print("-" * 80)
-            treatment_output = self.treatment_agent.process(reasoning_output)
-            
-            if not self.treatment_agent.validate_output(treatment_output):
-                raise ValueError("Treatment agent output validation failed")
-            
-            # Step 5: Follow-Up Agent
-            print("\n[STEP 5/5] Running Follow-Up Agent...")
-            print("-" * 80)
-            
             # Determine email for follow-ups
             if patient_email:
-                email_to_use = patient_email
-                print(f"✅ Using provided email: {email_to_use}")
+                print(f"✅ Using provided email: {patient_email}")
+                email_resolver = None
             elif not no_prompt:
-                email_to_use = self._ask_email_preference()
+                email_resolver = self._ask_email_preference
             else:
-                email_to_use = None
+                email_resolver = None
             
-            followup_output = self.followup_agent.process(
-                treatment_output, 
-                reasoning_output,
-                patient_email=email_to_use,
-                condition=condition
+            pipeline = build_diagnostic_pipeline(
+                self, early_followup=early_followup, email_resolver=email_resolver,
+                speculative_treatment=speculative_treatment
             )
             
-            if not self.followup_agent.validate_output(followup_output):
-                raise ValueError("Follow-up agent output validation failed")
+            # Stages run as soon as their inputs are ready
+            results = pipeline.run(
+                {'image_path': image_path, 'condition': condition, 'patient_email': patient_email,
+                 'image_digest': file_digest(image_path)},
+                on_event=self._print_step,
+                deltas=stream
+            )
             
             # Aggregate final report
-            final_report = self._aggregate_report(
-                diagnostic_output,
-                reasoning_output,
-                treatment_output,
-                followup_output,
-                image_path,
-                condition,
-                detection_info,
-                diagnostic_result.get('agent_used', 'Diagnostic Agent')
-            )
+            final_report = build_report(results, image_path, condition)
+            final_report["metrics"] = metrics.summary()
             
             print("\n" + "=" * 80)
             print("Pipeline Completed Successfully!")
@@ -126,6 +110,33 @@ class MaiOpinionOrchestrator:
             print(f"\n❌ ERROR: Pipeline failed - {str(e)}")
             sys.exit(1)
     
+    def _print_step(self, event: dict):
+        """Print a progress header when a pipeline step starts, its output as it streams and its time when it ends"""
+        if event['type'] == 'step_delta':
+            self._print_delta(event)
+            return
+        
+        if self._delta_step is not None:
+            print()
+            self._delta_step = None
+        
+        if event['type'] == 'step_start':
+            print(f"\n[STEP {event['step']}/5] Running {STEP_NAMES[event['step']]}...")
+            print("-" * 80)
+        elif event['type'] == 'step_complete':
+            print(f"[STEP {event['step']}/5] {STEP_NAMES[event['step']]} finished in {event['seconds']:.2f}s")
+    
+    def _print_delta(self, event: dict):
+        """Print streamed agent text as it arrives, labelled when steps interleave"""
+        if event['reset'] or event['step'] != self._delta_step:
+            if self._delta_step is not None:
+                print()
+            label = "retrying" if event['reset'] else f"STEP {event['step']}/5"
+            sys.stdout.write(f"   [{label}] ")
+            self._delta_step = event['step']
+        sys.stdout.write(event['text'])
+        sys.stdout.flush()
+    
     def _ask_email_preference(self) -> str:
         """Ask patient if they want to receive follow-up emails"""
         print("\n" + "-" * 80)
@@ -142,37 +153,6 @@ class MaiOpinionOrchestrator:
             print("⏭️  Skipping email registration")
             return None
     
-    def _aggregate_report(self, diagnostic, reasoning, treatment, followup, 
-                         image_path, condition, detection_info, agent_used) -> dict:
-        """Aggregate all agent outputs into final report"""
-        
-        report = {
-            "timestamp": datetime.now().isoformat(),
-            "patient_condition": condition,
-            "image_analyzed": Path(image_path).name,
-            "image_type": detection_info.get("image_type"),
-            "body_part": detection_info.get("body_part"),
-            "imaging_modality": detection_info.get("imaging_modality"),
-            "detection_confidence": detection_info.get("confidence"),
-            "finding": diagnostic.get("finding") if isinstance(diagnostic, dict) else diagnostic,
-            "diagnosis": reasoning.get("diagnosis"),
-            "confidence": reasoning.get("confidence"),
-            "treatment": treatment.get("treatment"),
-            "precautions": treatment.get("precautions", []),
-            "follow_up": followup.get("follow_up"),
-            "timeline": followup.get("timeline"),
-            "patient_instructions": followup.get("patient_instructions"),
-            "agent_workflow": {
-                "step_1": "Image Detection Agent",
-                "step_2": agent_used,
-                "step_3": "Clinical Reasoning Agent",
-                "step_4": "Treatment Agent",
-                "step_5": "Follow-Up Agent"
-            }
-        }
-        
-        return report
-    
     def print_report(self, report: dict):
         """Pretty print the final diagnostic report"""
         print("\n" + "=" * 80)
@@ -245,20 +225,21 @@ def parse_arguments():
 Examples:
   python main.py --image patient1.png --condition "Tooth pain for 3 days"
   python main.py -i sample_data/xray.png -c "Wrist pain after fall" --save
+  python main.py --batch cases.jsonl --output reports.jsonl --concurrency 16
         """
     )
     
     parser.add_argument(
         '--image', '-i',
         type=str,
-        required=True,
+        default=None,
         help='Path to the medical image file'
     )
     
     parser.add_argument(
         '--condition', '-c',
         type=str,
-        required=True,
+        default=None,
         help='Patient condition or symptoms description'
     )
     
@@ -272,7 +253,8 @@ Examples:
         '--output', '-o',
         type=str,
         default=None,
-        help='Output file path for the report (default: auto-generated)'
+        help='Output file path for the report (default: auto-generated); '
+             'with --batch, the JSONL results file (default: <manifest>_reports.jsonl)'
     )
     
     parser.add_argument(
@@ -288,7 +270,169 @@ Examples:
         help='Skip interactive email prompt (use with --email or to skip email registration)'
     )
     
-    return parser.parse_args()
+    parser.add_argument(
+        '--early-followup',
+        action='store_true',
+        help='Plan follow-up care as soon as the diagnosis is ready, in parallel with treatment'
+    )
+    
+    parser.add_argument(
+        '--speculative-treatment',
+        action='store_true',
+        help='Start the treatment plan as soon as the diagnosis is known, redoing it if the final diagnosis differs'
+    )
+    
+    parser.add_argument(
+        '--no-stream',
+        action='store_true',
+        help="Don't print agent output while it is generated"
+    )
+    
+    parser.add_argument(
+        '--batch', '-b',
+        metavar='MANIFEST',
+        type=str,
+        default=None,
+        help='Run every case in a JSONL manifest ({"id", "image", "condition", "email"} per line)'
+    )
+    
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='Number of cases diagnosed in parallel in batch mode (default: 8)'
+    )
+    
+    args = parser.parse_args()
+    
+    if not args.batch and not (args.image and args.condition):
+        parser.error("--image and --condition are required unless --batch is given")
+    
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    
+    return args
+
+
+def load_completed_ids(output_path: Path) -> set:
+    """
+    Collect case IDs that already succeeded in a batch output file
+    
+    Cases recorded with status 'error' are run again on resume, since the
+    failure may have been transient (e.g. a timed-out LLM call). Their new
+    result is appended, so the last record for an ID is the current one.
+    """
+    completed = set()
+    if not output_path.exists():
+        return completed
+    
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if record['status'] == 'ok':
+                    completed.add(record['id'])
+            except (ValueError, KeyError, TypeError):
+                # Ignore a partially written last line from an interrupted run
+                continue
+    
+    return completed
+
+
+def iter_manifest(manifest_path: Path, completed_ids: set, counts: dict, write_record):
+    """
+    Stream cases from a JSONL manifest, skipping IDs that already succeeded
+    
+    Malformed lines are recorded as failures through write_record instead of
+    stopping the batch.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            
+            case_id = f"line-{line_number}"
+            try:
+                entry = json.loads(line)
+                case_id = str(entry.get('id', case_id))
+                if case_id in completed_ids:
+                    counts['skipped'] += 1
+                    continue
+                case = {
+                    'id': case_id,
+                    'image_path': entry.get('image') or entry['image_path'],
+                    'condition': entry['condition'],
+                    'patient_email': entry.get('email')
+                }
+            except (ValueError, KeyError, AttributeError) as e:
+                if case_id in completed_ids:
+                    counts['skipped'] += 1
+                    continue
+                counts['failed'] += 1
+                write_record({'id': case_id, 'status': 'error', 'error': f"Invalid manifest entry: {e}"})
+                continue
+            
+            yield case
+
+
+def run_batch(args):
+    """Run every case in a manifest, appending one result per line to the output JSONL"""
+    manifest_path = Path(args.batch)
+    if not manifest_path.exists():
+        print(f"❌ ERROR: Manifest not found: {manifest_path}")
+        sys.exit(1)
+    
+    output_path = Path(args.output) if args.output else \
+        manifest_path.with_name(f"{manifest_path.stem}_reports.jsonl")
+    
+    completed_ids = load_completed_ids(output_path)
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    
+    print("=" * 80)
+    print("MaiOpinion - Batch Diagnosis")
+    print("=" * 80)
+    print(f"Manifest:    {manifest_path}")
+    print(f"Output:      {output_path}")
+    print(f"Concurrency: {args.concurrency}")
+    if completed_ids:
+        print(f"Resuming:    {len(completed_ids)} case(s) already succeeded")
+    print()
+    
+    orchestrator = AsyncOrchestrator(
+        early_followup=args.early_followup, speculative_treatment=args.speculative_treatment
+    )
+    start = time.perf_counter()
+    
+    with open(output_path, 'a', encoding='utf-8') as out:
+        def write_record(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+        
+        def on_result(case, report, error, seconds):
+            record = {'id': case['id'], 'elapsed_seconds': round(seconds, 3)}
+            if error is None:
+                record.update({'status': 'ok', 'report': report})
+            else:
+                record.update({'status': 'error', 'error': f"{type(error).__name__}: {error}"})
+            write_record(record)
+        
+        cases = iter_manifest(manifest_path, completed_ids, counts, write_record)
+        stats = run_sync(orchestrator.arun_batch(cases, concurrency=args.concurrency, on_result=on_result))
+    
+    elapsed = time.perf_counter() - start
+    counts['succeeded'] += stats['succeeded']
+    counts['failed'] += stats['failed']
+    processed = counts['succeeded'] + counts['failed']
+    
+    print("\n" + "=" * 80)
+    print("📊 BATCH SUMMARY")
+    print("=" * 80)
+    print(f"   Succeeded:  {counts['succeeded']}")
+    print(f"   Failed:     {counts['failed']}")
+    print(f"   Skipped:    {counts['skipped']} (already succeeded)")
+    print(f"   Elapsed:    {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.2f} cases/s)")
+    print(f"   Results:    {output_path}")
+    print("=" * 80 + "\n")
 
 
 def main():
@@ -296,6 +440,10 @@ def main():
     # Parse arguments
     args = parse_arguments()
     
+    if args.batch:
+        run_batch(args)
+        return
+    
     # Create orchestrator
     orchestrator = MaiOpinionOrchestrator()
     
@@ -304,7 +452,10 @@ def main():
         args.image, 
         args.condition,
         patient_email=args.email,
-        no_prompt=args.no_prompt
+        no_prompt=args.no_prompt,
+        early_followup=args.early_followup,
+        stream=not args.no_stream,
+        speculative_treatment=args.speculative_treatment
     )
     
     # Print report
@@ -322,7 +473,8 @@ def main():
         "finding": report["finding"],
         "diagnosis": report["diagnosis"],
         "treatment": report["treatment"],
-        "follow_up": report["follow_up"]
+        "follow_up": report["follow_up"],
+        "metrics": report["metrics"]
     }, indent=2))
     print()
 
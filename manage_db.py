@@ -3,125 +3,145 @@ Patient Database Manager
 Utility script for managing the MaiOpinion patient database
 """
 
-import csv
 import sys
 from pathlib import Path
 from datetime import datetime
 
+from agents.patient_store import (
+    LEGACY_CSV_PATH, PATIENT_STATUSES, PatientFilter, SQLitePatientStore, get_patient_store,
+    patient_db_backend, patient_db_path
+)
+
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 
-DB_PATH = Path("patients_db.csv")
+DB_PATH = patient_db_path()
+
 
+def database_exists() -> bool:
+    """True if there is a patient database (or a legacy CSV to migrate from)"""
+    return DB_PATH.exists() or LEGACY_CSV_PATH.exists()
 
-def view_all_patients():
-    """Display all patients in a formatted table"""
-    if not DB_PATH.exists():
+
+def view_all_patients(page: int = 1, limit: int = 50, patient_filter: PatientFilter = None):
+    """
+    Display one page of patients in a formatted table
+    
+    Only the requested page is read from the database, so listing stays
+    fast and memory use stays flat however many patients are stored.
+    """
+    if not database_exists():
         print("❌ No patient database found.")
         return
     
-    with open(DB_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        patients = list(reader)
+    store = get_patient_store()
+    total = store.count(patient_filter)
     
-    if not patients:
-        print("📭 No patients registered yet.")
+    if not total:
+        print("📭 No patients match these filters." if patient_filter else "📭 No patients registered yet.")
+        return
+    
+    pages = (total + limit - 1) // limit
+    if page > pages:
+        print(f"❌ Page {page} is past the last page ({pages}).")
         return
     
+    offset = (page - 1) * limit
+    patients = store.find(patient_filter, limit=limit, offset=offset)
+    
     print("\n" + "=" * 120)
-    print(f"👥 PATIENT DATABASE - {len(patients)} Patient(s) Registered")
+    label = "Matching" if patient_filter else "Registered"
+    print(f"👥 PATIENT DATABASE - {total} Patient(s) {label} - Page {page} of {pages}")
     print("=" * 120)
     
     # Print header
-    print(f"\n{'#':<4} {'Patient ID':<20} {'Email':<30} {'Condition':<25} {'Follow-Up':<12} {'Sent':<6}")
+    print(f"\n{'#':<8} {'Patient ID':<28} {'Email':<30} {'Condition':<25} {'Follow-Up':<12} {'Sent':<6}")
     print("-" * 120)
     
     # Print patients
-    for i, patient in enumerate(patients, 1):
-        print(f"{i:<4} {patient['patient_id']:<20} {patient['email']:<30} "
+    for i, patient in enumerate(patients, offset + 1):
+        print(f"{i:<8} {patient['patient_id']:<28} {patient['email']:<30} "
               f"{patient['condition'][:22]+'...' if len(patient['condition']) > 25 else patient['condition']:<25} "
               f"{patient['follow_up_date']:<12} {'✅' if patient['email_sent'] == 'Yes' else '❌':<6}")
     
-    print("-" * 120 + "\n")
+    print("-" * 120)
+    if page < pages:
+        print(f"Showing {offset + 1}-{offset + len(patients)} of {total}. Next page: --page {page + 1}")
+    print()
 
 
 def view_patient_details(patient_id: str):
     """Display detailed information for a specific patient"""
-    if not DB_PATH.exists():
+    if not database_exists():
         print("❌ No patient database found.")
         return
     
-    with open(DB_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for patient in reader:
-            if patient['patient_id'] == patient_id:
-                print("\n" + "=" * 80)
-                print(f"📋 PATIENT DETAILS: {patient_id}")
-                print("=" * 80)
-                print(f"\n📧 Email:            {patient['email']}")
-                print(f"📅 Registered:       {patient['created_at']}")
-                print(f"🩺 Condition:        {patient['condition']}")
-                print(f"🔬 Diagnosis:        {patient['diagnosis']}")
-                print(f"\n💊 Treatment Plan:")
-                print(f"   {patient['treatment']}")
-                print(f"\n📅 Follow-Up:")
-                print(f"   Timeline:         {patient['follow_up_timeline']}")
-                print(f"   Scheduled Date:   {patient['follow_up_date']}")
-                print(f"   Email Sent:       {'✅ Yes' if patient['email_sent'] == 'Yes' else '❌ No'}")
-                print("\n" + "=" * 80 + "\n")
-                return
-    
-    print(f"❌ Patient ID '{patient_id}' not found.")
-
-
-def count_statistics():
-    """Display database statistics"""
-    if not DB_PATH.exists():
+    patient = get_patient_store().get(patient_id)
+    if patient is None:
+        print(f"❌ Patient ID '{patient_id}' not found.")
+        return
+    
+    print("\n" + "=" * 80)
+    print(f"📋 PATIENT DETAILS: {patient['patient_id']}")
+    print("=" * 80)
+    if patient['patient_id'] != patient_id:
+        print(f"\n🔁 Legacy ID:        {patient_id}")
+    print(f"\n📧 Email:            {patient['email']}")
+    print(f"📅 Registered:       {patient['created_at']}")
+    print(f"🩺 Condition:        {patient['condition']}")
+    print(f"🔬 Diagnosis:        {patient['diagnosis']}")
+    print(f"\n💊 Treatment Plan:")
+    print(f"   {patient['treatment']}")
+    print(f"\n📅 Follow-Up:")
+    print(f"   Timeline:         {patient['follow_up_timeline']}")
+    print(f"   Scheduled Date:   {patient['follow_up_date']}")
+    print(f"   Email Sent:       {'✅ Yes' if patient['email_sent'] == 'Yes' else '❌ No'}")
+    print("\n" + "=" * 80 + "\n")
+
+
+def count_statistics(days: int = 14, top: int = 10):
+    """Display database statistics with per-day and per-diagnosis breakdowns"""
+    if not database_exists():
         print("❌ No patient database found.")
         return
     
-    with open(DB_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        patients = list(reader)
+    stats = get_patient_store().statistics(datetime.now().strftime('%Y-%m-%d'), days=days, top=top)
     
-    if not patients:
+    if not stats['total']:
         print("📭 No patients registered yet.")
         return
     
-    total = len(patients)
-    sent = sum(1 for p in patients if p['email_sent'] == 'Yes')
-    pending = total - sent
-    
-    # Count by follow-up status
-    today = datetime.now().date()
-    overdue = 0
-    upcoming = 0
-    
-    for p in patients:
-        if p['email_sent'] == 'No':
-            follow_date = datetime.strptime(p['follow_up_date'], '%Y-%m-%d').date()
-            if follow_date < today:
-                overdue += 1
-            else:
-                upcoming += 1
-    
     print("\n" + "=" * 60)
     print("📊 DATABASE STATISTICS")
     print("=" * 60)
-    print(f"\n📈 Total Patients:        {total}")
-    print(f"✅ Emails Sent:           {sent}")
-    print(f"⏳ Pending Emails:        {pending}")
-    print(f"\n⚠️  Overdue Follow-ups:   {overdue}")
-    print(f"📅 Upcoming Follow-ups:   {upcoming}")
+    print(f"\n📈 Total Patients:        {stats['total']}")
+    print(f"✅ Emails Sent:           {stats['sent']}")
+    print(f"⏳ Pending Emails:        {stats['pending']}")
+    print(f"\n⚠️  Overdue Follow-ups:   {stats['overdue']}")
+    print(f"📅 Upcoming Follow-ups:   {stats['upcoming']}")
+    
+    print(f"\n📆 Follow-ups due in the next {days} day(s):")
+    if stats['by_day']:
+        for day in stats['by_day']:
+            print(f"   {day['date']}   {day['total']:>6} total   {day['pending']:>6} pending")
+    else:
+        print("   (none)")
+    
+    print(f"\n🩺 Top {top} diagnoses:")
+    for entry in stats['by_diagnosis']:
+        diagnosis = entry['diagnosis'] or '(none)'
+        if len(diagnosis) > 30:
+            diagnosis = diagnosis[:27] + '...'
+        print(f"   {diagnosis:<30} {entry['total']:>6} total   {entry['pending']:>6} pending")
     print("\n" + "=" * 60 + "\n")
 
 
 def clear_database():
     """Clear all patient data (with confirmation)"""
-    if not DB_PATH.exists():
+    if not database_exists():
         print("❌ No patient database found.")
         return
     
@@ -129,21 +149,40 @@ def clear_database():
     confirm = input("Type 'DELETE' to confirm: ")
     
     if confirm == "DELETE":
-        DB_PATH.unlink()
-        print("✅ Patient database deleted.")
+        get_patient_store().clear()
+        print("✅ Patient database cleared.")
     else:
         print("❌ Operation cancelled.")
 
 
 def export_to_csv(output_path: str):
-    """Export database to a different location"""
-    if not DB_PATH.exists():
+    """Export database to a CSV file"""
+    if not database_exists():
         print("❌ No patient database found.")
         return
     
-    import shutil
-    shutil.copy(DB_PATH, output_path)
-    print(f"✅ Database exported to: {output_path}")
+    count = get_patient_store().export_csv(output_path)
+    print(f"✅ Exported {count} patient(s) to: {output_path}")
+
+
+def migrate_from_csv(csv_path: str):
+    """Import a legacy patients_db.csv file into the SQLite database"""
+    csv_path = Path(csv_path)
+    if not csv_path.exists():
+        print(f"❌ CSV file not found: {csv_path}")
+        return
+    
+    if patient_db_backend() != "sqlite":
+        print("❌ Migration requires the sqlite backend (PATIENT_DB_BACKEND=sqlite).")
+        return
+    
+    store = SQLitePatientStore(DB_PATH)
+    if store.migrated_from():
+        print(f"ℹ️  Database was already migrated from: {store.migrated_from()}")
+        return
+    
+    count = store.migrate_csv(csv_path)
+    print(f"✅ Migrated {count} patient(s) from {csv_path} into {store.path}")
 
 
 def main():
@@ -155,10 +194,14 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
-  python manage_db.py --list              # List all patients
+  python manage_db.py --list              # List patients (first 50)
+  python manage_db.py --list --page 3 --limit 100
+  python manage_db.py --list --status overdue --from 2025-01-01 --to 2025-03-31
+  python manage_db.py --list --email example.com
   python manage_db.py --stats             # Show statistics
   python manage_db.py --view PT12345      # View patient details
   python manage_db.py --export backup.csv # Export database
+  python manage_db.py --migrate           # Import patients_db.csv into SQLite
   python manage_db.py --clear             # Clear database (dangerous!)
         """
     )
@@ -169,12 +212,66 @@ Examples:
         help='List all registered patients'
     )
     
+    parser.add_argument(
+        '--page',
+        type=int,
+        default=1,
+        help='Page of the patient list to show (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=50,
+        help='Patients per page (default: 50)'
+    )
+    
+    parser.add_argument(
+        '--from',
+        dest='date_from',
+        metavar='YYYY-MM-DD',
+        help='List patients with a follow-up date on or after this date'
+    )
+    
+    parser.add_argument(
+        '--to',
+        dest='date_to',
+        metavar='YYYY-MM-DD',
+        help='List patients with a follow-up date on or before this date'
+    )
+    
+    parser.add_argument(
+        '--status',
+        choices=PATIENT_STATUSES,
+        help='List only sent, pending or overdue follow-ups'
+    )
+    
+    parser.add_argument(
+        '--email',
+        metavar='TEXT',
+        help='List patients whose email contains TEXT'
+    )
+    
     parser.add_argument(
         '--stats', '-s',
         action='store_true',
         help='Show database statistics'
     )
     
+    parser.add_argument(
+        '--days',
+        type=int,
+        default=14,
+        help='Statistics: days of upcoming follow-ups to break down (default: 14)'
+    )
+    
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='Statistics: number of diagnoses to break down (default: 10)'
+    )
+    
     parser.add_argument(
         '--view', '-v',
         metavar='PATIENT_ID',
@@ -187,6 +284,14 @@ Examples:
         help='Export database to file'
     )
     
+    parser.add_argument(
+        '--migrate',
+        nargs='?',
+        const=str(LEGACY_CSV_PATH),
+        metavar='CSV_FILE',
+        help=f'Import a legacy CSV database (default: {LEGACY_CSV_PATH})'
+    )
+    
     parser.add_argument(
         '--clear',
         action='store_true',
@@ -200,12 +305,30 @@ Examples:
         parser.print_help()
         sys.exit(0)
     
+    if args.page < 1 or args.limit < 1:
+        parser.error("--page and --limit must be positive")
+    if args.days < 1 or args.top < 1:
+        parser.error("--days and --top must be positive")
+    for value in (args.date_from, args.date_to):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                parser.error(f"invalid date '{value}' (expected YYYY-MM-DD)")
+    
+    patient_filter = None
+    if args.date_from or args.date_to or args.status or args.email:
+        patient_filter = PatientFilter(args.date_from, args.date_to, args.status, args.email)
+    
     # Execute commands
+    if args.migrate:
+        migrate_from_csv(args.migrate)
+    
     if args.list:
-        view_all_patients()
+        view_all_patients(args.page, args.limit, patient_filter)
     
     if args.stats:
-        count_statistics()
+        count_statistics(args.days, args.top)
     
     if args.view:
         view_patient_details(args.view)
@@ -4,9 +4,10 @@ Checks patient database and sends scheduled follow-up reminders
 """
 
 import sys
-from pathlib import Path
 from datetime import datetime
 from agents.followup import FollowUpAgent
+from agents.followup_scheduler import next_wakeup
+from agents.patient_store import LEGACY_CSV_PATH, get_patient_store, patient_db_path
 
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
@@ -23,9 +24,9 @@ def send_scheduled_emails():
     print()
     
     # Check if database exists
-    db_path = Path("patients_db.csv")
-    if not db_path.exists():
-        print("❌ No patient database found (patients_db.csv)")
+    db_path = patient_db_path()
+    if not db_path.exists() and not LEGACY_CSV_PATH.exists():
+        print(f"❌ No patient database found ({db_path})")
         print("   Run a diagnosis with email registration first.")
         return
     
@@ -36,23 +37,50 @@ def send_scheduled_emails():
     print("\nChecking for patients due for follow-up...")
     print("-" * 80)
     
-    emails_sent = agent.send_follow_up_emails()
+    result = agent.send_follow_up_emails()
     
     print("-" * 80)
-    if emails_sent > 0:
-        print(f"\n✅ Successfully sent {emails_sent} follow-up email(s)!")
+    if result['sent'] > 0:
+        print(f"\n✅ Successfully sent {result['sent']} follow-up email(s)!")
+        print(f"   Throughput: {result['per_second']} email(s)/s over {result['seconds']}s")
     else:
         print("\n📭 No follow-up emails due at this time.")
+    if result['failed'] > 0:
+        print(f"⚠️  {result['failed']} email(s) failed and will be retried on a later run")
     
     print("\n" + "=" * 80)
 
 
+def run_daemon(poll_interval: float):
+    """Keep running, sending follow-ups as they come due"""
+    print("=" * 80)
+    print("📧 MaiOpinion - Follow-Up Email Daemon")
+    print("=" * 80)
+    print(f"Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Max sleep between runs: {poll_interval:.0f}s  (Ctrl+C to stop)")
+    print()
+    
+    agent = FollowUpAgent()
+    totals = {'sent': 0, 'failed': 0}
+    
+    def on_run(result, wait):
+        totals['sent'] += result['sent']
+        totals['failed'] += result['failed']
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        print(f"[{stamp}] Sent {result['sent']}, failed {result['failed']} "
+              f"in {result['seconds']}s ({result['per_second']}/s); "
+              f"total sent {totals['sent']}. Next run at {next_wakeup(wait)}")
+    
+    try:
+        agent.scheduler().run_forever(poll_interval=poll_interval, on_run=on_run)
+    except KeyboardInterrupt:
+        print(f"\n⏹️  Daemon stopped. Sent {totals['sent']} email(s), {totals['failed']} failed.")
+
+
 def view_patient_database():
     """View all registered patients"""
-    import csv
-    
-    db_path = Path("patients_db.csv")
-    if not db_path.exists():
+    db_path = patient_db_path()
+    if not db_path.exists() and not LEGACY_CSV_PATH.exists():
         print("❌ No patient database found")
         return
     
@@ -60,15 +88,8 @@ def view_patient_database():
     print("👥 REGISTERED PATIENTS")
     print("=" * 80 + "\n")
     
-    with open(db_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        patients = list(reader)
-    
-    if not patients:
-        print("No patients registered yet.")
-        return
-    
-    for i, patient in enumerate(patients, 1):
+    i = 0
+    for i, patient in enumerate(get_patient_store().all(), 1):
         print(f"Patient #{i}")
         print(f"  ID: {patient['patient_id']}")
         print(f"  Email: {patient['email']}")
@@ -78,6 +99,9 @@ def view_patient_database():
         print(f"  Email Sent: {'✅ Yes' if patient['email_sent'] == 'Yes' else '❌ No'}")
         print(f"  Registered: {patient['created_at']}")
         print()
+    
+    if i == 0:
+        print("No patients registered yet.")
 
 
 def main():
@@ -92,6 +116,10 @@ Examples:
   python send_followups.py                    # Send scheduled emails
   python send_followups.py --view             # View patient database
   python send_followups.py --send --view      # Send emails and view database
+  python send_followups.py --daemon           # Keep running, send as emails come due
+
+Several senders may run at once against the same database; each email is
+claimed by one of them and sent once.
         """
     )
     
@@ -114,14 +142,33 @@ Examples:
         help='Skip sending emails (useful with --view)'
     )
     
+    parser.add_argument(
+        '--daemon', '-d',
+        action='store_true',
+        help='Run continuously, sleeping until the next follow-up is due'
+    )
+    
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=3600,
+        metavar='SECONDS',
+        help='Daemon mode: longest sleep between checks (default: 3600)'
+    )
+    
     args = parser.parse_args()
     
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    
     # View database if requested
     if args.view:
         view_patient_database()
     
     # Send emails unless explicitly disabled
-    if not args.no_send:
+    if args.daemon:
+        run_daemon(args.interval)
+    elif not args.no_send:
         send_scheduled_emails()
 
 
@@ -0,0 +1,72 @@
+"""
+Tests for resuming main.py --batch runs
+"""
+
+import json
+from argparse import Namespace
+
+import main
+
+
+class FakeOrchestrator:
+    """Diagnoses every case, failing the IDs in fail_ids"""
+
+    fail_ids = set()
+    runs = []
+
+    def __init__(self, **options):
+        pass
+
+    async def arun_batch(self, cases, concurrency=8, on_result=None):
+        stats = {'succeeded': 0, 'failed': 0}
+        for case in cases:
+            FakeOrchestrator.runs.append(case['id'])
+            if case['id'] in self.fail_ids:
+                stats['failed'] += 1
+                on_result(case, None, TimeoutError("LLM call timed out"), 0.1)
+            else:
+                stats['succeeded'] += 1
+                on_result(case, {'diagnosis': 'Pneumonia'}, None, 0.1)
+        return stats
+
+
+def run(tmp_path, monkeypatch, fail_ids):
+    monkeypatch.setattr(main, "AsyncOrchestrator", FakeOrchestrator)
+    FakeOrchestrator.fail_ids = set(fail_ids)
+    FakeOrchestrator.runs = []
+    main.run_batch(Namespace(
+        batch=str(tmp_path / "cases.jsonl"), output=None, concurrency=2,
+        early_followup=False, speculative_treatment=False
+    ))
+    return FakeOrchestrator.runs
+
+
+def records(tmp_path):
+    with open(tmp_path / "cases_reports.jsonl", encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_retries_failed_cases_only(tmp_path, monkeypatch):
+    with open(tmp_path / "cases.jsonl", 'w', encoding='utf-8') as f:
+        for case_id in ("a", "b", "c"):
+            f.write(json.dumps({"id": case_id, "image": f"{case_id}.png", "condition": "cough"}) + "\n")
+
+    assert run(tmp_path, monkeypatch, fail_ids={"b"}) == ["a", "b", "c"]
+    assert [(r['id'], r['status']) for r in records(tmp_path)] == [("a", "ok"), ("b", "error"), ("c", "ok")]
+
+    # The transient failure is retried; finished cases are not
+    assert run(tmp_path, monkeypatch, fail_ids=set()) == ["b"]
+    assert [(r['id'], r['status']) for r in records(tmp_path)][-1] == ("b", "ok")
+    assert main.load_completed_ids(tmp_path / "cases_reports.jsonl") == {"a", "b", "c"}
+
+    assert run(tmp_path, monkeypatch, fail_ids=set()) == []
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(
+        json.dumps({"id": "a", "status": "ok"}) + "\n"
+        + json.dumps({"id": "b", "status": "error", "error": "boom"}) + "\n"
+        + '{"id": "c", "sta', encoding='utf-8'
+    )
+    assert main.load_completed_ids(output) == {"a"}
@@ -0,0 +1,120 @@
+"""
+Tests for LLM call policies: retries and hedged requests
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from openai import APIConnectionError
+
+from agents.call_policy import CallPolicy
+
+
+def flaky(failures, result="ok"):
+    """Attempt factory raising each of failures in turn, then returning result"""
+    failures = list(failures)
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        if failures:
+            raise failures.pop(0)
+        return result
+
+    return attempt, calls
+
+
+def run(policy, attempt):
+    return asyncio.run(policy.run(attempt))
+
+
+def test_transient_errors_are_retried():
+    policy = CallPolicy("test", retries=2, backoff_base=0)
+    error = APIConnectionError(request=httpx.Request("POST", "http://llm.test/"))
+    attempt, calls = flaky([asyncio.TimeoutError(), error])
+
+    assert run(policy, attempt) == "ok"
+    assert len(calls) == 3
+    assert policy.stats()["retries"] == 2
+    assert policy.stats()["timeouts"] == 1
+
+
+def test_retries_are_bounded():
+    policy = CallPolicy("test", retries=1, backoff_base=0)
+    attempt, calls = flaky([asyncio.TimeoutError()] * 5)
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(policy, attempt)
+    assert len(calls) == 2
+    assert policy.stats()["failures"] == 1
+
+
+def test_other_errors_are_not_retried():
+    policy = CallPolicy("test", retries=3, backoff_base=0)
+    attempt, calls = flaky([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        run(policy, attempt)
+    assert len(calls) == 1
+
+
+def test_backoff_is_capped():
+    policy = CallPolicy("test", backoff_base=0.5, backoff_cap=2.0)
+    assert all(0 <= policy.backoff(attempt) <= 2.0 for attempt in range(10) for _ in range(20))
+
+
+def test_no_hedging_without_samples():
+    policy = CallPolicy("test", hedge=True, hedge_min_delay=0.01)
+    assert policy.hedge_delay() is None
+    for _ in range(CallPolicy.MIN_SAMPLES):
+        policy.observe(0.02)
+    assert policy.hedge_delay() == pytest.approx(0.02)
+
+
+def test_slow_attempt_is_hedged():
+    policy = CallPolicy("test", hedge=True, hedge_min_delay=0.01)
+    for _ in range(CallPolicy.MIN_SAMPLES):
+        policy.observe(0.01)
+
+    started = []
+    cancelled = []
+
+    async def attempt():
+        number = len(started)
+        started.append(number)
+        try:
+            # The first attempt hangs; the hedge answers quickly
+            await asyncio.sleep(5 if number == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        return number
+
+    async def main():
+        result = await policy.run(attempt)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert cancelled == [0]
+    stats = policy.stats()
+    assert (stats["hedges_sent"], stats["hedges_won"]) == (1, 1)
+
+
+def test_hedge_failure_falls_back_to_primary():
+    policy = CallPolicy("test", hedge=True, hedge_min_delay=0.01, retries=0)
+    for _ in range(CallPolicy.MIN_SAMPLES):
+        policy.observe(0.01)
+    started = []
+
+    async def attempt():
+        number = len(started)
+        started.append(number)
+        if number == 1:
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    assert run(policy, attempt) == "primary"
+    assert policy.stats()["hedges_won"] == 0
@@ -0,0 +1,120 @@
+"""
+Tests for batching streamed agent text into API step_delta events
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from agents import diagnosis_events
+from agents.diagnosis_events import DeltaBuffer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(diagnosis_events.time, "monotonic", clock)
+    return clock
+
+
+def delta(step, text, reset=False):
+    return {'type': 'step_delta', 'stage': f'stage{step}', 'step': step, 'text': text, 'reset': reset}
+
+
+def test_text_is_batched_per_step(clock):
+    buffer = DeltaBuffer(interval=0.25)
+    for event in (delta(3, "Dental "), delta(4, "Fill"), delta(3, "caries")):
+        buffer.add(event)
+
+    assert buffer.flush() == [
+        {'type': 'step_delta', 'step': 3, 'text': "Dental caries", 'reset': False},
+        {'type': 'step_delta', 'step': 4, 'text': "Fill", 'reset': False},
+    ]
+    assert buffer.flush() == []
+
+
+def test_due_after_interval(clock):
+    buffer = DeltaBuffer(interval=0.25)
+    assert not buffer.due()
+
+    buffer.add(delta(3, "a"))
+    clock.now += 0.2
+    assert not buffer.due()
+    clock.now += 0.05
+    assert buffer.due()
+
+    buffer.flush()
+    buffer.add(delta(3, "b"))
+    assert not buffer.due()
+
+
+def test_reset_discards_buffered_text(clock):
+    buffer = DeltaBuffer()
+    buffer.add(delta(3, "Pneumo"))
+    buffer.add(delta(3, "Dental", reset=True))
+    buffer.add(delta(3, " caries"))
+
+    # The reset reaches the client, which also drops text flushed earlier
+    assert buffer.flush() == [{'type': 'step_delta', 'step': 3, 'text': "Dental caries", 'reset': True}]
+
+
+def fake_pipeline(clock, events):
+    """Pipeline whose stream() replays (seconds to advance, event) pairs"""
+    def stream(context, deltas=False):
+        for seconds, event in events:
+            clock.now += seconds
+            yield event
+    return SimpleNamespace(stream=stream)
+
+
+def run_events(monkeypatch, clock, pipeline_events):
+    monkeypatch.setattr(diagnosis_events, "get_agent_pool", lambda: SimpleNamespace(get=lambda: None))
+    monkeypatch.setattr(diagnosis_events, "build_diagnostic_pipeline",
+                        lambda agents, **options: fake_pipeline(clock, pipeline_events))
+    monkeypatch.setattr(diagnosis_events, "build_api_report", lambda results, *args: results)
+    return list(diagnosis_events.diagnosis_events("scan.png", None, "scan.png", "tooth pain"))
+
+
+def test_deltas_flush_on_interval_and_before_step_complete(monkeypatch, clock):
+    result = {'diagnosis': 'Dental caries', 'confidence': 'high'}
+    events = run_events(monkeypatch, clock, [
+        (0.0, {'type': 'step_start', 'stage': 'reasoning', 'step': 3}),
+        (0.1, delta(3, "Dental")),
+        (0.1, delta(3, " car")),
+        (0.1, delta(3, "ies")),
+        (0.01, delta(3, " (high)")),
+        (0.01, {'type': 'step_complete', 'stage': 'reasoning', 'step': 3, 'result': result, 'seconds': 0.32}),
+        (0.0, {'type': 'complete', 'results': {'reasoning': result}}),
+    ])
+
+    assert [(e['type'], e.get('text')) for e in events] == [
+        ('step_start', None),
+        # 0.3s after the buffer was created: one batch
+        ('step_delta', "Dental caries"),
+        # The rest is flushed before the step completes
+        ('step_delta', " (high)"),
+        ('step_complete', None),
+        ('complete', None),
+    ]
+    assert events[3]['message'] == "Diagnosis: Dental caries"
+
+
+def test_pipeline_error_becomes_error_event(monkeypatch, clock):
+    def failing(context, deltas=False):
+        yield delta(1, "partial")
+        raise ValueError("Reasoning agent output validation failed")
+
+    monkeypatch.setattr(diagnosis_events, "get_agent_pool", lambda: SimpleNamespace(get=lambda: None))
+    monkeypatch.setattr(diagnosis_events, "build_diagnostic_pipeline",
+                        lambda agents, **options: SimpleNamespace(stream=failing))
+
+    events = list(diagnosis_events.diagnosis_events("scan.png", None, "scan.png", "tooth pain"))
+    assert events == [{'type': 'error', 'message': "Reasoning agent output validation failed"}]
@@ -0,0 +1,122 @@
+"""
+Tests for SMTP delivery and its error classification, against a local
+aiosmtpd server
+"""
+
+import socket
+from email.message import EmailMessage
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+from aiosmtpd.smtp import AuthResult
+
+from agents.email_delivery import DeliveryEngine, SMTPConnectionPool
+
+
+class RecipientHandler:
+    """Accepts mail except for recipients named after an SMTP reply code"""
+
+    def __init__(self):
+        self.delivered = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        local = address.split('@')[0]
+        if local == 'unknown':
+            return '550 No such user'
+        if local == 'busy':
+            return '451 Try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def check_password(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=auth_data.password == b'secret', handled=False)
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecipientHandler()
+    controller = aiosmtpd_controller.Controller(
+        handler, hostname='127.0.0.1', port=free_port(),
+        authenticator=check_password, auth_require_tls=False
+    )
+    controller.start()
+    try:
+        yield controller, handler
+    finally:
+        controller.stop()
+
+
+def engine_for(controller, password='secret', retries=2):
+    pool = SMTPConnectionPool(
+        controller.hostname, controller.port, username='clinic', password=password,
+        starttls=False, timeout=5, size=2
+    )
+    return DeliveryEngine(pool, retries=retries, backoff_base=0)
+
+
+def message_to(recipient):
+    message = EmailMessage()
+    message['From'] = 'followup@maiopinion.test'
+    message['To'] = recipient
+    message['Subject'] = 'Follow-up reminder'
+    message.set_content('Time for your follow-up.')
+    return message
+
+
+def send_one(engine, recipient):
+    try:
+        return engine.send_batch([(recipient, message_to(recipient))])['results'][0]
+    finally:
+        engine.close()
+
+
+def test_message_is_sent(smtp_server):
+    controller, handler = smtp_server
+    result = send_one(engine_for(controller), 'patient@example.com')
+
+    assert (result.sent, result.code, result.attempts) == (True, 250, 1)
+    assert handler.delivered == ['patient@example.com']
+
+
+def test_permanent_rejection_is_not_retried(smtp_server):
+    controller, _ = smtp_server
+    result = send_one(engine_for(controller), 'unknown@example.com')
+
+    assert (result.sent, result.code, result.attempts) == (False, 550, 1)
+    assert 'No such user' in result.detail
+
+
+def test_transient_rejection_is_retried(smtp_server):
+    controller, _ = smtp_server
+    result = send_one(engine_for(controller, retries=2), 'busy@example.com')
+
+    assert (result.sent, result.code, result.attempts) == (False, 451, 3)
+
+
+def test_auth_failure_is_permanent(smtp_server):
+    controller, handler = smtp_server
+    result = send_one(engine_for(controller, password='wrong', retries=3), 'patient@example.com')
+
+    assert not result.sent
+    assert result.code == 535
+    assert result.attempts == 1
+    assert handler.delivered == []
+
+
+def test_connection_refused_is_retried():
+    pool = SMTPConnectionPool('127.0.0.1', free_port(), starttls=False, timeout=5)
+    result = send_one(DeliveryEngine(pool, retries=2, backoff_base=0), 'patient@example.com')
+
+    assert (result.sent, result.code, result.attempts) == (False, None, 3)
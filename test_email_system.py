@@ -5,9 +5,10 @@ Demonstrates the complete email workflow
 
 import subprocess
 import sys
-from pathlib import Path
 from datetime import datetime
 
+from agents.patient_store import patient_db_path
+
 
 def print_header(title: str):
     """Print formatted section header"""
@@ -36,7 +37,7 @@ def main():
     
     # Test 1: Check if database exists
     print_header("TEST 1: Database Status Check")
-    db_path = Path("patients_db.csv")
+    db_path = patient_db_path()
     if db_path.exists():
         print(f"✅ Database found: {db_path}")
         print(f"   Size: {db_path.stat().st_size} bytes")
@@ -0,0 +1,92 @@
+"""
+Tests for the follow-up scheduler's daemon wait
+"""
+
+from datetime import datetime
+
+import pytest
+
+from agents.followup_scheduler import FollowUpScheduler
+from agents.patient_ids import new_patient_id
+from agents.patient_store import CSVPatientStore, SQLitePatientStore
+
+NOW = datetime(2024, 1, 10, 12, 0, 0)
+
+
+def patient(follow_up_date):
+    return {
+        'patient_id': new_patient_id(),
+        'email': 'patient@example.com',
+        'follow_up_date': follow_up_date,
+        'email_sent': 'No',
+    }
+
+
+@pytest.fixture(params=["sqlite", "csv"])
+def store(request, tmp_path):
+    if request.param == "csv":
+        yield CSVPatientStore(tmp_path / "patients_db.csv")
+        return
+    store = SQLitePatientStore(tmp_path / "patients.db")
+    yield store
+    store.close()
+
+
+def failing_delivery(patients, begin, finish):
+    for record in patients:
+        if begin(record['patient_id']):
+            finish(record['patient_id'], False, "421 try later")
+
+
+def test_nothing_pending(store):
+    assert FollowUpScheduler(store, failing_delivery).seconds_until_next_due(NOW) is None
+
+
+def test_waits_for_next_due_date(store):
+    store.add(patient("2024-01-12"))
+    # Midnight starting 12 January
+    assert FollowUpScheduler(store, failing_delivery).seconds_until_next_due(NOW) == 36 * 3600
+
+
+def test_due_patient_can_be_sent_now(store):
+    store.add(patient("2024-01-12"))
+    store.add(patient("2024-01-09"))
+    assert FollowUpScheduler(store, failing_delivery).seconds_until_next_due(NOW) == 0
+
+
+def test_waits_for_failed_send_retry(store):
+    store.add(patient("2024-01-09"))
+    store.add(patient("2099-01-20"))
+    scheduler = FollowUpScheduler(store, failing_delivery, retry_delay=600)
+
+    assert scheduler.run_due()['failed'] == 1
+    assert scheduler.seconds_until_next_due() == pytest.approx(600, abs=5)
+
+
+def test_waits_for_other_workers_lease(store):
+    store.add(patient("2024-01-09"))
+    store.claim_due("2024-01-10", "other", lease=300)
+    scheduler = FollowUpScheduler(store, failing_delivery, worker="me")
+    assert scheduler.seconds_until_next_due() == pytest.approx(300, abs=5)
+
+
+def test_due_date_sooner_than_lease_expiry(store):
+    store.add(patient("2024-01-09"))
+    store.claim_due("2024-01-10", "other", lease=7 * 86400)
+    store.add(patient("2024-01-11"))
+    # Midnight starting 11 January
+    assert FollowUpScheduler(store, failing_delivery).seconds_until_next_due(NOW) == 12 * 3600
+
+
+def test_daemon_sleeps_until_retry(store, monkeypatch):
+    store.add(patient("2024-01-09"))
+    scheduler = FollowUpScheduler(store, failing_delivery, retry_delay=600)
+    waits = []
+
+    def stop(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr("agents.followup_scheduler.time.sleep", stop)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run_forever(poll_interval=3600, on_run=lambda result, wait: waits.append(wait))
+    assert waits == [pytest.approx(601, abs=5)]
@@ -0,0 +1,216 @@
+"""
+Tests for the background job queue and the job event stream
+"""
+
+import io
+import threading
+
+import pytest
+
+from agents.job_queue import JobQueue, JobQueueFull, JobWorkerPool, MemoryJobQueue, RedisJobQueue
+from agents.upload_store import UploadStore
+
+
+def finished_job(queue, events):
+    """Enqueue a job, run it to completion and return its ID"""
+    job_id = queue.enqueue({'condition': 'cough'})
+    queue.dequeue(timeout=0)
+    for event in events:
+        queue.publish(job_id, event)
+    return job_id
+
+
+def test_event_ids_and_resume():
+    queue = MemoryJobQueue()
+    job_id = finished_job(queue, [
+        {'type': 'step_start', 'step': 1},
+        {'type': 'step_complete', 'step': 1},
+        {'type': 'complete', 'report': {}}
+    ])
+
+    events, finished = queue.read_events(job_id)
+    assert [event_id for event_id, _ in events] == [1, 2, 3]
+    assert finished
+
+    events, finished = queue.read_events(job_id, after_id=2)
+    assert events == [(3, {'type': 'complete', 'report': {}})]
+    assert finished
+
+
+def test_resume_after_last_event_returns_at_once():
+    queue = MemoryJobQueue()
+    job_id = finished_job(queue, [{'type': 'step_start', 'step': 1}, {'type': 'complete'}])
+
+    # A finished job has nothing more to wait for, whatever the timeout
+    assert queue.read_events(job_id, after_id=2, timeout=30) == ([], True)
+    assert queue.read_events(job_id, after_id=5, timeout=30) == ([], True)
+
+
+def test_running_job_times_out_without_events():
+    queue = MemoryJobQueue()
+    job_id = queue.enqueue({})
+    queue.dequeue(timeout=0)
+
+    assert queue.read_events(job_id, timeout=0.05) == ([], False)
+    assert queue.read_events('missing') is None
+
+
+def test_read_waits_for_published_event():
+    queue = MemoryJobQueue()
+    job_id = queue.enqueue({})
+    queue.dequeue(timeout=0)
+
+    timer = threading.Timer(0.05, queue.publish, (job_id, {'type': 'step_start', 'step': 1}))
+    timer.start()
+    events, finished = queue.read_events(job_id, timeout=5)
+    timer.join()
+
+    assert events == [(1, {'type': 'step_start', 'step': 1})]
+    assert not finished
+
+
+def test_trimmed_log_returns_oldest_retained():
+    queue = MemoryJobQueue(max_events=3)
+    job_id = finished_job(queue, [{'type': 'step_start', 'step': n} for n in range(1, 6)])
+
+    events, _ = queue.read_events(job_id, after_id=1)
+    assert [event_id for event_id, _ in events] == [3, 4, 5]
+
+
+def test_queue_full():
+    queue = MemoryJobQueue(max_depth=1)
+    queue.enqueue({})
+    with pytest.raises(JobQueueFull):
+        queue.enqueue({})
+
+
+def test_worker_pool_finishes_failed_jobs():
+    queue = MemoryJobQueue()
+
+    def handler(payload, publish):
+        publish({'type': 'step_start', 'step': 1})
+        if payload.get('fail'):
+            raise RuntimeError('model unavailable')
+
+    pool = JobWorkerPool(queue, handler, workers=1)
+    pool.start()
+    try:
+        failed = queue.enqueue({'fail': True})
+        silent = queue.enqueue({})
+        for job_id in (failed, silent):
+            events, finished = queue.read_events(job_id, after_id=1, timeout=5)
+            assert finished
+            assert events[-1][1]['type'] == 'error'
+    finally:
+        pool.stop(timeout=5)
+
+    assert queue.status(failed)['status'] == 'error'
+    assert pool.stats()['failed'] == 2
+
+
+def test_event_stream_resumed_at_last_event_ends():
+    # Imported here: the server builds its agents and stores at import
+    import api_server
+
+    job_id = finished_job(api_server.job_queue, [{'type': 'step_start', 'step': 1}, {'type': 'complete'}])
+    client = api_server.app.test_client()
+
+    response = client.get(f'/api/jobs/{job_id}/events', headers={'Last-Event-ID': '2'})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == ''
+
+    response = client.get(f'/api/jobs/{job_id}/events?last_event_id=1')
+    assert response.get_data(as_text=True) == 'id: 2\ndata: {"type": "complete"}\n\n'
+
+
+def test_incomplete_backend_fails_on_construction():
+    class EnqueueOnlyQueue(JobQueue):
+        def enqueue(self, payload):
+            return "job"
+
+    with pytest.raises(TypeError):
+        EnqueueOnlyQueue()
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest.mark.parametrize("path", ['/api/jobs', '/api/diagnose'])
+def test_full_queue_answers_429(path, monkeypatch, tmp_path):
+    import api_server
+
+    store = UploadStore(str(tmp_path))
+    monkeypatch.setattr(api_server, "upload_store", store)
+    monkeypatch.setattr(api_server, "job_queue", MemoryJobQueue(max_depth=0))
+    client = api_server.app.test_client()
+
+    response = client.post(path, data={'condition': 'cough', 'image': (io.BytesIO(PNG), 'scan.png')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(api_server.JOB_RETRY_AFTER)
+    assert 'retry later' in response.get_data(as_text=True)
+    # The rejected job's image reference is freed
+    assert store.stats()['active_images'] == 0
+
+
+class FakeRedis:
+    """The redis-py calls RedisJobQueue makes, with key TTLs recorded instead of applied"""
+
+    def __init__(self):
+        self.hashes, self.lists, self.ttls = {}, {}, {}
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    def brpop(self, key, timeout=0):
+        items = self.lists.get(key)
+        return (key, items.pop()) if items else None
+
+    def ltrim(self, key, start, end):
+        items = self.lists.get(key, [])
+        self.lists[key] = items[start:] if end == -1 else items[start:end + 1]
+
+    def lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hincrby(self, key, field, amount):
+        job = self.hashes.setdefault(key, {})
+        job[field] = str(int(job.get(field, 0)) + amount)
+        return int(job[field])
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+
+def test_redis_job_keys_always_expire():
+    client = FakeRedis()
+    queue = RedisJobQueue(client, prefix="test", retention=60, unfinished_ttl=600)
+
+    job_id = queue.enqueue({'condition': 'cough'})
+    # Set before any worker touches the job, so a lost job still expires
+    assert client.ttls == {f"test:job:{job_id}": 600}
+
+    assert queue.dequeue(timeout=0) == (job_id, {'condition': 'cough'})
+    queue.publish(job_id, {'type': 'step_start', 'step': 1})
+    assert client.ttls == {f"test:job:{job_id}": 600, f"test:events:{job_id}": 600}
+
+    queue.publish(job_id, {'type': 'complete'})
+    assert client.ttls == {f"test:job:{job_id}": 60, f"test:events:{job_id}": 60}
+    assert queue.read_events(job_id, 1) == ([(2, {'type': 'complete'})], True)
@@ -0,0 +1,81 @@
+"""
+Tests for extracting JSON objects from streamed LLM responses
+"""
+
+import random
+
+import pytest
+
+from agents.json_stream import JsonStreamParser, parse_json_response
+
+OBJECT = '{"diagnosis": "Pneumonia", "confidence": "high", "tests": ["CBC", "CRP"], "reasoning": "Fever, \\"crackles\\" {right}"}'
+EXPECTED = {
+    "diagnosis": "Pneumonia",
+    "confidence": "high",
+    "tests": ["CBC", "CRP"],
+    "reasoning": 'Fever, "crackles" {right}'
+}
+
+
+@pytest.mark.parametrize("text", [
+    OBJECT,
+    "```json\n" + OBJECT + "\n```",
+    "```\n" + OBJECT + "\n```",
+    "Here is the assessment:\n\n" + OBJECT + "\n\nLet me know if you need more detail.",
+    "Sure! ```json\n" + OBJECT + "\n``` Hope this helps {not json}",
+])
+def test_wrapped_responses(text):
+    assert parse_json_response(text, agent="test") == EXPECTED
+
+
+@pytest.mark.parametrize("text", [
+    OBJECT,
+    "```json\n" + OBJECT + "\n```",
+    "Here is the assessment: " + OBJECT + " Thanks.",
+])
+def test_any_chunking_gives_same_fields(text):
+    rng = random.Random(7)
+    for _ in range(50):
+        parser = JsonStreamParser()
+        completed = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 12)
+            completed.extend(parser.feed(text[pos:pos + size]))
+            pos += size
+
+        assert parser.complete
+        assert parser.result() == EXPECTED
+        assert completed == list(EXPECTED.items())
+
+
+def test_fields_are_reported_as_they_finish():
+    parser = JsonStreamParser()
+
+    assert parser.feed('```json\n{"diagnosis": "Car') == []
+    assert parser.feed('ies", "confidence": 0.9') == [("diagnosis", "Caries")]
+    # A number only ends at the next delimiter
+    assert parser.feed(', "reasoning": "deep cav') == [("confidence", 0.9)]
+    assert parser.feed('ity"}\n```') == [("reasoning", "deep cavity")]
+    assert parser.surrounded
+
+
+def test_unwrapped_object_is_not_surrounded():
+    parser = JsonStreamParser()
+    parser.feed("  " + OBJECT + "\n")
+    assert parser.result() == EXPECTED
+    assert not parser.surrounded
+
+
+@pytest.mark.parametrize("text, message", [
+    ("I cannot determine a diagnosis from this image.", "no JSON object"),
+    ('```json\n{"diagnosis": "Pneumonia", "confidence": ', "incomplete"),
+])
+def test_missing_or_truncated_object(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_json_response(text, agent="test")
+
+
+def test_malformed_object_fails_on_result():
+    with pytest.raises(ValueError):
+        parse_json_response('{"diagnosis": Pneumonia}', agent="test")
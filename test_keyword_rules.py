@@ -0,0 +1,155 @@
+"""
+Tests for the keyword rule engine behind the agents' mock responses
+"""
+
+import json
+import random
+
+import pytest
+
+from agents.detection import ImageDetectionAgent
+from agents.diagnostic_chest import ChestXrayDiagnosticAgent
+from agents.diagnostic_dental import DentalDiagnosticAgent
+from agents.diagnostic_generic import GenericDiagnosticAgent
+from agents.followup import FollowUpAgent
+from agents.keyword_rules import DEFAULT_RULES_PATH, KeywordRules, get_keyword_rules
+from agents.reasoning import ReasoningAgent
+from agents.treatment import TreatmentAgent
+
+# Answers of the hand-written keyword mocks the rules file replaced
+DETECTION_CASES = [
+    ("dental_xray.png", "", "dental"),
+    ("scan.png", "Severe tooth pain for 3 days", "dental"),
+    ("scan.png", "bleeding gums", "dental"),
+    ("chest_xray.png", "cough", "chest_xray"),
+    ("scan.png", "Shortness of breath and coughing", "chest_xray"),
+    ("brain_mri.png", "", "brain_scan"),
+    ("scan.png", "Severe headache for 2 weeks", "brain_scan"),
+    ("scan.png", "Suspicious mole on back", "skin"),
+    ("wrist.png", "Wrist fracture after a fall", "other"),
+    ("IMG_001.jpg", "", "other"),
+    ("lung_ct.png", "tooth pain", "dental"),
+    ("HEAD_ct.png", "rash", "brain_scan"),
+    ("skin_rash.png", "chest pain", "chest_xray"),
+]
+
+FINDINGS_CASES = [
+    ("chest", "Severe chest pain for 3 days", "Chest X-ray shows clear lung fields"),
+    ("chest", "Cough and fever for 1 week", "Bilateral interstitial infiltrates"),
+    ("chest", "Pneumonia suspected", "Bilateral interstitial infiltrates"),
+    ("chest", "Shortness of breath", "Bilateral lung hyperinflation"),
+    ("chest", "PAIN when breathing", "Chest X-ray shows clear lung fields"),
+    ("chest", "swelling in jaw", "Bilateral perihilar haziness"),
+    ("chest", "feeling tired", "Chest X-ray demonstrates increased interstitial"),
+    ("dental", "Severe tooth pain", "Possible dental caries (cavity)"),
+    ("dental", "Wisdom tooth pain", "Possible dental caries (cavity)"),
+    ("dental", "Bleeding gums when brushing", "Evidence of periodontal disease"),
+    ("dental", "swelling in jaw", "Periapical abscess detected"),
+    ("dental", "Cough and fever for 1 week", "Possible cavity detected"),
+    ("brain_scan", "Severe headache for 2 weeks", "Brain CT scan shows no acute"),
+    ("brain_scan", "Dizziness", "Brain imaging reveals normal brain parenchyma"),
+    ("skin", "Suspicious mole on back", "Dermatoscopic examination reveals asymmetric"),
+    ("skin", "itchy rash", "Clinical photograph shows erythematous"),
+    ("skin", "swelling", "Skin examination shows benign-appearing"),
+    ("bone_xray", "Wrist pain after fall", "X-ray demonstrates oblique fracture"),
+    ("bone_xray", "swelling", "Skeletal radiograph shows intact bony"),
+    ("eye", "blurry vision", "Medical imaging of arm reviewed."),
+]
+
+DIAGNOSIS_CASES = [
+    # finding or diagnosis, reasoning diagnosis, treatment, follow-up
+    ("Possible fracture of the distal radius", "Possible bone fracture",
+     "Immobilization and rest recommended.", "Follow up with orthopedic specialist"),
+    ("Tooth decay", "Dental caries (early stage)",
+     "Specialist consultation recommended", "Specialist consultation recommended"),
+    ("Dental caries on upper molar", "Condition requiring specialist evaluation",
+     "Dental filling recommended", "Schedule dental check-up within 7 days"),
+    ("Pneumonia", "Condition requiring specialist evaluation",
+     "Specialist consultation recommended", "Specialist consultation recommended"),
+]
+
+
+def bare(agent_class):
+    """Agent with its keyword rules but no LLM client"""
+    agent = agent_class.__new__(agent_class)
+    agent.rules = get_keyword_rules()
+    return agent
+
+
+@pytest.mark.parametrize("filename, condition, image_type", DETECTION_CASES)
+def test_detection_matches_old_mock(filename, condition, image_type):
+    assert bare(ImageDetectionAgent)._mock_detection(filename, condition)["image_type"] == image_type
+
+
+@pytest.mark.parametrize("kind, condition, findings", FINDINGS_CASES)
+def test_findings_match_old_mock(kind, condition, findings):
+    if kind == "chest":
+        result = bare(ChestXrayDiagnosticAgent)._mock_analysis(condition)
+    elif kind == "dental":
+        result = bare(DentalDiagnosticAgent)._mock_analysis(condition)
+    else:
+        result = bare(GenericDiagnosticAgent)._mock_analysis(condition, kind, "arm")
+    assert result.startswith(findings)
+
+
+@pytest.mark.parametrize("text, diagnosis, treatment, follow_up", DIAGNOSIS_CASES)
+def test_diagnosis_chain_matches_old_mock(text, diagnosis, treatment, follow_up):
+    assert bare(ReasoningAgent)._mock_diagnosis(text, "")["diagnosis"] == diagnosis
+    assert bare(TreatmentAgent)._mock_treatment(text)["treatment"].startswith(treatment)
+    assert bare(FollowUpAgent)._mock_followup(text)["follow_up"].startswith(follow_up)
+
+
+def reference_match(tables, table, **fields):
+    """The rules file's documented semantics, evaluated the slow way"""
+    rules = sorted(enumerate(tables[table]["rules"]), key=lambda r: (-r[1].get("priority", 0), r[0]))
+    for _, rule in rules:
+        for field, words in rule["match"].items():
+            text = (fields.get(field) or "").lower()
+            if any(word.lower() in text for word in words):
+                return rule["result"]
+    return tables[table].get("default")
+
+
+def test_compiled_rules_match_reference():
+    with open(DEFAULT_RULES_PATH, encoding="utf-8") as f:
+        tables = json.load(f)
+    rules = KeywordRules(tables)
+
+    words = sorted({w for t in tables.values() for r in t["rules"] for ws in r["match"].values() for w in ws})
+    words += ["HEAD", "Tooth", "the", "ache", "pain ", "x"]
+    rng = random.Random(25)
+
+    def text():
+        return " ".join(rng.choice(words) + rng.choice(["", "s", "ing"]) for _ in range(rng.randint(0, 5)))
+
+    for _ in range(2000):
+        for table, table_rules in tables.items():
+            fields = {field: text() for rule in table_rules["rules"] for field in rule["match"]}
+            assert rules.match(table, **fields) == reference_match(tables, table, **fields)
+
+
+def test_keywords_inside_other_keywords():
+    rules = KeywordRules({"t": {"rules": [
+        {"match": {"c": ["headache"]}, "result": "headache"},
+        {"match": {"c": ["head"]}, "result": "head", "priority": 1},
+        {"match": {"c": ["ache"]}, "result": "ache", "priority": 2},
+    ], "default": None}})
+
+    # "head" and "ache" both occur inside "headache" and outrank it
+    assert rules.match("t", c="Severe HEADACHE") == "ache"
+    assert rules.match("t", c="head injury") == "head"
+    assert rules.match("t", c="back pain") is None
+
+
+def test_results_are_copies():
+    rules = get_keyword_rules()
+    result = rules.match("treatment", diagnosis="dental caries")
+    result["precautions"].append("changed")
+    assert "changed" not in rules.match("treatment", diagnosis="dental caries")["precautions"]
+
+
+def test_malformed_rules_are_rejected():
+    with pytest.raises(ValueError):
+        KeywordRules({"t": {"rules": [{"match": {"c": "cough"}, "result": 1}]}})
+    with pytest.raises(ValueError):
+        KeywordRules({"t": {"rules": [{"match": {"c": ["cough"]}}]}})
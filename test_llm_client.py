@@ -0,0 +1,108 @@
+"""
+Tests for the LLM client's JSON completions and response caching, against
+a fake OpenAI client
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from agents import llm_client
+from agents.response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "Patient reports a cough"}]
+
+
+class FakeCompletions:
+    """Answers chat.completions.create() with queued replies, one per call"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        content = self.replies.pop(0)
+        if kwargs.get("stream"):
+            return self._stream(content)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    @staticmethod
+    async def _stream(content):
+        for i in range(0, len(content), 7):
+            delta = SimpleNamespace(content=content[i:i + 7])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Route the client to a FakeCompletions and a fresh memory-only cache"""
+    cache = ResponseCache()
+    state = SimpleNamespace(cache=cache, completions=None)
+
+    def client():
+        return SimpleNamespace(base_url="http://llm.test/", chat=SimpleNamespace(completions=state.completions))
+
+    def replies(*texts):
+        state.completions = FakeCompletions(texts)
+        return state.completions
+
+    monkeypatch.setattr(llm_client, "get_async_client", client)
+    monkeypatch.setattr(llm_client, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(llm_client, "get_rate_limiter", lambda provider: None)
+    state.replies = replies
+    return state
+
+
+def complete_json(**kwargs):
+    return asyncio.run(llm_client.acomplete_json("model", MESSAGES, 0.3, 200, policy="reasoning", **kwargs))
+
+
+def test_valid_reply_is_cached(fake_llm):
+    completions = fake_llm.replies('{"diagnosis": "Bronchitis", "confidence": "high"}')
+
+    first = complete_json(required=("diagnosis",))
+    second = complete_json(required=("diagnosis",))
+
+    assert first == second == {"diagnosis": "Bronchitis", "confidence": "high"}
+    assert completions.calls == 1
+
+
+def test_unparseable_reply_is_not_cached(fake_llm):
+    completions = fake_llm.replies("I cannot help with that.", '{"diagnosis": "Bronchitis"}')
+
+    with pytest.raises(ValueError):
+        complete_json()
+    assert complete_json() == {"diagnosis": "Bronchitis"}
+    assert completions.calls == 2
+
+
+def test_reply_missing_required_field_is_not_cached(fake_llm):
+    completions = fake_llm.replies('{"confidence": "low"}', '{"diagnosis": "Asthma"}')
+
+    with pytest.raises(ValueError, match="diagnosis"):
+        complete_json(required=("diagnosis",))
+    assert complete_json(required=("diagnosis",)) == {"diagnosis": "Asthma"}
+    assert completions.calls == 2
+
+
+def test_invalid_cached_reply_is_requested_again(fake_llm):
+    key = fake_llm.cache.make_key("model", MESSAGES, 0.3, 200)
+    fake_llm.cache.set(key, "```json\n{\"diagnosis\": \"\"}\n```")
+    completions = fake_llm.replies('{"diagnosis": "Pneumonia"}')
+
+    assert complete_json(required=("diagnosis",)) == {"diagnosis": "Pneumonia"}
+    assert fake_llm.cache.get(key) == '{"diagnosis": "Pneumonia"}'
+    assert completions.calls == 1
+
+
+def test_streamed_fields_are_reported(fake_llm):
+    fake_llm.replies('Here you go:\n```json\n{"diagnosis": "Caries", "confidence": "high"}\n```')
+    fields = []
+
+    result = complete_json(on_field=lambda key, value: fields.append((key, value)))
+
+    assert result == {"diagnosis": "Caries", "confidence": "high"}
+    assert fields == [("diagnosis", "Caries"), ("confidence", "high")]
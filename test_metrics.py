@@ -0,0 +1,69 @@
+"""
+Tests for the Prometheus exposition of pipeline and LLM metrics
+"""
+
+from agents.metrics import MetricsRegistry, metrics
+
+
+def sample_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name) and not line.startswith("#")]
+
+
+def test_histogram_exposition():
+    registry = MetricsRegistry()
+    for seconds in (0.03, 0.2, 0.2, 7.0, 120.0):
+        registry.observe("pipeline_stage_seconds", seconds, stage="reasoning")
+
+    text = registry.render_prometheus()
+    assert "# HELP pipeline_stage_seconds Pipeline stage duration in seconds\n" in text
+    assert "# TYPE pipeline_stage_seconds histogram\n" in text
+
+    lines = sample_lines(text, "pipeline_stage_seconds")
+    buckets = {line.split('le="')[1].split('"')[0]: int(line.split()[-1]) for line in lines if "_bucket" in line}
+    assert buckets["0.05"] == 1
+    assert buckets["0.25"] == 3
+    assert buckets["5.0"] == 3
+    assert buckets["10.0"] == 4
+    assert buckets["+Inf"] == 5
+    # Cumulative: never decreasing
+    assert list(buckets.values()) == sorted(buckets.values())
+    assert 'pipeline_stage_seconds_bucket{stage="reasoning",le="0.05"} 1' in lines
+    assert 'pipeline_stage_seconds_sum{stage="reasoning"} 127.43' in lines
+    assert 'pipeline_stage_seconds_count{stage="reasoning"} 5' in lines
+
+
+def test_counter_exposition_and_label_escaping():
+    registry = MetricsRegistry()
+    registry.inc("llm_errors_total", policy="default")
+    registry.inc("llm_errors_total", policy="default")
+    registry.inc("llm_errors_total", policy='say "hi"\\\nbye')
+    registry.inc("llm_tokens_total", 1.5, kind="prompt")
+
+    text = registry.render_prometheus()
+    assert "# TYPE llm_errors_total counter\n" in text
+    assert text.count("# TYPE llm_errors_total counter") == 1
+    assert 'llm_errors_total{policy="default"} 2' in text.splitlines()
+    assert 'llm_errors_total{policy="say \\"hi\\"\\\\\\nbye"} 1' in text.splitlines()
+    assert 'llm_tokens_total{kind="prompt"} 1.5' in text.splitlines()
+    assert text.endswith("\n")
+
+
+def test_unknown_metric_gets_generic_help():
+    registry = MetricsRegistry()
+    registry.inc("custom_total")
+    text = registry.render_prometheus()
+    assert "# HELP custom_total custom_total\n# TYPE custom_total counter\ncustom_total 1\n" in text
+
+
+def test_metrics_endpoint():
+    import api_server
+
+    metrics.inc("agent_fallbacks_total", agent="test_metrics_endpoint")
+    response = api_server.app.test_client().get('/api/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+    assert "# TYPE agent_fallbacks_total counter" in body
+    assert 'agent_fallbacks_total{agent="test_metrics_endpoint"} 1' in body
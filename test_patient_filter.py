@@ -0,0 +1,136 @@
+"""
+Tests for patient listing filters and pagination
+"""
+
+import pytest
+
+import manage_db
+from agents.patient_store import CSVPatientStore, PatientFilter, SQLitePatientStore
+
+TODAY = "2024-01-10"
+
+EMAILS = [
+    "alice@example.com", "Bob@Example.com", "a_b@example.com", "axb@example.com",
+    "100%@example.com", "1000@example.com", "back\\slash@example.com", "backslash@example.com",
+]
+
+
+def records():
+    result = []
+    for index in range(40):
+        result.append({
+            'patient_id': f"PT{index:026d}",
+            'email': EMAILS[index % len(EMAILS)],
+            'condition': 'cough',
+            'follow_up_date': "2024-01-%02d" % (5 + index % 10),
+            'email_sent': 'Yes' if index % 3 == 0 else 'No',
+        })
+    return result
+
+
+@pytest.fixture(scope="module")
+def stores(tmp_path_factory):
+    path = tmp_path_factory.mktemp("stores")
+    sqlite_store = SQLitePatientStore(path / "patients.db")
+    csv_store = CSVPatientStore(path / "patients_db.csv")
+    for record in records():
+        sqlite_store.add(record)
+        csv_store.add(record)
+    yield sqlite_store, csv_store
+    sqlite_store.close()
+
+
+def ids(patients):
+    return [patient['patient_id'] for patient in patients]
+
+
+FILTERS = [
+    PatientFilter(),
+    PatientFilter(date_from="2024-01-08"),
+    PatientFilter(date_to="2024-01-08"),
+    PatientFilter(date_from="2024-01-07", date_to="2024-01-07"),
+    PatientFilter(status="sent"),
+    PatientFilter(status="pending"),
+    PatientFilter(status="overdue", today=TODAY),
+    PatientFilter(email="EXAMPLE.COM"),
+    PatientFilter(email="bob"),
+    PatientFilter(email="a_b"),
+    PatientFilter(email="100%"),
+    PatientFilter(email="back\\"),
+    PatientFilter(date_from="2024-01-06", status="pending", email="a", today=TODAY),
+]
+
+
+@pytest.mark.parametrize("patient_filter", FILTERS)
+def test_sql_and_matches_agree(stores, patient_filter):
+    expected = ids(record for record in records() if patient_filter.matches(record))
+    for store in stores:
+        assert ids(store.find(patient_filter, limit=100)) == expected
+        assert store.count(patient_filter) == len(expected)
+
+
+@pytest.mark.parametrize("email, expected", [
+    # LIKE wildcards in the search text are matched literally
+    ("a_b", ["a_b@example.com"]),
+    ("100%", ["100%@example.com"]),
+    ("back\\", ["back\\slash@example.com"]),
+    ("bob@", ["Bob@Example.com"]),
+])
+def test_email_wildcards_are_literal(stores, email, expected):
+    for store in stores:
+        found = {patient['email'] for patient in store.find(PatientFilter(email=email), limit=100)}
+        assert sorted(found) == expected
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 40, 50])
+def test_pages_cover_every_match_once(stores, limit):
+    patient_filter = PatientFilter(status="pending")
+    expected = ids(record for record in records() if patient_filter.matches(record))
+    for store in stores:
+        pages = [store.find(patient_filter, limit=limit, offset=offset)
+                 for offset in range(0, len(expected), limit)]
+        assert ids(patient for page in pages for patient in page) == expected
+        assert all(len(page) == limit for page in pages[:-1])
+        assert store.find(patient_filter, limit=limit, offset=len(expected)) == []
+
+
+def test_unknown_status_is_rejected():
+    with pytest.raises(ValueError):
+        PatientFilter(status="bounced")
+
+
+def test_due_pages_through_ties_while_marking_sent(tmp_path):
+    store = SQLitePatientStore(tmp_path / "patients.db")
+    try:
+        for record in records():
+            store.add(record)
+        expected = sorted(
+            (r for r in records() if r['email_sent'] == 'No' and r['follow_up_date'] <= TODAY),
+            key=lambda r: r['follow_up_date']
+        )
+
+        # Batches of 3 split runs of equal follow-up dates
+        seen = []
+        for patient in store.due(TODAY, batch_size=3):
+            seen.append(patient['patient_id'])
+            store.mark_sent(patient['patient_id'])
+        assert seen == ids(expected)
+        assert list(store.due(TODAY)) == []
+    finally:
+        store.close()
+
+
+def test_manage_db_listing_pages(stores, monkeypatch, capsys):
+    monkeypatch.setattr(manage_db, "get_patient_store", lambda: stores[0])
+    monkeypatch.setattr(manage_db, "database_exists", lambda: True)
+
+    manage_db.view_all_patients(page=2, limit=15)
+    out = capsys.readouterr().out
+    assert "Page 2 of 3" in out
+    assert "Showing 16-30 of 40. Next page: --page 3" in out
+
+    manage_db.view_all_patients(page=4, limit=15)
+    assert "Page 4 is past the last page (3)" in capsys.readouterr().out
+
+    manage_db.view_all_patients(patient_filter=PatientFilter(email="nobody"))
+    assert "No patients match these filters" in capsys.readouterr().out
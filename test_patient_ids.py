@@ -0,0 +1,83 @@
+"""
+Tests for ULID patient IDs
+"""
+
+import os
+import threading
+
+import pytest
+
+from agents import patient_ids
+from agents.patient_ids import PREFIX, PatientIdGenerator, is_legacy_patient_id, legacy_timestamp_ms, new_patient_id
+
+ALPHABET = set("0123456789ABCDEFGHJKMNPQRSTVWXYZ")
+
+
+def test_id_layout():
+    patient_id = new_patient_id()
+    assert patient_id.startswith(PREFIX)
+    assert len(patient_id) == len(PREFIX) + 26
+    assert set(patient_id[len(PREFIX):]) <= ALPHABET
+    assert not is_legacy_patient_id(patient_id)
+
+
+def test_ids_within_one_millisecond_increase():
+    generator = PatientIdGenerator()
+    ids = [generator.new(1_700_000_000_000) for _ in range(1000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    # Same timestamp prefix: only the random part moved
+    assert len({patient_id[:12] for patient_id in ids}) == 1
+
+
+def test_ids_sort_by_time_even_if_clock_steps_back():
+    generator = PatientIdGenerator()
+    ids = [generator.new(ms) for ms in (1_000, 2_000, 1_500, 3_000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_concurrent_ids_are_unique():
+    ids = []
+
+    def worker():
+        ids.extend(new_patient_id() for _ in range(500))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(ids)) == len(ids) == 4000
+
+
+def test_reset_draws_fresh_random_bits():
+    generator = PatientIdGenerator()
+    first = generator.new(5_000)
+    generator.reset()
+    second = generator.new(5_000)
+    # Without the reset the second ID would be the first plus one
+    assert second != first
+    assert generator.new(5_000) > second
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_does_not_continue_parent_sequence():
+    new_patient_id()
+    assert patient_ids._generator._last_ms >= 0
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if patient_ids._generator._last_ms == -1 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_legacy_ids():
+    assert is_legacy_patient_id("PT20240115093000")
+    assert not is_legacy_patient_id("PT2024")
+    assert not is_legacy_patient_id(None)
+
+    from_id = legacy_timestamp_ms({"patient_id": "PT20240115093000"})
+    from_created_at = legacy_timestamp_ms({"patient_id": "PT20240115093000", "created_at": "2024-01-15 09:30:05"})
+    assert from_created_at - from_id == 5000
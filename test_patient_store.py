@@ -0,0 +1,254 @@
+"""
+Tests for the SQLite patient store
+"""
+
+import csv
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agents.patient_ids import is_legacy_patient_id
+from agents.patient_store import PATIENT_FIELDS, PatientStore, SQLitePatientStore
+
+
+def patient(follow_up_date="2024-01-10", **fields):
+    record = {
+        'patient_id': 'PT' + uuid.uuid4().hex[:26].upper(),
+        'email': 'patient@example.com',
+        'condition': 'cough',
+        'follow_up_date': follow_up_date,
+        'email_sent': 'No',
+        'created_at': '2024-01-01 09:00:00',
+    }
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLitePatientStore(tmp_path / "patients.db")
+    yield store
+    store.close()
+
+
+def ids(records):
+    return [record['patient_id'] for record in records]
+
+
+def test_claimed_patients_are_skipped_by_other_workers(store):
+    records = [patient("2024-01-0%d" % day) for day in (3, 1, 2)]
+    store.add_many(records)
+
+    claimed = store.claim_due("2024-01-10", "a", limit=2)
+    assert ids(claimed) == [records[1]['patient_id'], records[2]['patient_id']]
+    assert ids(store.claim_due("2024-01-10", "b")) == [records[0]['patient_id']]
+    assert store.claim_due("2024-01-10", "c") == []
+    assert store.outbox_counts() == {'claimed': 3}
+
+
+def test_only_the_claim_holder_may_send(store):
+    record = patient()
+    store.add(record)
+    store.claim_due("2024-01-10", "a")
+
+    assert not store.begin_send(record['patient_id'], "b")
+    assert store.begin_send(record['patient_id'], "a")
+    # Already sending: a second begin must not send the email twice
+    assert not store.begin_send(record['patient_id'], "a")
+
+    store.finish_send(record['patient_id'], "a", sent=True, detail="250 OK")
+    assert store.get(record['patient_id'])['email_sent'] == 'Yes'
+    assert [d['status'] for d in store.deliveries(record['patient_id'])] == ['sent']
+    assert store.outbox_counts() == {'sent': 1}
+    assert store.claim_due("2024-01-10", "a") == []
+
+
+def test_expired_lease_can_be_claimed_again(store):
+    record = patient()
+    store.add(record)
+    store.claim_due("2024-01-10", "a", lease=0.05)
+    store.begin_send(record['patient_id'], "a", lease=0.05)
+
+    # Worker a died mid-send; once its lease runs out b resends
+    assert store.claim_due("2024-01-10", "b") == []
+    time.sleep(0.1)
+    assert ids(store.claim_due("2024-01-10", "b")) == [record['patient_id']]
+    assert not store.begin_send(record['patient_id'], "a")
+    assert store.begin_send(record['patient_id'], "b")
+
+
+def test_failed_send_waits_for_retry(store):
+    record = patient()
+    store.add(record)
+    store.claim_due("2024-01-10", "a")
+    store.begin_send(record['patient_id'], "a")
+    store.finish_send(record['patient_id'], "a", sent=False, detail="421 busy", retry_after=0.05)
+
+    assert store.get(record['patient_id'])['email_sent'] == 'No'
+    assert store.claim_due("2024-01-10", "a") == []
+    time.sleep(0.1)
+    assert ids(store.claim_due("2024-01-10", "a")) == [record['patient_id']]
+    assert [d['detail'] for d in store.deliveries(record['patient_id'])] == ['421 busy']
+
+
+def test_released_claims_are_free_at_once(store):
+    sending, unsent = patient(), patient()
+    store.add_many([sending, unsent])
+    store.claim_due("2024-01-10", "a")
+    store.begin_send(sending['patient_id'], "a")
+
+    store.release_claims("a")
+    # The email handed to the mail server keeps its lease
+    assert ids(store.claim_due("2024-01-10", "b")) == [unsent['patient_id']]
+
+
+def test_concurrent_adds_are_group_committed(store):
+    records = [patient() for _ in range(200)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(store.add, records))
+
+    assert len(list(store.all())) == 200
+    assert all(store.get(record['patient_id']) for record in records)
+
+
+def test_bad_record_fails_alone(store):
+    existing = patient()
+    store.add(existing)
+    records = [patient() for _ in range(20)] + [dict(existing)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(store.add, record) for record in records]
+    errors = [future.exception() for future in futures]
+
+    assert errors[-1] is not None
+    assert errors[:-1] == [None] * 20
+    assert len(list(store.all())) == 21
+
+
+def test_close_commits_queued_records(tmp_path):
+    path = tmp_path / "patients.db"
+    store = SQLitePatientStore(path)
+    records = [patient() for _ in range(5)]
+    for record in records:
+        store.add(record)
+    store.close()
+
+    reopened = SQLitePatientStore(path)
+    try:
+        assert ids(reopened.all()) == ids(records)
+    finally:
+        reopened.close()
+
+
+def write_csv(path, records):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PATIENT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def test_csv_migration_runs_once_and_keeps_old_ids(store, tmp_path):
+    kept = patient()
+    # Two registrations in the same second shared one legacy ID
+    first = patient(patient_id='PT20240101090000', created_at='2024-01-01 09:00:00')
+    second = patient(patient_id='PT20240101090000', created_at='2024-01-01 09:00:00', email='b@example.com')
+    csv_path = tmp_path / "patients_db.csv"
+    write_csv(csv_path, [kept, first, second])
+
+    assert store.migrate_csv(csv_path) == 3
+    assert store.migrated_from() == str(csv_path)
+    assert store.get(kept['patient_id'])['email'] == kept['email']
+    assert store.get('PT20240101090000')['email'] == first['email']
+    new_ids = [p['patient_id'] for p in store.all() if p['patient_id'] != kept['patient_id']]
+    assert len(set(new_ids)) == 2
+    assert not any(is_legacy_patient_id(patient_id) for patient_id in new_ids)
+
+    assert store.migrate_csv(csv_path) == 0
+    assert store.count() == 3
+
+
+def test_interrupted_csv_migration_leaves_nothing_behind(store, tmp_path, monkeypatch):
+    csv_path = tmp_path / "patients_db.csv"
+    write_csv(csv_path, [patient(), patient(patient_id='PT20240101090000')])
+    insert = store._insert
+
+    def crash_after_insert(records):
+        insert(records)
+        raise RuntimeError("killed")
+
+    monkeypatch.setattr(store, "_insert", crash_after_insert)
+    with pytest.raises(RuntimeError):
+        store.migrate_csv(csv_path)
+    assert store.count() == 0
+    assert store.migrated_from() is None
+
+    monkeypatch.undo()
+    assert store.migrate_csv(csv_path) == 2
+    assert store.get('PT20240101090000') is not None
+
+
+def full_scan_statistics(store, today, **kwargs):
+    """statistics() recomputed from every record, as backends without a summary do"""
+    return PatientStore.statistics(store, today, **kwargs)
+
+
+def test_statistics_summary_follows_every_write(store):
+    rng = random.Random(17)
+    diagnoses = ["Pneumonia", "Dental caries", "Fracture", "Migraine"]
+    records = [
+        patient("2024-01-%02d" % rng.randint(1, 28), diagnosis=rng.choice(diagnoses))
+        for _ in range(60)
+    ]
+    store.add_many(records)
+    for record in rng.sample(records, 20):
+        store.mark_sent(record['patient_id'])
+
+    # Updates and deletes from outside the store API (e.g. another tool)
+    with store._lock, store._db:
+        for record in rng.sample(records, 10):
+            store._db.execute(
+                "UPDATE patients SET follow_up_date = ?, diagnosis = ? WHERE patient_id = ?",
+                ("2024-01-%02d" % rng.randint(1, 28), rng.choice(diagnoses), record['patient_id'])
+            )
+        for record in rng.sample(records, 10):
+            store._db.execute("DELETE FROM patients WHERE patient_id = ?", (record['patient_id'],))
+
+    for today in ("2024-01-10", "2024-01-20", "2024-01-05", "2024-02-01"):
+        assert store.statistics(today, days=14, top=3) == full_scan_statistics(store, today, days=14, top=3)
+        assert store.counts(today)['overdue'] == full_scan_statistics(store, today)['overdue']
+
+
+def test_overdue_rolls_forward_lazily(store):
+    store.add_many([patient("2024-01-05"), patient("2024-01-10"), patient("2024-01-15")])
+
+    assert store.counts("2024-01-01")['overdue'] == 0
+    assert store.counts("2024-01-11") == {
+        'total': 3, 'sent': 0, 'pending': 3, 'overdue': 2, 'upcoming': 1
+    }
+    # A write after the rollover is counted against the new day
+    store.add(patient("2024-01-08"))
+    assert store.counts("2024-01-11")['overdue'] == 3
+    assert store.counts("2024-01-06")['overdue'] == 1
+
+
+def test_top_diagnoses_read_the_index(store):
+    with store._lock:
+        plan = store._db.execute(
+            "EXPLAIN QUERY PLAN SELECT diagnosis, total, sent FROM stats_diagnosis WHERE total > 0 "
+            "ORDER BY total DESC, diagnosis LIMIT 10"
+        ).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "idx_stats_diagnosis_total" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_incomplete_backend_fails_on_construction():
+    class AddOnlyStore(PatientStore):
+        def add(self, record):
+            pass
+
+    with pytest.raises(TypeError):
+        AddOnlyStore()
@@ -0,0 +1,297 @@
+"""
+Tests for the diagnostic pipeline: the stage executor, the analysis cache
+and speculative treatment
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agents import pipeline
+from agents.llm_client import note_mock_response
+from agents.response_cache import ResponseCache
+
+DIGEST = "ab" * 32
+
+
+def recording_stage(name, inputs=(), seconds=0.0, log=None, step=None, error=None):
+    """Stage that logs when it starts and ends and returns the names of its inputs"""
+    async def func(**kwargs):
+        log.append(("start", name))
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        log.append(("end", name))
+        return f"{name}({','.join(str(kwargs[dep]) for dep in inputs)})"
+    return pipeline.Stage(name, func, inputs, step=step)
+
+
+def test_stages_run_in_dependency_order():
+    log = []
+    executor = pipeline.PipelineExecutor([
+        recording_stage("c", ("b",), log=log, step=3),
+        recording_stage("b", ("a", "x"), log=log, step=2),
+        recording_stage("a", ("x",), log=log, step=1),
+    ])
+    events = []
+
+    results = asyncio.run(executor.arun({"x": 1}, on_event=events.append))
+
+    assert results == {"c": "c(b(a(1),1))", "b": "b(a(1),1)", "a": "a(1)"}
+    assert log == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+    assert [(e["type"], e["step"]) for e in events] == [
+        ("step_start", 1), ("step_complete", 1), ("step_start", 2),
+        ("step_complete", 2), ("step_start", 3), ("step_complete", 3)
+    ]
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    executor = pipeline.PipelineExecutor([
+        recording_stage("left", ("x",), seconds=0.1, log=log),
+        recording_stage("right", ("x",), seconds=0.1, log=log),
+        recording_stage("join", ("left", "right"), log=log),
+    ])
+
+    start = time.perf_counter()
+    results = asyncio.run(executor.arun({"x": 1}))
+
+    assert time.perf_counter() - start < 0.18
+    assert results["join"] == "join(left(1),right(1))"
+    assert log[:2] == [("start", "left"), ("start", "right")]
+
+
+def test_stage_error_cancels_running_stages():
+    log = []
+    cancelled = []
+
+    async def slow(x):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    executor = pipeline.PipelineExecutor([
+        pipeline.Stage("slow", slow, ("x",)),
+        recording_stage("bad", ("x",), seconds=0.01, log=log, error=ValueError("no findings")),
+        recording_stage("after", ("bad",), log=log),
+    ])
+
+    async def main():
+        with pytest.raises(ValueError, match="no findings"):
+            await executor.arun({"x": 1})
+        await asyncio.sleep(0)
+        assert cancelled == ["slow"]
+
+    asyncio.run(main())
+    assert ("start", "after") not in log
+
+
+@pytest.mark.parametrize("stages, context, message", [
+    ([("a", ("b",)), ("b", ("a",))], {}, "cycle"),
+    ([("a", ()), ("a", ())], {}, "unique"),
+    ([("a", ("missing",))], {}, "not provided"),
+])
+def test_invalid_graphs_are_rejected(stages, context, message):
+    log = []
+    with pytest.raises(ValueError, match=message):
+        executor = pipeline.PipelineExecutor([recording_stage(name, inputs, log=log) for name, inputs in stages])
+        asyncio.run(executor.arun(context))
+
+
+@pytest.fixture
+def analysis_cache(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(pipeline, "get_analysis_cache", lambda: cache)
+    return cache
+
+
+def run_twice(compute):
+    async def main():
+        first = await pipeline.cached_analysis("detection", DIGEST, {"condition": "cough"}, compute)
+        second = await pipeline.cached_analysis("detection", DIGEST, {"condition": "cough"}, compute)
+        return first, second
+    return asyncio.run(main())
+
+
+def test_model_result_is_cached(analysis_cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"image_type": "chest_xray", "confidence": "high"}
+
+    first, second = run_twice(compute)
+    assert first == second == {"image_type": "chest_xray", "confidence": "high"}
+    assert len(calls) == 1
+
+
+def test_mock_result_is_not_cached(analysis_cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0)
+        note_mock_response("detection")
+        return {"image_type": "other", "confidence": "low"}
+
+    first, second = run_twice(compute)
+    assert first == second
+    assert len(calls) == 2
+    assert analysis_cache.stats()["memory_entries"] == 0
+
+
+def test_concurrent_callers_share_one_analysis(analysis_cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"findings": "Clear lung fields"}
+
+    async def main():
+        return await asyncio.gather(*(
+            pipeline.cached_analysis("diagnostic", DIGEST, {}, compute) for _ in range(3)
+        ))
+
+    assert asyncio.run(main()) == [{"findings": "Clear lung fields"}] * 3
+    assert len(calls) == 1
+
+
+class StubReasoning:
+    """Streams its diagnosis and confidence, then takes a while on the explanation"""
+
+    def __init__(self, explain_seconds=0.05):
+        self.explain_seconds = explain_seconds
+
+    async def aprocess(self, finding, condition, on_field=None):
+        result = {"diagnosis": "Dental caries", "confidence": "high", "reasoning": "Visible cavity"}
+        for key in ("diagnosis", "confidence"):
+            if on_field is not None:
+                on_field(key, result[key])
+            await asyncio.sleep(0)
+        await asyncio.sleep(self.explain_seconds)
+        return result
+
+    def validate_output(self, output):
+        return True
+
+
+class StubTreatment:
+    """Records when its calls start and whether they were cancelled"""
+
+    def __init__(self, seconds=0.01):
+        self.seconds = seconds
+        self.started = []
+        self.cancelled = 0
+
+    async def aprocess(self, reasoning):
+        self.started.append(dict(reasoning))
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"treatment": "Filling", "precautions": []}
+
+    def validate_output(self, output):
+        return True
+
+
+class StubFollowup:
+    def __init__(self):
+        self.planned_with = []
+
+    async def aplan(self, reasoning, treatment=None):
+        self.planned_with.append(treatment)
+        return {"follow_up": "Recheck in 2 weeks"}
+
+    def register(self, plan, treatment, reasoning, patient_email=None, condition=None):
+        return plan
+
+    def validate_output(self, output):
+        return True
+
+
+def stub_agents(reasoning=None, treatment=None):
+    async def detect(image_path, condition):
+        return {"image_type": "dental", "confidence": "high"}
+
+    async def analyze(image_path, condition, detection):
+        return {"findings": "Cavity on upper molar", "agent_used": "Dental Diagnostic Agent"}
+
+    return SimpleNamespace(
+        detection_agent=SimpleNamespace(adetect_image_type=detect),
+        diagnostic_router=SimpleNamespace(aroute_and_analyze=analyze),
+        reasoning_agent=reasoning or StubReasoning(),
+        treatment_agent=treatment or StubTreatment(),
+        followup_agent=StubFollowup()
+    )
+
+
+CONTEXT = {"image_path": "dental.png", "condition": "tooth pain", "patient_email": None, "image_digest": None}
+
+
+def test_confirmed_speculation_is_used():
+    agents = stub_agents()
+    executor = pipeline.build_diagnostic_pipeline(agents, speculative_treatment=True)
+
+    results = asyncio.run(executor.arun(dict(CONTEXT)))
+
+    assert results["treatment"]["treatment"] == "Filling"
+    assert agents.treatment_agent.started == [{"diagnosis": "Dental caries", "confidence": "high"}]
+
+
+def test_speculation_cancelled_with_reasoning():
+    agents = stub_agents(reasoning=StubReasoning(explain_seconds=5), treatment=StubTreatment(seconds=5))
+    executor = pipeline.build_diagnostic_pipeline(agents, speculative_treatment=True)
+
+    async def main():
+        run = asyncio.ensure_future(executor.arun(dict(CONTEXT)))
+        while not agents.treatment_agent.started:
+            await asyncio.sleep(0.01)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        await asyncio.sleep(0.01)
+        # Checked before asyncio.run() cancels whatever is left over
+        assert agents.treatment_agent.cancelled == 1
+
+    asyncio.run(main())
+
+
+def test_speculation_cancelled_when_run_ends_before_treatment():
+    agents = stub_agents(treatment=StubTreatment(seconds=5))
+    executor = pipeline.build_diagnostic_pipeline(agents, speculative_treatment=True)
+
+    async def main():
+        events = executor.astream(dict(CONTEXT))
+        async for event in events:
+            if event["type"] == "step_complete" and event["stage"] == "reasoning":
+                break
+        # The consumer went away before the treatment stage started
+        await events.aclose()
+        await asyncio.sleep(0.01)
+        assert len(agents.treatment_agent.started) == 1
+        assert agents.treatment_agent.cancelled == 1
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("early_followup", [False, True])
+def test_early_followup_plans_alongside_treatment(early_followup):
+    agents = stub_agents(treatment=StubTreatment(seconds=0.05))
+    executor = pipeline.build_diagnostic_pipeline(agents, early_followup=early_followup)
+    events = []
+
+    results = asyncio.run(executor.arun(dict(CONTEXT), on_event=events.append))
+
+    order = [(e["type"], e["stage"]) for e in events]
+    plan_start = order.index(("step_start", "followup_plan"))
+    treatment_done = order.index(("step_complete", "treatment"))
+    assert (plan_start < treatment_done) == early_followup
+    assert agents.followup_agent.planned_with == [None if early_followup else results["treatment"]]
+    assert results["followup"] == {"follow_up": "Recheck in 2 weeks"}
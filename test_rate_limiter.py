@@ -0,0 +1,123 @@
+"""
+Tests for the provider rate limiter
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from agents.rate_limiter import AdaptiveConcurrency, ProviderRateLimiter, TokenBucket, retry_after_seconds
+
+
+def test_bucket_reservations_queue_up():
+    bucket = TokenBucket(60, capacity=2)
+
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    # Empty: each further request waits one more second (1 token per second)
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve(1) == pytest.approx(2.0, abs=0.05)
+
+
+def test_bucket_refund_and_drain():
+    bucket = TokenBucket(6000, capacity=100)
+    bucket.reserve(100)
+    bucket.refund(40)
+    assert bucket.reserve(40) == 0
+
+    bucket.drain()
+    assert bucket.reserve(10) > 0
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(0)
+    assert all(bucket.reserve(1000) == 0 for _ in range(10))
+
+
+def test_aimd_limit():
+    concurrency = AdaptiveConcurrency(initial=8, minimum=1, maximum=8)
+
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    assert concurrency.limit == 1
+
+    # One more slot per full window of successes
+    for expected in (2, 3):
+        for _ in range(concurrency.limit):
+            concurrency.on_success()
+        assert concurrency.limit == expected
+
+
+def test_waiters_get_slots_in_order():
+    concurrency = AdaptiveConcurrency(initial=1)
+    order = []
+
+    async def call(name):
+        await concurrency.acquire()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        concurrency.release()
+
+    async def main():
+        await asyncio.gather(*(call(n) for n in range(4)))
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3]
+    assert concurrency.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    concurrency = AdaptiveConcurrency(initial=1)
+
+    async def main():
+        await concurrency.acquire()
+        waiter = asyncio.ensure_future(concurrency.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        concurrency.release()
+
+    asyncio.run(main())
+    assert concurrency.in_flight == 0
+
+
+def test_throttle_episode_backs_off_once():
+    limiter = ProviderRateLimiter("test", rpm=0, tpm=0, max_concurrency=8)
+
+    # Three calls in flight all get a 429 for the same episode
+    for _ in range(3):
+        limiter.on_throttle(0.5)
+
+    stats = limiter.stats()
+    assert stats["throttled"] == 3
+    assert stats["concurrency_limit"] == 4
+
+
+def test_slot_waits_out_cooldown():
+    limiter = ProviderRateLimiter("test", rpm=0, tpm=0, max_concurrency=2)
+    limiter.on_throttle(0.05)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        async with limiter.slot(100):
+            return loop.time() - start
+
+    assert asyncio.run(main()) >= 0.04
+
+
+@pytest.mark.parametrize("headers, attempt, expected", [
+    ({"retry-after-ms": "1500"}, 0, 1.5),
+    ({"retry-after": "3"}, 0, 3.0),
+    ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 2, 4.0),
+    ({}, 3, 8.0),
+    ({"retry-after": "600"}, 0, 60.0),
+])
+def test_retry_after_seconds(headers, attempt, expected):
+    error = SimpleNamespace(response=SimpleNamespace(headers=headers))
+    assert retry_after_seconds(error, attempt) == expected
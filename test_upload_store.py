@@ -0,0 +1,66 @@
+"""
+Tests for the content-addressed upload store
+"""
+
+import os
+
+import pytest
+
+from agents.upload_store import UnsupportedImageError, UploadStore, get_upload_store
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def store_bytes(store, data, filename="scan.png"):
+    writer = store.new_writer()
+    try:
+        writer.write(data)
+    except BaseException:
+        writer.close()
+        raise
+    return store.commit(writer, filename)
+
+
+def test_identical_uploads_share_one_file(tmp_path):
+    store = UploadStore(str(tmp_path))
+
+    first = store_bytes(store, PNG)
+    second = store_bytes(store, PNG)
+
+    assert first.digest == second.digest
+    assert first.path != second.path
+    assert (first.deduplicated, second.deduplicated) == (False, True)
+    assert first.format == "png"
+
+    first.release()
+    assert os.path.exists(second.path)
+    second.release()
+    assert store.stats()["active_images"] == 0
+    assert not os.listdir(os.path.join(str(tmp_path), "blobs", first.digest[:2]))
+
+
+def test_non_image_is_rejected(tmp_path):
+    store = UploadStore(str(tmp_path))
+    with pytest.raises(UnsupportedImageError):
+        store_bytes(store, b"%PDF-1.7 not an image")
+    assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+
+
+def test_upload_over_limit_is_rejected(tmp_path):
+    store = UploadStore(str(tmp_path), max_bytes=len(PNG) - 1)
+    with pytest.raises(ValueError):
+        store_bytes(store, PNG)
+    assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+
+
+def test_configured_store_has_upload_limit(monkeypatch, tmp_path):
+    from agents import upload_store
+
+    monkeypatch.setattr(upload_store, "_store", None)
+    monkeypatch.setenv("UPLOAD_STORE_PATH", str(tmp_path))
+    monkeypatch.setenv("UPLOAD_MAX_BYTES", "1024")
+    assert get_upload_store().max_bytes == 1024
+
+    monkeypatch.setattr(upload_store, "_store", None)
+    monkeypatch.delenv("UPLOAD_MAX_BYTES")
+    assert get_upload_store().max_bytes == upload_store.DEFAULT_MAX_BYTES